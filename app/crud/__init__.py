@@ -6,9 +6,13 @@ from .common import (  # noqa F401
     create_table,
     update_entity,
     delete_entity,
+    apply_entities,
+    profile_entity,
 )
 from .labels import PredefinedLabel
+from .probes import Probe
 from .session import snowpark_session
+from .tracing import Tracer  # noqa F401
 from .wh_sched import regenerate_alter_statements  # noqa F401
 from .account import (
     sundeck_signup_with_snowflake_sso,  # noqa F401
@@ -20,3 +24,8 @@ from .account import (
 def validate_predefined_labels(sess: snowflake.snowpark.Session):
     with snowpark_session(sess) as txn:
         PredefinedLabel.validate_all(txn)
+
+
+def backtest_query_monitor(sess: snowflake.snowpark.Session, condition, start, end):
+    with snowpark_session(sess) as txn:
+        return Probe.backtest(txn, condition, start, end)
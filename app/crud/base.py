@@ -1,7 +1,27 @@
 from contextlib import contextmanager
-from snowflake.snowpark import Row
+from snowflake.snowpark import Column, Row
+from snowflake.snowpark.functions import col, when_matched, when_not_matched
+from snowflake.snowpark.types import (
+    BooleanType,
+    LongType,
+    StringType,
+    StructField,
+    StructType,
+    TimestampType,
+    TimeType,
+)
 from pydantic import BaseModel
-from typing import ClassVar, get_args, get_origin, Union, Dict, List
+from typing import (
+    Any,
+    ClassVar,
+    get_args,
+    get_origin,
+    Union,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
 import datetime
 import pandas as pd
 from enum import Enum
@@ -13,6 +33,8 @@ from enum import Enum
 class BaseOpsCenterModel(BaseModel):
     # The name of the table in snowflake (without schema) that the model maps to.
     table_name: ClassVar[str] = None
+    # Columns which are written by `batch_upsert` but not compared when deciding if an existing row has changed.
+    upsert_ignored_cols: ClassVar[List[str]] = []
 
     @classmethod
     def cols_dict(cls) -> Dict[str, str]:
@@ -39,6 +61,19 @@ class BaseOpsCenterModel(BaseModel):
                 f"CREATE OR REPLACE VIEW catalog.{cls.table_name} AS SELECT * FROM internal.{cls.table_name}"
             ).collect()
 
+    @classmethod
+    def snowpark_schema(cls) -> StructType:
+        """
+        Returns the schema of the model's table, so that DataFrames of its rows are typed even where every value is
+        None.
+        """
+        return StructType(
+            [
+                StructField(name, _SNOWPARK_TYPES[sql_type.split()[0]], nullable=True)
+                for name, sql_type in cls.cols_dict().items()
+            ]
+        )
+
     def to_row(self) -> Row:
         return Row(**dict(self))
 
@@ -71,16 +106,8 @@ class BaseOpsCenterModel(BaseModel):
     def update(self, session, obj) -> "BaseOpsCenterModel":
         cols = dict(obj)
         # Build up the SET clause and bind param values
-        set_elements = []
-        params = []
-        for k, v in cols.items():
-            # Specific versions of snowpark-python appear to have an issue handling None bind parameters
-            if v is None:
-                set_elements.append(f"{k} = NULL")
-            else:
-                set_elements.append(f"{k} = ?")
-                params.append(unwrap_value(v))
-        set_clause = ", ".join(set_elements)
+        placeholders, params = bind_values(cols)
+        set_clause = ", ".join(f"{k} = {p}" for k, p in zip(cols.keys(), placeholders))
         params.append(self.get_id())
         stmt = f"UPDATE INTERNAL.{self.table_name} SET {set_clause} WHERE {self.get_id_col()} = ?"
         session.sql(
@@ -105,34 +132,172 @@ class BaseOpsCenterModel(BaseModel):
             column_order="name",
         )
 
+    @classmethod
+    def batch_upsert(cls, session, data: List["BaseOpsCenterModel"]) -> Dict[str, int]:
+        """
+        Inserts or updates a list of objects with a single MERGE keyed on `get_id_col()`. Existing rows are only
+        updated when at least one column differs, so unchanged rows are not rewritten.
+        :param session:
+        :param data:
+        :return: A dict with the number of rows which were inserted, updated and unchanged.
+        """
+        if not data:
+            return dict(inserted=0, updated=0, unchanged=0)
+
+        id_col = data[0].get_id_col()
+        cols = list(cls.__fields__.keys())
+        source = session.create_dataframe(
+            [d.to_row() for d in data], schema=cls.snowpark_schema()
+        )
+        target = session.table(f"INTERNAL.{cls.table_name}")
+
+        changed = None
+        for c in cols:
+            if c == id_col or c in cls.upsert_ignored_cols:
+                continue
+            diff = ~target[c].equal_null(source[c])
+            changed = diff if changed is None else changed | diff
+
+        values = {c: source[c] for c in cols}
+        result = target.merge(
+            source,
+            target[id_col] == source[id_col],
+            [
+                when_matched(changed).update(values),
+                when_not_matched().insert(values),
+            ],
+        )
+        return dict(
+            inserted=result.rows_inserted,
+            updated=result.rows_updated,
+            unchanged=len(data) - result.rows_inserted - result.rows_updated,
+        )
+
     @classmethod
     def batch_read(
-        cls, session, sortby=None, filter: lambda df: bool = None
+        cls,
+        session,
+        sortby: Optional[Union[str, List[str]]] = None,
+        filter: lambda df: bool = None,
+        where: Optional[Union[Dict[str, Any], Column]] = None,
+        limit: Optional[int] = None,
+        trusted: bool = False,
     ) -> List["BaseOpsCenterModel"]:
         """
-        Reads all rows from the table and returns them as a list of objects.
+        Reads rows from the table and returns them as a list of objects. The `where`, `sortby` and `limit` arguments
+        are compiled into Snowpark column expressions and evaluated in Snowflake, so only the matching rows are
+        transferred to the client. The `filter` lambda is applied to the pandas DataFrame after the rows are fetched
+        and should be avoided for new code.
         :param session:
+        :param sortby: Column name (or list of column names) to order the results by.
+        :param filter: Deprecated, a function which accepts the pandas DataFrame and returns a boolean mask.
+        :param where: A mapping of column name to value, or a Snowpark Column expression, which rows must match.
+        :param limit: The maximum number of rows to return.
+        :param trusted: If True, skip model validation because the rows were already validated when they were written.
         :return:
         """
-        df = session.table(f"INTERNAL.{cls.table_name}").to_pandas()
+        df = session.table(f"INTERNAL.{cls.table_name}")
+        predicate = build_predicate(where)
+        if predicate is not None:
+            df = df.filter(predicate)
+        if sortby:
+            sort_cols = [sortby] if isinstance(sortby, str) else sortby
+            df = df.sort([col(c) for c in sort_cols])
+        if limit is not None:
+            df = df.limit(limit)
+        df = df.to_pandas()
         df.columns = [c.lower() for c in df.columns]
         if filter:
             df = df[filter(df)]
-        if sortby:
-            df.sort_values(by=[sortby], inplace=True)
-        arr = [cls(**dict(row)) for row in df.to_dict("records")]
-        return arr
+        return cls._hydrate(df, trusted)
 
     @classmethod
-    def from_df(cls, df) -> List["BaseOpsCenterModel"]:
+    def from_df(cls, df, trusted: bool = False) -> List["BaseOpsCenterModel"]:
         """
         Reads all rows from the table and returns them as a list of objects.
-        :param session:
+        :param df: The pandas DataFrame to convert.
+        :param trusted: If True, skip model validation because the rows were already validated when they were written.
         :return:
         """
         df.columns = [c.lower() for c in df.columns]
-        arr = [cls(**dict(row)) for row in df.to_dict("records")]
-        return arr
+        return cls._hydrate(df, trusted)
+
+    @classmethod
+    def _hydrate(cls, df: pd.DataFrame, trusted: bool) -> List["BaseOpsCenterModel"]:
+        if not trusted:
+            return [cls(**dict(row)) for row in df.to_dict("records")]
+
+        # Rows read back from INTERNAL.* were validated when they were written. Validators can issue queries
+        # (e.g. Label), so build the objects directly and only normalize what pandas did to the values.
+        df = df[[c for c in df.columns if c in cls.__fields__]]
+        return [cls.construct(**row) for row in clean_records(df)]
+
+
+def clean_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    Converts a pandas DataFrame into a list of dicts of plain Python values: numpy scalars become Python scalars,
+    pandas Timestamps become datetime.datetime and NaN/NaT become None.
+    """
+    datetime_cols = [
+        c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])
+    ]
+    df = df.astype(object)
+    for c in datetime_cols:
+        df[c] = pd.Series(
+            [v.to_pydatetime() if isinstance(v, pd.Timestamp) else v for v in df[c]],
+            index=df.index,
+            dtype=object,
+        )
+    df = df.where(pd.notnull(df), None)
+    return df.to_dict("records")
+
+
+def build_predicate(where: Optional[Union[Dict[str, Any], Column]]) -> Optional[Column]:
+    """
+    Compiles the declarative `where` argument of `batch_read` into a Snowpark Column expression. Each key in a dict is
+    a column name. A scalar value is compared for equality, None matches NULL, and a list, tuple or set matches any
+    of its values. All entries are combined with AND. A Column is returned as-is.
+    """
+    if where is None or isinstance(where, Column):
+        return where
+
+    predicate = None
+    for name, value in where.items():
+        if value is None:
+            expr = col(name).is_null()
+        elif isinstance(value, (list, tuple, set)):
+            expr = col(name).isin([unwrap_literal(v) for v in value])
+        else:
+            expr = col(name) == unwrap_literal(value)
+        predicate = expr if predicate is None else predicate & expr
+    return predicate
+
+
+def unwrap_literal(v):
+    """
+    Unwraps `v` into a value which Snowpark can use as a literal in a column expression.
+    """
+    if isinstance(v, Enum):
+        return unwrap_literal(v.value)
+    elif isinstance(v, pd.Timestamp):
+        return v.to_pydatetime()
+    return v
+
+
+def bind_values(values: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    """
+    Returns a SQL placeholder for each value along with the bind parameters for the placeholders, in order.
+    """
+    placeholders = []
+    params = []
+    for v in values.values():
+        # Specific versions of snowpark-python appear to have an issue handling None bind parameters
+        if v is None:
+            placeholders.append("NULL")
+        else:
+            placeholders.append("?")
+            params.append(unwrap_value(v))
+    return placeholders, params
 
 
 def unwrap_value(v):
@@ -173,6 +338,16 @@ def handle_type(t):
         raise ValueError(f"Unknown type: {t}")
 
 
+# The Snowpark types of the column types returned by handle_type
+_SNOWPARK_TYPES = {
+    "STRING": StringType(),
+    "NUMBER": LongType(),
+    "TIMESTAMP": TimestampType(),
+    "TIME": TimeType(),
+    "BOOLEAN": BooleanType(),
+}
+
+
 def handle_union(args, origin):
     if origin == Union and len(args) == 2 and type(None) == args[1]:
         return f"{handle_type(args[0])} NULL"
@@ -1,8 +1,10 @@
 from pydantic import ValidationError
+from typing import List, Optional
 from .labels import Label
 from .probes import Probe
 from .errors import summarize_error
-from .session import snowpark_session
+from .session import deferred_refresh, deferred_validation, snowpark_session
+from .tracing import Tracer
 from .wh_sched import WarehouseSchedules, WarehouseAlterStatements
 
 # A "registry" of CRUD types and the implementation class
@@ -24,13 +26,15 @@ def create_table(session, entity_type):
         return None
 
 
-def create_entity(session, entity_type, entity):
-    with snowpark_session(session) as txn:
+def create_entity(session, entity_type, entity, tracer: Optional[Tracer] = None):
+    with snowpark_session(session, tracer, f"create_entity {entity_type}") as txn:
         try:
             t = _TYPES.get(entity_type)
             if not t:
                 raise ValueError(f"Unknown entity type: {entity_type}")
-            obj = t.parse_obj(entity)
+            # Models which defer their Snowflake checks run them in write()
+            with deferred_validation():
+                obj = t.parse_obj(entity)
             obj.write(txn)
             return None
         except ValidationError as e:
@@ -39,8 +43,14 @@ def create_entity(session, entity_type, entity):
             return f"Failed to create {entity_type.lower()}: {str(ae)}"
 
 
-def update_entity(session, entity_type: str, old_name: str, new_obj: dict):
-    with snowpark_session(session) as txn:
+def update_entity(
+    session,
+    entity_type: str,
+    old_name: str,
+    new_obj: dict,
+    tracer: Optional[Tracer] = None,
+):
+    with snowpark_session(session, tracer, f"update_entity {entity_type}") as txn:
         try:
             t = _TYPES.get(entity_type)
             if not t:
@@ -55,7 +65,9 @@ def update_entity(session, entity_type: str, old_name: str, new_obj: dict):
             else:
                 # Instantiate a new object with the old name
                 obj = t.construct(name=old_name)
-            new_obj = t.parse_obj(new_obj)
+            # Models which defer their Snowflake checks run them in update()
+            with deferred_validation():
+                new_obj = t.parse_obj(new_obj)
             obj.update(txn, new_obj)
             return None
         except ValidationError as ve:
@@ -64,8 +76,10 @@ def update_entity(session, entity_type: str, old_name: str, new_obj: dict):
             return f"Failed to update {entity_type.lower()}: {str(ae)}"
 
 
-def delete_entity(session, entity_type: str, name: str):
-    with snowpark_session(session) as txn:
+def delete_entity(
+    session, entity_type: str, name: str, tracer: Optional[Tracer] = None
+):
+    with snowpark_session(session, tracer, f"delete_entity {entity_type}") as txn:
         try:
             t = _TYPES.get(entity_type)
             if not t:
@@ -77,3 +91,61 @@ def delete_entity(session, entity_type: str, name: str):
             return None
         except Exception as ae:
             return f"Failed to delete {entity_type.lower()}: {str(ae)}"
+
+
+def apply_entities(
+    session,
+    entity_type: str,
+    operations: List[dict],
+    tracer: Optional[Tracer] = None,
+) -> List[Optional[str]]:
+    """
+    Applies a batch of operations, each a dict with an `action` of "create", "update" or "delete", the `name` of the
+    entity to update or delete and the new `entity`. Operations are applied in order and a failed operation does not
+    stop the batch. The procedures run after a change (e.g. regenerating LABELED_QUERY_HISTORY) are called once, after
+    the whole batch.
+    :return: The outcome of each operation, None on success or an error message.
+    """
+    with snowpark_session(session, tracer, f"apply_entities {entity_type}") as txn:
+        if entity_type not in _TYPES:
+            raise ValueError(f"Unknown entity type: {entity_type}")
+        outcomes = []
+        with deferred_refresh(txn):
+            for op in operations:
+                action = op.get("action")
+                if action == "create":
+                    outcome = create_entity(txn, entity_type, op.get("entity"))
+                elif action == "update":
+                    outcome = update_entity(
+                        txn, entity_type, op.get("name"), op.get("entity")
+                    )
+                elif action == "delete":
+                    outcome = delete_entity(txn, entity_type, op.get("name"))
+                else:
+                    outcome = f"Unknown action: {action}"
+                outcomes.append(outcome)
+        return outcomes
+
+
+def profile_entity(
+    session, action: str, entity_type: str, name: str, entity: dict
+) -> dict:
+    """
+    Runs create_entity, update_entity or delete_entity with a Tracer attached and returns the outcome along with the
+    statements that were issued. The operation runs in a transaction which is rolled back, and the procedures it
+    would call afterwards are not run, so nothing is changed.
+    """
+    if action not in ("create", "update", "delete"):
+        raise ValueError(f"Unknown action: {action}")
+    tracer = Tracer(rollback=True)
+    session.sql("BEGIN").collect()
+    try:
+        if action == "create":
+            outcome = create_entity(session, entity_type, entity, tracer=tracer)
+        elif action == "update":
+            outcome = update_entity(session, entity_type, name, entity, tracer=tracer)
+        else:
+            outcome = delete_entity(session, entity_type, name, tracer=tracer)
+    finally:
+        session.sql("ROLLBACK").collect()
+    return dict(outcome=outcome, totals=tracer.totals(), statements=tracer.summary())
@@ -0,0 +1,167 @@
+import time
+from typing import Dict, FrozenSet, NamedTuple, Optional
+from snowflake.snowpark.exceptions import SnowparkSQLException
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import SqlglotError
+except ImportError:
+    # sqlglot is optional. Without it, every condition is validated by Snowflake.
+    sqlglot = None
+
+# The relations which label and query monitor conditions are evaluated against, as recorded in
+# INTERNAL.CONDITION_SCHEMA by INTERNAL.REFRESH_CONDITION_SCHEMA().
+ENRICHED_QUERY_HISTORY = "ENRICHED_QUERY_HISTORY"
+DUMMY_QUERY_HISTORY_UDTF = "DUMMY_QUERY_HISTORY_UDTF"
+
+# How long the snapshot is used before checking whether INTERNAL.CONDITION_SCHEMA was refreshed.
+SCHEMA_SNAPSHOT_TTL_SECONDS = 300
+# Column names per relation, the REFRESHED_AT of the rows they were loaded from and when that was last checked.
+_schema_snapshot: Dict[str, FrozenSet[str]] = {}
+_schema_snapshot_version = None
+_schema_snapshot_checked_at = 0.0
+
+
+class LocalCheck(NamedTuple):
+    # True or False when the condition could be checked in-process, None when Snowflake must decide.
+    valid: Optional[bool]
+    message: Optional[str] = None
+
+
+UNKNOWN = LocalCheck(valid=None)
+
+
+def load_schema_snapshot(session) -> bool:
+    """
+    Loads the column names of the relations that conditions are evaluated against. The snapshot is refreshed in
+    Snowflake whenever the views are migrated, so once SCHEMA_SNAPSHOT_TTL_SECONDS have passed it is only reused if
+    the refresh time of INTERNAL.CONDITION_SCHEMA has not changed.
+    :return: True if a snapshot is available.
+    """
+    global _schema_snapshot_version, _schema_snapshot_checked_at
+    if (
+        _schema_snapshot
+        and time.monotonic() - _schema_snapshot_checked_at < SCHEMA_SNAPSHOT_TTL_SECONDS
+    ):
+        return True
+    if sqlglot is None:
+        # The snapshot is only useful to the local validator
+        return False
+    try:
+        if _schema_snapshot:
+            version = session.sql(
+                "select max(refreshed_at) from internal.condition_schema"
+            ).collect()[0][0]
+            if version == _schema_snapshot_version:
+                _schema_snapshot_checked_at = time.monotonic()
+                return True
+        rows = session.sql(
+            "select source, column_name, refreshed_at from internal.condition_schema"
+        ).collect()
+    except SnowparkSQLException:
+        # Not created yet, validate with Snowflake until the next migration
+        clear_schema_snapshot()
+        return False
+
+    clear_schema_snapshot()
+    columns = {}
+    for source, column_name, refreshed_at in rows:
+        columns.setdefault(source, set()).add(column_name)
+        if _schema_snapshot_version is None or (
+            refreshed_at is not None and refreshed_at > _schema_snapshot_version
+        ):
+            _schema_snapshot_version = refreshed_at
+    _schema_snapshot.update({k: frozenset(v) for k, v in columns.items()})
+    _schema_snapshot_checked_at = time.monotonic()
+    return bool(_schema_snapshot)
+
+
+def clear_schema_snapshot():
+    global _schema_snapshot_version
+    _schema_snapshot.clear()
+    _schema_snapshot_version = None
+
+
+def schema_snapshot(source: str) -> Optional[FrozenSet[str]]:
+    """
+    Returns the column names of `source`, or None if no snapshot is loaded.
+    """
+    return _schema_snapshot.get(source) or None
+
+
+def has_column(source: str, name: str) -> Optional[bool]:
+    """
+    Returns whether `source` has a column named exactly `name` (a quoted identifier), or None if it is unknown.
+    """
+    columns = _schema_snapshot.get(source)
+    if not columns:
+        return None
+    return name in columns
+
+
+def check_expression(expression: str, source: str) -> LocalCheck:
+    """
+    Parses `expression` as a select-list item against `source` and resolves its column references with the schema
+    snapshot. Anything the local parser cannot fully reason about (syntax it rejects, UDFs or functions it does not
+    know, subqueries, lambdas, qualified columns) is left to Snowflake.
+    """
+    columns = _schema_snapshot.get(source)
+    if sqlglot is None or not columns:
+        return UNKNOWN
+
+    try:
+        statements = sqlglot.parse(
+            f"select {expression} from {source}", read="snowflake"
+        )
+    except SqlglotError:
+        return UNKNOWN
+    if len(statements) != 1 or not isinstance(statements[0], exp.Select):
+        return UNKNOWN
+
+    select = statements[0]
+    if len(select.expressions) != 1 or len(list(select.find_all(exp.Table))) != 1:
+        return UNKNOWN
+    if any(
+        select.find_all(exp.Anonymous, exp.Dot, exp.Lambda, exp.Star, exp.Placeholder)
+    ):
+        return UNKNOWN
+
+    for column in select.find_all(exp.Column):
+        if column.table or not isinstance(column.this, exp.Identifier):
+            return UNKNOWN
+        identifier = column.this
+        # Snowflake upper-cases unquoted identifiers
+        name = identifier.name if identifier.quoted else identifier.name.upper()
+        if name not in columns:
+            return LocalCheck(
+                valid=False,
+                message=f"invalid identifier '{identifier.sql(dialect='snowflake')}'",
+            )
+
+    return LocalCheck(valid=True)
+
+
+def replace_current_timestamp(expression: str, column: str) -> Optional[str]:
+    """
+    Returns `expression` with every call to current_timestamp() replaced by a reference to `column`, or None if the
+    local parser is not available or cannot parse it. String literals are left untouched.
+    """
+    if sqlglot is None:
+        return None
+    try:
+        statements = sqlglot.parse(f"select {expression}", read="snowflake")
+    except SqlglotError:
+        return None
+    if len(statements) != 1 or not isinstance(statements[0], exp.Select):
+        return None
+    select = statements[0]
+    if len(select.expressions) != 1:
+        return None
+
+    replaced = select.expressions[0].transform(
+        lambda node: exp.column(column)
+        if isinstance(node, exp.CurrentTimestamp)
+        else node
+    )
+    return replaced.sql(dialect="snowflake")
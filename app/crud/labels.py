@@ -3,12 +3,46 @@ from pydantic import (
     validator,
     root_validator,
 )
-from typing import Optional, ClassVar, Union
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, ClassVar, Tuple, Union
 import datetime
+import hashlib
 import math
 import pandas as pd
-from .base import BaseOpsCenterModel, transaction
-from .session import get_current_session
+import time
+from .base import BaseOpsCenterModel, bind_values, transaction
+from .conditions import (
+    ENRICHED_QUERY_HISTORY,
+    check_expression,
+    has_column,
+    load_schema_snapshot,
+    schema_snapshot,
+)
+from .session import (
+    deferred_validation,
+    get_current_session,
+    is_validation_deferred,
+    request_refresh,
+)
+
+# Counts columns in the label view with the same (case-sensitive) name as a label
+_COLUMN_CONFLICT_CHECK = """SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_SCHEMA = 'REPORTING' AND TABLE_NAME = 'ENRICHED_QUERY_HISTORY' AND COLUMN_NAME = ?"""
+
+
+def condition_check_expr(condition: str, is_dynamic: bool) -> str:
+    """
+    Returns the expression a label condition is evaluated as in the label view.
+    """
+    if is_dynamic:
+        return f"substring({condition}, 0, 0)"
+    return f"case when {condition} then 1 else 0 end"
+
+
+def condition_check_stmt(condition: str, is_dynamic: bool) -> str:
+    """
+    Returns a statement which only compiles if `condition` is a valid label condition.
+    """
+    return f"select {condition_check_expr(condition, is_dynamic)} from reporting.enriched_query_history where false"
 
 
 ## TODO
@@ -38,83 +72,152 @@ class Label(BaseOpsCenterModel):
     def delete(self, session):
         with transaction(session) as txn:
             super().delete(txn)
-        session.call(self.on_success_proc)
+        clear_preview_cache()
+        request_refresh(session, self.on_success_proc)
 
     def write(self, session):
-        with transaction(session) as txn:
+        """
+        Inserts the label if its name is unique, does not collide with a column in ENRICHED_QUERY_HISTORY and its
+        condition compiles. All checks run within the INSERT, so a successful write costs one statement plus the
+        view refresh. The checks are only re-run separately to explain a failed write.
+        """
+        conflict_sql, conflict_params = self._name_conflict_check()
+        cols = dict(self)
+        placeholders, params = bind_values(cols)
+        try:
+            inserted = session.sql(
+                f"""
+                INSERT INTO INTERNAL.{self.table_name} ({", ".join(cols.keys())})
+                SELECT {", ".join(placeholders)}
+                WHERE ({conflict_sql}) = 0
+                    AND ({_COLUMN_CONFLICT_CHECK}) = 0
+                    AND (SELECT COUNT(*) FROM ({self._condition_check_stmt()})) = 0""",
+                params=[*params, *conflict_params, self._view_column_name()],
+            ).collect()[0][0]
+        except snowflake.snowpark.exceptions.SnowparkSQLException:
+            self._assert_condition_compiles(session)
+            raise
+
+        if inserted == 0:
+            name_conflicts, column_conflicts = session.sql(
+                f"SELECT ({conflict_sql}), ({_COLUMN_CONFLICT_CHECK})",
+                params=[*conflict_params, self._view_column_name()],
+            ).collect()[0]
+            self._assert_no_column_conflict(column_conflicts)
             if self.group_name:
-                # check if the grouped label's name conflict with :
-                #  1) another label in the same group,
-                #  2) or an ungrouped label's name.
-                #  3) another dynamic group name
-                count = txn.sql(
-                    """
-                    SELECT COUNT(*) FROM INTERNAL.LABELS
-                    WHERE
-                        (GROUP_NAME = ? AND NAME = ? AND NAME IS NOT NULL)
-                         OR (NAME = ? AND GROUP_NAME IS NULL)
-                         OR (GROUP_NAME = ? AND NAME IS NULL)""",
-                    params=(
-                        self.group_name,
-                        self.name,
-                        self.group_name,
-                        self.group_name,
-                    ),
-                ).collect()[0][0]
-                assert count == 0, "A label with this name already exists."
+                assert name_conflicts == 0, "A label with this name already exists."
             else:
-                # check if the ungrouped label's name conflict with another ungrouped label, or a group with same name.
-                count = txn.sql(
-                    """
-                    SELECT COUNT(*) FROM INTERNAL.LABELS
-                    WHERE (NAME = ? AND GROUP_NAME IS NULL) OR (GROUP_NAME = ? AND GROUP_NAME IS NOT NULL)""",
-                    params=(
-                        self.name,
-                        self.name,
-                    ),
-                ).collect()[0][0]
                 assert (
-                    count == 0
+                    name_conflicts == 0
                 ), f"A label with the name '{self.name}' already exists."
+            assert False, "Failed to create label, please try again."
 
-            super().write(txn)
+        # re-generate the views
+        clear_preview_cache()
+        request_refresh(session, self.on_success_proc)
 
-        # re-generate the views outside the transaction
-        session.call(self.on_success_proc)
+    def _name_conflict_check(self) -> Tuple[str, tuple]:
+        if self.group_name:
+            # check if the grouped label's name conflict with :
+            #  1) another label in the same group,
+            #  2) or an ungrouped label's name.
+            #  3) another dynamic group name
+            return (
+                """SELECT COUNT(*) FROM INTERNAL.LABELS
+                WHERE
+                    (GROUP_NAME = ? AND NAME = ? AND NAME IS NOT NULL)
+                     OR (NAME = ? AND GROUP_NAME IS NULL)
+                     OR (GROUP_NAME = ? AND NAME IS NULL)""",
+                (self.group_name, self.name, self.group_name, self.group_name),
+            )
+        # check if the ungrouped label's name conflict with another ungrouped label, or a group with same name.
+        return (
+            """SELECT COUNT(*) FROM INTERNAL.LABELS
+            WHERE (NAME = ? AND GROUP_NAME IS NULL) OR (GROUP_NAME = ? AND GROUP_NAME IS NOT NULL)""",
+            (self.name, self.name),
+        )
 
     def update(self, session, obj: "Label") -> "Label":
-        with transaction(session):
-            if self.is_dynamic:
-                old_label_exists = session.sql(
-                    f"SELECT COUNT(*) FROM INTERNAL.{self.table_name} WHERE group_name = ? and is_dynamic",
-                    params=(self.group_name,),
-                ).collect()[0][0]
-            else:
-                old_label_exists = session.sql(
-                    f"SELECT COUNT(*) = 1 FROM INTERNAL.{self.table_name} WHERE name = ?",
-                    params=(self.name,),
-                ).collect()[0][0]
-                new_name_is_unique = session.sql(
-                    f"SELECT COUNT(*) = 0 FROM INTERNAL.{self.table_name} WHERE name = ? and name <> ?",
-                    params=(
-                        obj.name,
-                        self.name,
-                    ),
-                ).collect()[0][0]
-                assert (
-                    new_name_is_unique
-                ), f"A label with the name '{obj.name}' already exists."
+        """
+        Replaces this label with `obj`, performing the same checks as `write` within the UPDATE statement.
+        """
+        if self.is_dynamic:
+            old_label_sql = f"SELECT COUNT(*) FROM INTERNAL.{self.table_name} WHERE group_name = ? and is_dynamic"
+            old_label_params = (self.group_name,)
+            conflict_sql = "SELECT 0"
+            conflict_params = ()
+        else:
+            old_label_sql = (
+                f"SELECT COUNT(*) FROM INTERNAL.{self.table_name} WHERE name = ?"
+            )
+            old_label_params = (self.name,)
+            conflict_sql = f"SELECT COUNT(*) FROM INTERNAL.{self.table_name} WHERE name = ? and name <> ?"
+            conflict_params = (obj.name, self.name)
+
+        cols = dict(obj)
+        placeholders, params = bind_values(cols)
+        set_clause = ", ".join(f"{k} = {p}" for k, p in zip(cols.keys(), placeholders))
+        try:
+            updated = session.sql(
+                f"""
+                UPDATE INTERNAL.{self.table_name} SET {set_clause}
+                WHERE {self.get_id_col()} = ?
+                    AND ({old_label_sql}) > 0
+                    AND ({conflict_sql}) = 0
+                    AND ({_COLUMN_CONFLICT_CHECK}) = 0
+                    AND (SELECT COUNT(*) FROM ({obj._condition_check_stmt()})) = 0""",
+                params=[
+                    *params,
+                    self.get_id(),
+                    *old_label_params,
+                    *conflict_params,
+                    obj._view_column_name(),
+                ],
+            ).collect()[0][0]
+        except snowflake.snowpark.exceptions.SnowparkSQLException:
+            obj._assert_condition_compiles(session)
+            raise
 
+        if updated == 0:
+            old_label_exists, name_conflicts, column_conflicts = session.sql(
+                f"SELECT ({old_label_sql}), ({conflict_sql}), ({_COLUMN_CONFLICT_CHECK})",
+                params=[*old_label_params, *conflict_params, obj._view_column_name()],
+            ).collect()[0]
+            obj._assert_no_column_conflict(column_conflicts)
+            assert (
+                name_conflicts == 0
+            ), f"A label with the name '{obj.name}' already exists."
             assert (
                 old_label_exists
             ), f"A label with the name '{self.name}' does not exist."
+            assert False, "Failed to update label, please try again."
 
-            super().update(session, obj)
-
-        session.call(self.on_success_proc)
+        clear_preview_cache()
+        request_refresh(session, self.on_success_proc)
 
         return obj
 
+    def _view_column_name(self) -> str:
+        return self.group_name if self.group_name else self.name
+
+    def _assert_no_column_conflict(self, column_conflicts: int):
+        attr = "group name" if self.group_name else "name"
+        assert (
+            column_conflicts == 0
+        ), f"Label {attr} cannot be the same as a column in REPORTING.ENRICHED_QUERY_HISTORY."
+
+    def _condition_check_stmt(self) -> str:
+        return condition_check_stmt(self.condition, self.is_dynamic)
+
+    def _assert_condition_compiles(self, session):
+        """
+        Compiles the condition on its own, so that a failed write is only blamed on the condition when it is invalid.
+        """
+        try:
+            session.sql(self._condition_check_stmt()).collect()
+        except snowflake.snowpark.exceptions.SnowparkSQLException as e:
+            assert False, f'Invalid label condition: "{e.message}".'
+
     @root_validator(allow_reuse=True)
     @classmethod
     def validate_label_obj(cls, values) -> "Label":
@@ -148,16 +251,26 @@ class Label(BaseOpsCenterModel):
         """
         Validates this Label against the database to check things like name uniqueness and condition validity.
         """
+        if is_validation_deferred():
+            return values
+
         session = get_current_session()
         assert session, "Session must be present"
 
         # Cannot check the condition if it's empty
         condition = values.get("condition")
         if condition:
-            if values.get("is_dynamic"):
-                stmt = f"select substring({condition}, 0, 0) from reporting.enriched_query_history where false"
-            else:
-                stmt = f"select case when {condition} then 1 else 0 end from reporting.enriched_query_history where false"
+            # Reject conditions with unknown columns in-process. Only Snowflake checks types and function signatures,
+            # so a condition which passes locally is still compiled.
+            local = check_expression(
+                condition_check_expr(condition, values.get("is_dynamic")),
+                ENRICHED_QUERY_HISTORY,
+            )
+            assert (
+                local.valid is not False
+            ), f'Invalid label condition: "{local.message}".'
+
+            stmt = condition_check_stmt(condition, values.get("is_dynamic"))
             try:
                 session.sql(stmt).collect()
             except snowflake.snowpark.exceptions.SnowparkSQLException as e:
@@ -171,6 +284,9 @@ class Label(BaseOpsCenterModel):
         """
         Validates that the label's name does not duplicate a column in account_usage.query_history.
         """
+        if is_validation_deferred():
+            return values
+
         session = get_current_session()
 
         # Check that the label [group] name does not conflict with any columns already in this view
@@ -179,6 +295,13 @@ class Label(BaseOpsCenterModel):
             values.get("group_name") if values.get("group_name") else values.get("name")
         )
 
+        conflicts = has_column(ENRICHED_QUERY_HISTORY, name)
+        if conflicts is not None:
+            assert (
+                not conflicts
+            ), f"Label {attr} cannot be the same as a column in REPORTING.ENRICHED_QUERY_HISTORY."
+            return values
+
         try:
             session.sql(
                 f'select "{name}" from reporting.enriched_query_history where false'
@@ -243,6 +366,167 @@ class PredefinedLabel(Label):
             inplace=True,
         )
         df["label_id"] = "predefined"
-        for row in df.to_dict(orient="records"):
-            # Validate each predefined label
-            _ = Label.parse_obj(row)
+        # Validate as many conditions in-process as possible
+        load_schema_snapshot(session)
+        # Check each label on its own, then check against Snowflake in bulk
+        with deferred_validation():
+            labels = [Label.parse_obj(row) for row in df.to_dict(orient="records")]
+        validate_batch(session, labels)
+
+
+def validate_batch(session: snowflake.snowpark.Session, labels: List[Label]):
+    """
+    Performs the checks of Label's Snowflake validators for many labels at once. Names are checked against the columns
+    of ENRICHED_QUERY_HISTORY, conditions with unknown columns are rejected in-process and the rest are compiled in a
+    single statement. If that statement fails, the offending label is found by bisection.
+    :raises AssertionError: naming the first invalid label.
+    """
+    columns = _view_columns(session)
+    for label in labels:
+        attr = "group name" if label.group_name else "name"
+        assert (
+            label._view_column_name() not in columns
+        ), f"Label {attr} '{label._view_column_name()}' cannot be the same as a column in REPORTING.ENRICHED_QUERY_HISTORY."
+
+    for label in labels:
+        local = check_expression(
+            condition_check_expr(label.condition, label.is_dynamic),
+            ENRICHED_QUERY_HISTORY,
+        )
+        assert (
+            local.valid is not False
+        ), f"Invalid condition for label '{label._view_column_name()}': \"{local.message}\"."
+    _compile_conditions(session, labels)
+
+
+def _view_columns(session: snowflake.snowpark.Session) -> FrozenSet[str]:
+    columns = schema_snapshot(ENRICHED_QUERY_HISTORY)
+    if columns is not None:
+        return columns
+    rows = session.sql(
+        "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_SCHEMA = 'REPORTING' AND TABLE_NAME = 'ENRICHED_QUERY_HISTORY'"
+    ).collect()
+    return frozenset(r[0] for r in rows)
+
+
+def _compile_conditions(session: snowflake.snowpark.Session, labels: List[Label]):
+    if not labels:
+        return
+    projections = ", ".join(
+        f"{condition_check_expr(label.condition, label.is_dynamic)} as c{i}"
+        for i, label in enumerate(labels)
+    )
+    try:
+        session.sql(
+            f"select {projections} from reporting.enriched_query_history where false"
+        ).collect()
+    except snowflake.snowpark.exceptions.SnowparkSQLException as e:
+        if len(labels) == 1:
+            assert (
+                False
+            ), f"Invalid condition for label '{labels[0]._view_column_name()}': \"{e.message}\"."
+        mid = len(labels) // 2
+        _compile_conditions(session, labels[:mid])
+        # Both halves compiling on their own means the combined statement was only too large
+        _compile_conditions(session, labels[mid:])
+
+
+class LabelPreview(NamedTuple):
+    # Matches and totals over the previewed slice. Sampled counts are scaled up by the sample rate.
+    queries: int
+    cost: float
+    total_queries: int
+    total_cost: float
+    # Queries matched by the condition which each existing grouped label applies to, keyed by (group name, label name).
+    overlaps: Dict[Tuple[str, str], int]
+
+
+# How long a preview is reused for the same condition and slice.
+PREVIEW_TTL_SECONDS = 600
+_preview_cache: Dict[str, Tuple[float, LabelPreview]] = {}
+
+
+def preview_label(
+    session: snowflake.snowpark.Session,
+    condition: str,
+    is_dynamic: bool = False,
+    days: int = 7,
+    sample_percent: Optional[float] = None,
+) -> LabelPreview:
+    """
+    Estimates how many queries, and how much cost, a label condition would match over the last `days` days of
+    REPORTING.ENRICHED_QUERY_HISTORY, optionally over a random `sample_percent` of those queries. The matches, totals
+    and overlaps with existing label groups are computed in one aggregate query, and the result is cached per condition
+    hash for PREVIEW_TTL_SECONDS or until a label is written.
+    :raises AssertionError: if the condition is invalid.
+    """
+    assert days > 0, "The preview must cover at least one day."
+    assert sample_percent is None or (
+        0 < sample_percent <= 100
+    ), "The sample must be between 0 and 100 percent."
+    check_expr = condition_check_expr(condition, is_dynamic)
+    local = check_expression(check_expr, ENRICHED_QUERY_HISTORY)
+    assert local.valid is not False, f'Invalid label condition: "{local.message}".'
+
+    # The overlaps are cached with the preview, so a hit issues no queries. Label writes clear the cache.
+    key = hashlib.sha256(
+        "\n".join([check_expr, str(days), str(sample_percent)]).encode("utf-8")
+    ).hexdigest()
+    cached = _preview_cache.get(key)
+    if cached and time.monotonic() - cached[0] < PREVIEW_TTL_SECONDS:
+        return cached[1]
+
+    # The effective label of each group, as it appears in LABELED_QUERY_HISTORY
+    groups = session.sql(
+        """SELECT d.label_key, d.expr, l.name
+        FROM internal.label_definitions d
+        JOIN internal.labels l ON l.group_name = d.label_key AND NOT l.is_dynamic
+        WHERE d.kind_order = 2
+        ORDER BY d.label_key, l.group_rank"""
+    ).collect()
+
+    group_exprs = {}
+    for g in groups:
+        group_exprs.setdefault(g[0], f"{g[1]} as _g{len(group_exprs)}")
+    group_aliases = {name: f"_g{i}" for i, name in enumerate(group_exprs)}
+    overlap_cols = "".join(
+        f", count_if(_match and {group_aliases[g[0]]} = ?)" for g in groups
+    )
+    inner_cols = "".join(f", {e}" for e in group_exprs.values())
+    sample = f" SAMPLE ({sample_percent})" if sample_percent else ""
+    stmt = f"""SELECT count_if(_match), sum(iff(_match, cost, 0)), count(*), sum(cost){overlap_cols}
+    FROM (
+        SELECT cost, {match_expr(condition, is_dynamic)} as _match{inner_cols}
+        FROM reporting.enriched_query_history{sample}
+        WHERE start_time >= dateadd(day, -?, current_timestamp())
+    )"""
+    try:
+        row = session.sql(stmt, params=[g[2] for g in groups] + [days]).collect()[0]
+    except snowflake.snowpark.exceptions.SnowparkSQLException as e:
+        assert False, f'Invalid label condition: "{e.message}".'
+
+    scale = 100 / sample_percent if sample_percent else 1
+    preview = LabelPreview(
+        queries=round((row[0] or 0) * scale),
+        cost=float(row[1] or 0) * scale,
+        total_queries=round((row[2] or 0) * scale),
+        total_cost=float(row[3] or 0) * scale,
+        overlaps={
+            (g[0], g[2]): round((row[4 + i] or 0) * scale) for i, g in enumerate(groups)
+        },
+    )
+    _preview_cache[key] = (time.monotonic(), preview)
+    return preview
+
+
+def match_expr(condition: str, is_dynamic: bool) -> str:
+    """
+    Returns a boolean expression which is true for the queries the label applies to.
+    """
+    if is_dynamic:
+        return f"(({condition}) is not null)"
+    return f"coalesce(({condition}), false)"
+
+
+def clear_preview_cache():
+    _preview_cache.clear()
@@ -4,9 +4,23 @@ from pydantic import root_validator, validator
 from snowflake import snowpark
 from typing import ClassVar, Optional, Tuple
 from .base import BaseOpsCenterModel, transaction
+from .conditions import (
+    DUMMY_QUERY_HISTORY_UDTF,
+    ENRICHED_QUERY_HISTORY,
+    check_expression,
+    replace_current_timestamp,
+)
 from .session import get_current_session
 
 
+# How often TASKS.PROBE_MONITORING evaluates running queries. Queries which finish sooner may never be seen running.
+MONITOR_INTERVAL_MS = 60 * 1000
+# A backtest evaluates current_timestamp() in a condition as the time the monitor would have seen the query.
+_EVALUATED_AT = "monitor_evaluated_at"
+# A running query is checked at most this many times by a backtest, spread over its run when it is long.
+MAX_BACKTEST_CHECKS = 60
+
+
 class NotificationMethod(str, Enum):
     EMAIL = "EMAIL"
     SLACK = "SLACK"
@@ -138,17 +152,97 @@ class Probe(BaseOpsCenterModel):
     def validate_probe_condition(cls, values: dict) -> dict:
         session = get_current_session()
 
-        condition = values.get("condition")
-
-        try:
-            _ = session.sql(
-                f"select {condition} from INTERNAL.DUMMY_QUERY_HISTORY_UDTF where false",
-            ).collect()
-        except snowpark.exceptions.SnowparkSQLException as e:
-            assert False, f"Invalid query monitor condition: {e.message}"
+        _assert_valid_condition(session, values.get("condition"))
 
         return values
 
+    @classmethod
+    def backtest(
+        cls,
+        session: snowpark.Session,
+        condition: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+    ) -> snowpark.DataFrame:
+        """
+        Evaluates a query monitor condition over REPORTING.ENRICHED_QUERY_HISTORY for the queries which started between
+        `start` and `end`, the way TASKS.PROBE_MONITORING would have. Each query is checked once it has ended, with
+        current_timestamp() as its end time, and at every monitoring interval while it was running (at most
+        MAX_BACKTEST_CHECKS times), with current_timestamp() as that moment and its elapsed time so far. Returns, per
+        hour, the number of matching queries, their cost and how many of them matched while still running, which a
+        cancelling monitor would have caught.
+        """
+        assert condition, "Query monitor condition cannot be empty"
+        assert start < end, "The backtest must start before it ends"
+        # The condition must be a valid query monitor, and valid over the history it is backtested against
+        _assert_valid_condition(session, condition)
+        _assert_valid_condition(
+            session,
+            condition,
+            ENRICHED_QUERY_HISTORY,
+            "reporting.enriched_query_history",
+        )
+        evaluated = replace_current_timestamp(condition, _EVALUATED_AT)
+        if evaluated is None:
+            assert (
+                "current_timestamp" not in condition.lower()
+            ), "Unable to backtest this use of current_timestamp(), the condition could not be parsed"
+            evaluated = condition
+
+        return session.sql(
+            f"""WITH history AS (
+                SELECT *, end_time AS {_EVALUATED_AT} FROM reporting.enriched_query_history
+                WHERE start_time >= ? AND start_time < ?
+            ), ticks AS (
+                SELECT h.*, dateadd(millisecond,
+                    floor(t.value * greatest(?, h.total_elapsed_time / {MAX_BACKTEST_CHECKS + 1})), h.start_time) AS tick
+                FROM history h, LATERAL flatten(input =>
+                    array_generate_range(1, least(ceil(h.total_elapsed_time / ?), {MAX_BACKTEST_CHECKS + 1}))) t
+            ), running AS (
+                SELECT * EXCLUDE (total_elapsed_time, end_time, execution_status, {_EVALUATED_AT}, tick),
+                    datediff(millisecond, start_time, tick) AS total_elapsed_time, NULL::timestamp_ltz AS end_time,
+                    'RUNNING' AS execution_status, tick AS {_EVALUATED_AT}
+                FROM ticks
+            ), caught AS (
+                SELECT DISTINCT query_id FROM running WHERE coalesce(({evaluated}), false)
+            ), evaluated AS (
+                SELECT query_id, start_time, cost, coalesce(({evaluated}), false) AS matched FROM history
+            )
+            SELECT date_trunc('hour', e.start_time) AS hour, count_if(e.matched OR c.query_id IS NOT NULL) AS matches,
+                sum(iff(e.matched OR c.query_id IS NOT NULL, e.cost, 0)) AS matched_cost, count(c.query_id) AS cancelled
+            FROM evaluated e LEFT JOIN caught c ON e.query_id = c.query_id
+            GROUP BY hour
+            HAVING matches > 0
+            ORDER BY hour""",
+            params=(start, end, MONITOR_INTERVAL_MS, MONITOR_INTERVAL_MS),
+        )
+
+
+def _assert_valid_condition(
+    session: snowpark.Session,
+    condition: Optional[str],
+    source: str = DUMMY_QUERY_HISTORY_UDTF,
+    relation: str = "INTERNAL.DUMMY_QUERY_HISTORY_UDTF",
+):
+    """
+    Checks that `condition` can be evaluated against `relation`, by default the query history TASKS.PROBE_MONITORING
+    reads. `source` names the relation in the schema snapshot.
+    """
+    # Reject conditions with unknown columns in-process, if label validation already loaded the schema snapshot.
+    # Only Snowflake checks types and function signatures, so a condition which passes locally is still compiled.
+    if condition:
+        local = check_expression(condition, source)
+        assert (
+            local.valid is not False
+        ), f"Invalid query monitor condition: {local.message}"
+
+    try:
+        _ = session.sql(
+            f"select {condition} from {relation} where false",
+        ).collect()
+    except snowpark.exceptions.SnowparkSQLException as e:
+        assert False, f"Invalid query monitor condition: {e.message}"
+
 
 def _assert_no_duplicate_destinations(
     destinations: str, method: NotificationMethod
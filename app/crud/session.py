@@ -1,18 +1,28 @@
 from contextvars import ContextVar
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional
 from snowflake.snowpark import Session
+from .tracing import Tracer
 
 _session_context = ContextVar("session")
+_deferred_validation = ContextVar("deferred_validation", default=False)
+_deferred_refresh = ContextVar("deferred_refresh", default=None)
 
 
 @contextmanager
-def snowpark_session(session):
+def snowpark_session(
+    session, tracer: Optional[Tracer] = None, operation: Optional[str] = None
+):
     """
-    Makes the give Snowpark Session available to the CRUD implementation for the scope of this call.
+    Makes the give Snowpark Session available to the CRUD implementation for the scope of this call. If a Tracer is
+    provided, every statement issued through the session is recorded, attributed to `operation` when it is given.
     """
+    if tracer is not None:
+        session = tracer.wrap(session)
     token = _session_context.set(session)
     try:
-        yield session
+        with tracer.operation(operation) if tracer and operation else nullcontext():
+            yield session
     finally:
         _session_context.reset(token)
 
@@ -22,3 +32,47 @@ def get_current_session() -> Session:
     if not s:
         raise ValueError("Session must be set by caller")
     return s
+
+
+@contextmanager
+def deferred_validation():
+    """
+    Models parsed within this block skip validators which query Snowflake. The caller must persist them through a
+    path which performs those checks itself (e.g. `Label.write` and `Label.update`).
+    """
+    token = _deferred_validation.set(True)
+    try:
+        yield
+    finally:
+        _deferred_validation.reset(token)
+
+
+def is_validation_deferred() -> bool:
+    return _deferred_validation.get()
+
+
+@contextmanager
+def deferred_refresh(session):
+    """
+    Collects the procedures which models request to run after a change (e.g. `INTERNAL.UPDATE_LABEL_VIEW`) and calls
+    each of them once when the block exits, instead of once per change.
+    """
+    pending: Dict[str, None] = {}
+    token = _deferred_refresh.set(pending)
+    try:
+        yield
+    finally:
+        _deferred_refresh.reset(token)
+        for proc in pending:
+            session.call(proc)
+
+
+def request_refresh(session, proc: str):
+    """
+    Calls `proc` now, or marks it to be called when the enclosing `deferred_refresh` block exits.
+    """
+    pending = _deferred_refresh.get()
+    if pending is None:
+        session.call(proc)
+    else:
+        pending[proc] = None
@@ -14,6 +14,7 @@ class Setting(BaseOpsCenterModel):
         "storage_cost": float,
         "serverless_credit_cost": float,
         "compute_credit_cost": float,
+        "query_monitor_retention_days": float,
     }
 
     key: str
@@ -66,6 +67,8 @@ class Setting(BaseOpsCenterModel):
         elif key in ["storage_cost", "serverless_credit_cost", "compute_credit_cost"]:
             # Make sure we have a sane cost
             cls.verify_cost(v)
+        elif key == "query_monitor_retention_days":
+            cls.verify_retention(v)
 
         return values
 
@@ -76,3 +79,9 @@ class Setting(BaseOpsCenterModel):
     @classmethod
     def verify_cost(cls, cost: float):
         assert cost > 0, f"Credit cost must be greater than 0 (got {cost})"
+
+    @classmethod
+    def verify_retention(cls, days: float):
+        assert days >= 1 and days == int(
+            days
+        ), f"Retention must be a whole number of days, at least 1 (got {days})"
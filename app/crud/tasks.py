@@ -9,6 +9,7 @@ class Task(BaseModel):
         "SIMPLE_DATA_EVENTS_MAINTENANCE",
         "SFUSER_MAINTENANCE",
         "USER_LIMITS_MAINTENANCE",
+        "PROBE_ACTIONS_MAINTENANCE",
     )
 
     task_name: str
@@ -1,6 +1,19 @@
 import datetime
+import pandas as pd
 from enum import Enum
-from .base import handle_type, unwrap_value
+from typing import ClassVar
+from unittest.mock import MagicMock
+from snowflake.snowpark.functions import col
+from snowflake.snowpark.table import MergeResult
+from .base import BaseOpsCenterModel, build_predicate, handle_type, unwrap_value
+from .wh_sched import WarehouseSchedules
+
+
+class ExampleModel(BaseOpsCenterModel):
+    __test__ = False
+    table_name: ClassVar[str] = "EXAMPLE"
+    name: str
+    value: int
 
 
 class TestStrEnum(str, Enum):
@@ -33,3 +46,117 @@ def test_unwrap_values():
     assert 1 == unwrap_value(1)
     assert "a" == unwrap_value(TestStrEnum.A)
     assert 1 == unwrap_value(TestIntEnum.ONE)
+
+
+def test_build_predicate():
+    assert build_predicate(None) is None
+
+    predicate = build_predicate({"name": "COMPUTE_WH", "weekday": True})
+    assert repr(predicate) == 'Column("NAME" = LITERAL AND "WEEKDAY" = LITERAL)'
+
+    predicate = build_predicate({"name": ["A", "B"], "comment": None})
+    assert repr(predicate) == 'Column(INEXPRESSION AND "COMMENT" IS NULL)'
+
+    # Column expressions are passed through untouched
+    expr = col("name") == "COMPUTE_WH"
+    assert build_predicate(expr) is expr
+
+
+def test_batch_read_pushdown():
+    session = MagicMock()
+    table = session.table.return_value
+    table.filter.return_value = table
+    table.sort.return_value = table
+    table.limit.return_value = table
+    table.to_pandas.return_value = pd.DataFrame({"NAME": ["a"], "VALUE": [1]})
+
+    rows = ExampleModel.batch_read(session, sortby="name", where={"name": "a"}, limit=5)
+
+    session.table.assert_called_once_with("INTERNAL.EXAMPLE")
+    assert table.filter.call_count == 1
+    assert table.sort.call_count == 1
+    table.limit.assert_called_once_with(5)
+    assert rows == [ExampleModel(name="a", value=1)]
+
+
+def test_batch_read_without_pushdown():
+    session = MagicMock()
+    table = session.table.return_value
+    table.to_pandas.return_value = pd.DataFrame({"NAME": ["a", "b"], "VALUE": [1, 2]})
+
+    rows = ExampleModel.batch_read(session)
+
+    table.filter.assert_not_called()
+    table.sort.assert_not_called()
+    table.limit.assert_not_called()
+    assert len(rows) == 2
+
+
+class ExampleKeyedModel(ExampleModel):
+    __test__ = False
+
+    def get_id_col(self) -> str:
+        return "name"
+
+
+def test_batch_upsert():
+    session = MagicMock()
+    target = session.table.return_value
+    target.__getitem__.side_effect = lambda c: col(f"t_{c}")
+    source = session.create_dataframe.return_value
+    source.__getitem__.side_effect = lambda c: col(f"s_{c}")
+    target.merge.return_value = MergeResult(
+        rows_inserted=1, rows_updated=1, rows_deleted=0
+    )
+
+    data = [
+        ExampleKeyedModel(name="a", value=1),
+        ExampleKeyedModel(name="b", value=2),
+        ExampleKeyedModel(name="c", value=3),
+    ]
+    counts = ExampleKeyedModel.batch_upsert(session, data)
+
+    assert len(session.create_dataframe.call_args[0][0]) == 3
+    session.table.assert_called_once_with("INTERNAL.EXAMPLE")
+    target.merge.assert_called_once()
+    merge_source, join_expr, clauses = target.merge.call_args[0]
+    assert merge_source is source
+    assert repr(join_expr) == 'Column("T_NAME" = "S_NAME")'
+    assert len(clauses) == 2
+    assert counts == dict(inserted=1, updated=1, unchanged=1)
+
+
+def test_batch_upsert_types_all_null_columns(session):
+    sf = MagicMock()
+    sf.create_dataframe.side_effect = session.create_dataframe
+    sf.table.return_value.__getitem__.side_effect = lambda c: col(f"t_{c}")
+    schedules = [
+        WarehouseSchedules(
+            name=f"WH_{i}",
+            size="X-Small",
+            suspend_minutes=1,
+            resume=True,
+            scale_min=0,
+            scale_max=0,
+            warehouse_mode="Standard",
+        )
+        for i in range(2)
+    ]
+    assert all(s.comment is None and s.last_modified is None for s in schedules)
+
+    WarehouseSchedules.batch_upsert(sf, schedules)
+
+    (source, *_), _ = sf.table.return_value.merge.call_args
+    stmt = source.queries["queries"][-1]
+    # Columns without a value in any row are still typed like the table, not NullType
+    assert "'Standard' :: STRING, NULL :: STRING, True :: BOOLEAN" in stmt
+    assert 'to_timestamp("LAST_MODIFIED")' in stmt
+    assert 'to_time("START_AT")' in stmt
+
+
+def test_batch_upsert_empty():
+    session = MagicMock()
+    assert ExampleKeyedModel.batch_upsert(session, []) == dict(
+        inserted=0, updated=0, unchanged=0
+    )
+    session.table.assert_not_called()
@@ -0,0 +1,172 @@
+import datetime
+import pytest
+from unittest.mock import MagicMock
+from uuid import uuid4
+from pydantic import ValidationError
+from . import conditions
+from .conditions import (
+    DUMMY_QUERY_HISTORY_UDTF,
+    ENRICHED_QUERY_HISTORY,
+    check_expression,
+    has_column,
+    load_schema_snapshot,
+)
+from .labels import Label
+from .probes import Probe
+
+pytest.importorskip("sqlglot")
+
+_COLUMNS = ["QUERY_ID", "USER_NAME", "WAREHOUSE_NAME", "START_TIME", "QTAG_FILTER"]
+_REFRESHED_AT = datetime.datetime(2023, 10, 1)
+
+
+@pytest.fixture(autouse=True)
+def snapshot():
+    sf = MagicMock()
+    sf.sql.return_value.collect.return_value = [
+        (source, c, _REFRESHED_AT)
+        for source in (ENRICHED_QUERY_HISTORY, DUMMY_QUERY_HISTORY_UDTF)
+        for c in _COLUMNS
+    ]
+    assert load_schema_snapshot(sf)
+    # Cached for the process, a second load does not query again
+    assert load_schema_snapshot(sf)
+    assert sf.sql.call_count == 1
+    yield
+    conditions.clear_schema_snapshot()
+
+
+def test_valid_condition():
+    check = check_expression(
+        "user_name ilike '%josh%' and start_time > dateadd(day, -1, current_timestamp())",
+        ENRICHED_QUERY_HISTORY,
+    )
+    assert check.valid
+
+
+def test_unknown_column():
+    check = check_expression("usr_name = 'josh'", ENRICHED_QUERY_HISTORY)
+    assert check.valid is False
+    assert "usr_name" in check.message
+
+
+def test_quoted_identifiers_are_case_sensitive():
+    assert check_expression('"USER_NAME" = 1', ENRICHED_QUERY_HISTORY).valid
+    assert check_expression('"user_name" = 1', ENRICHED_QUERY_HISTORY).valid is False
+
+
+@pytest.mark.parametrize(
+    "condition",
+    [
+        "tools.qtag_value(qtag_filter, 'dbt', 'node_id') is not null",
+        "my_udf(user_name)",
+        "user_name in (select name from other_table)",
+        "user_name = ",
+        "q.user_name = 'x'",
+    ],
+)
+def test_ambiguous_conditions_defer_to_snowflake(condition):
+    assert check_expression(condition, ENRICHED_QUERY_HISTORY).valid is None
+
+
+def test_unknown_source_defers_to_snowflake():
+    assert check_expression("user_name = 'x'", "SOMETHING_ELSE").valid is None
+    assert has_column("SOMETHING_ELSE", "USER_NAME") is None
+
+
+def test_label_passing_locally_is_still_compiled(session):
+    Label.parse_obj(
+        dict(
+            name="label1",
+            condition="user_name = 'josh@sundeck.io'",
+            label_created_at=datetime.datetime.now(),
+            label_modified_at=datetime.datetime.now(),
+            label_id=str(uuid4()),
+        )
+    )
+    # The column names resolve, but only Snowflake checks the types. The name is checked with the snapshot.
+    assert len(session._sql) == 1
+    assert "from reporting.enriched_query_history where false" in session._sql[0]
+
+
+def test_label_name_conflicts_with_column(session):
+    with pytest.raises(ValidationError, match="same as a column"):
+        Label.parse_obj(
+            dict(
+                name="USER_NAME",
+                condition="user_name = 'josh@sundeck.io'",
+                label_created_at=datetime.datetime.now(),
+                label_modified_at=datetime.datetime.now(),
+                label_id=str(uuid4()),
+            )
+        )
+    # Only the condition is compiled, the name is checked with the snapshot
+    assert len(session._sql) == 1
+    assert session._sql[0].startswith("select case when user_name")
+
+
+def test_probe_rejects_unknown_column_locally(session):
+    with pytest.raises(ValidationError, match="invalid identifier 'usr_name'"):
+        Probe.parse_obj(
+            dict(
+                name="probe1",
+                condition="usr_name = 'josh'",
+                probe_created_at=datetime.datetime.now(),
+                probe_modified_at=datetime.datetime.now(),
+            )
+        )
+    assert session._sql == []
+
+
+def test_probe_with_udf_compiles_in_snowflake(session):
+    Probe.parse_obj(
+        dict(
+            name="probe1",
+            condition="tools.is_ad_hoc_query(query_id, 10)",
+            probe_created_at=datetime.datetime.now(),
+            probe_modified_at=datetime.datetime.now(),
+        )
+    )
+    assert len(session._sql) == 1
+
+
+@pytest.mark.parametrize("condition", ["user_name > 'abc'", "user_name + 1 > 0"])
+def test_probe_passing_locally_is_still_compiled(session, condition):
+    # Columns resolve, so these pass locally even though the types may not line up
+    assert check_expression(condition, DUMMY_QUERY_HISTORY_UDTF).valid
+    Probe.parse_obj(
+        dict(
+            name="probe1",
+            condition=condition,
+            probe_created_at=datetime.datetime.now(),
+            probe_modified_at=datetime.datetime.now(),
+        )
+    )
+    assert len(session._sql) == 1
+    assert condition in session._sql[0]
+
+
+def test_snapshot_reloads_after_refresh(monkeypatch):
+    refreshed_at = _REFRESHED_AT + datetime.timedelta(days=1)
+    sf = MagicMock()
+    sf.sql.return_value.collect.side_effect = [
+        # The refresh time has not changed
+        [(_REFRESHED_AT,)],
+        # The views were migrated and gained a column
+        [(refreshed_at,)],
+        [(ENRICHED_QUERY_HISTORY, c, refreshed_at) for c in _COLUMNS + ["NEW_COL"]],
+    ]
+    assert check_expression("new_col = 1", ENRICHED_QUERY_HISTORY).valid is False
+
+    # Within the TTL the snapshot is used as-is
+    assert load_schema_snapshot(sf)
+    assert sf.sql.call_count == 0
+
+    monkeypatch.setattr(conditions, "SCHEMA_SNAPSHOT_TTL_SECONDS", 0)
+    assert load_schema_snapshot(sf)
+    assert sf.sql.call_count == 1
+    assert check_expression("new_col = 1", ENRICHED_QUERY_HISTORY).valid is False
+
+    assert load_schema_snapshot(sf)
+    assert sf.sql.call_count == 3
+    assert check_expression("new_col = 1", ENRICHED_QUERY_HISTORY).valid
@@ -1,6 +1,6 @@
 import datetime
 import pandas as pd
-from typing import List, Callable, Optional
+from typing import Callable, Dict, List, Optional
 import uuid
 from unittest import mock
 from snowflake.snowpark.exceptions import SnowparkSQLException
@@ -44,8 +44,8 @@ class MockSession:
 
         return self
 
-    def create_dataframe(self, data: List[Row]):
-        return self._session.create_dataframe(data)
+    def create_dataframe(self, data: List[Row], schema=None):
+        return self._session.create_dataframe(data, schema=schema)
 
 
 class WarehouseScheduleFixture:
@@ -54,6 +54,7 @@ class WarehouseScheduleFixture:
     last_task_run: datetime.datetime
     now: datetime.datetime
     schedule_filter: Optional[Callable[[pd.DataFrame], pd.DataFrame]]
+    applied_state: Dict[str, str]
 
     def __init__(self):
         # Make sure each test method gets a fresh fixture
@@ -62,6 +63,7 @@ class WarehouseScheduleFixture:
         self.last_task_run = datetime.datetime.now() - datetime.timedelta(minutes=15)
         self.now = datetime.datetime.now()
         self.schedule_filter = None
+        self.applied_state = {}
 
     _schedules_columns = [
         "id_val",
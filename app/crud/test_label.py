@@ -2,7 +2,12 @@ import pytest
 from datetime import datetime
 import math
 import pandas as pd
-from .labels import Label
+from unittest.mock import MagicMock, patch
+from snowflake.snowpark.exceptions import SnowparkSQLException
+from . import labels
+from .common import apply_entities
+from .labels import Label, clear_preview_cache, preview_label, validate_batch
+from .session import deferred_validation
 from uuid import uuid4
 
 
@@ -145,9 +150,311 @@ def test_from_pandas():
     )
 
 
+def _persisted_labels_df(n: int) -> pd.DataFrame:
+    now = pd.Timestamp("2023-09-20 09:55:43.469000")
+    return pd.DataFrame(
+        [
+            {
+                "NAME": f"label{i}",
+                "GROUP_NAME": None,
+                "GROUP_RANK": math.nan,
+                "LABEL_CREATED_AT": now,
+                "CONDITION": f"user_name = 'user{i}@sundeck.io'",
+                "ENABLED": True,
+                "LABEL_MODIFIED_AT": now if i % 2 else pd.NaT,
+                "IS_DYNAMIC": False,
+                "LABEL_ID": str(uuid4()),
+            }
+            for i in range(n)
+        ]
+    )
+
+
+def test_from_df_trusted(session):
+    df = _persisted_labels_df(2)
+    labels = Label.from_df(df, trusted=True)
+
+    assert session._sql == [], "Trusted hydration should not issue any queries"
+    assert [label.name for label in labels] == ["label0", "label1"]
+    assert labels[0].group_rank is None
+    assert labels[0].label_modified_at is None
+    assert isinstance(labels[1].label_modified_at, datetime)
+    assert not isinstance(labels[1].label_modified_at, pd.Timestamp)
+    assert labels[1].dict()["condition"] == "user_name = 'user1@sundeck.io'"
+
+
+def test_trusted_hydration_skips_validation(session):
+    df = _persisted_labels_df(300)
+
+    validated = Label.from_df(df)
+    validated_queries = len(session._sql)
+
+    session._sql.clear()
+    trusted = Label.from_df(df, trusted=True)
+
+    # Validation costs two queries per label, trusted hydration none
+    assert validated_queries == 2 * len(validated)
+    assert session._sql == [], "Trusted hydration should not issue any queries"
+    # Trusted hydration normalizes the NaT of labels which were never modified to None
+    assert [label.dict() for label in trusted] == [
+        {k: None if v is pd.NaT else v for k, v in label.dict().items()}
+        for label in validated
+    ]
+
+
 def _expected_condition_check_query(condition: str) -> str:
     return f"select case when {condition} then 1 else 0 end from reporting.enriched_query_history where false".lower()
 
 
 def _expected_name_check_query(name: str) -> str:
     return f'select "{name}" from reporting.enriched_query_history where false'.lower()
+
+
+def _saved_label(**kwargs) -> Label:
+    with deferred_validation():
+        return Label.parse_obj(_get_label(**kwargs))
+
+
+def test_deferred_validation_skips_queries(session):
+    _saved_label()
+    assert session._sql == [], "Deferred validation should not issue any queries"
+
+
+def test_write_is_one_statement():
+    sf = MagicMock()
+    sf.sql.return_value.collect.return_value = [[1]]
+    _saved_label().write(sf)
+
+    assert sf.sql.call_count == 1
+    stmt = sf.sql.call_args[0][0]
+    assert stmt.strip().startswith("INSERT INTO INTERNAL.LABELS")
+    assert _expected_condition_check_query("user_name = 'josh@sundeck.io'") in stmt
+    sf.call.assert_called_once_with("INTERNAL.UPDATE_LABEL_VIEW")
+
+
+def test_write_explains_name_conflict():
+    sf = MagicMock()
+    sf.sql.return_value.collect.side_effect = [[[0]], [[1, 0]]]
+    with pytest.raises(AssertionError, match="'label1' already exists"):
+        _saved_label().write(sf)
+    sf.call.assert_not_called()
+
+
+def test_write_explains_column_conflict():
+    sf = MagicMock()
+    sf.sql.return_value.collect.side_effect = [[[0]], [[0, 1]]]
+    with pytest.raises(AssertionError, match="same as a column"):
+        _saved_label(name="QUERY_ID").write(sf)
+
+
+def test_write_explains_invalid_condition():
+    sf = MagicMock()
+    sf.sql.return_value.collect.side_effect = [
+        SnowparkSQLException("invalid identifier 'BAD_COLUMN'"),
+        SnowparkSQLException("invalid identifier 'BAD_COLUMN'"),
+    ]
+    with pytest.raises(AssertionError, match="Invalid label condition"):
+        _saved_label(condition="bad_column = 1").write(sf)
+    assert _expected_condition_check_query("bad_column = 1") == (
+        sf.sql.call_args[0][0].lower()
+    )
+
+
+def test_write_reraises_other_errors():
+    sf = MagicMock()
+    lock_timeout = SnowparkSQLException("Statement reached its statement timeout")
+    # The condition compiles on its own, so it is not to blame
+    sf.sql.return_value.collect.side_effect = [lock_timeout, []]
+    with pytest.raises(SnowparkSQLException) as e:
+        _saved_label().write(sf)
+    assert e.value is lock_timeout
+    sf.call.assert_not_called()
+
+    sf.sql.return_value.collect.side_effect = [lock_timeout, []]
+    with pytest.raises(SnowparkSQLException):
+        Label.construct(name="label1").update(sf, _saved_label(name="label2"))
+
+
+def test_update_is_one_statement():
+    sf = MagicMock()
+    sf.sql.return_value.collect.return_value = [[1]]
+    old = Label.construct(name="label1")
+    new = _saved_label(name="label2")
+    assert old.update(sf, new) is new
+
+    assert sf.sql.call_count == 1
+    stmt, kwargs = sf.sql.call_args[0][0], sf.sql.call_args[1]
+    assert stmt.strip().startswith("UPDATE INTERNAL.LABELS SET")
+    # The new name is checked for conflicts and against the view's columns
+    assert kwargs["params"][-3:] == ["label2", "label1", "label2"]
+    sf.call.assert_called_once_with("INTERNAL.UPDATE_LABEL_VIEW")
+
+
+def test_apply_entities_refreshes_view_once():
+    sf = MagicMock()
+    sf.sql.return_value.collect.return_value = [[1]]
+    outcomes = apply_entities(
+        sf,
+        "LABEL",
+        [
+            dict(action="create", entity=_get_label(name="label1")),
+            dict(action="create", entity=_get_label(name="label2")),
+            dict(action="update", name="label2", entity=_get_label(name="label3")),
+            dict(action="delete", name="label1"),
+            dict(action="rename", name="label3"),
+        ],
+    )
+
+    assert outcomes == [None, None, None, None, "Unknown action: rename"]
+    sf.call.assert_called_once_with("INTERNAL.UPDATE_LABEL_VIEW")
+
+
+def test_apply_entities_no_changes():
+    sf = MagicMock()
+    outcomes = apply_entities(sf, "LABEL", [dict(action="create", entity={})])
+
+    assert outcomes[0].startswith("Failed to create label")
+    sf.call.assert_not_called()
+
+
+def test_update_explains_missing_label():
+    sf = MagicMock()
+    sf.sql.return_value.collect.side_effect = [[[0]], [[0, 0, 0]]]
+    with pytest.raises(AssertionError, match="'label1' does not exist"):
+        Label.construct(name="label1").update(sf, _saved_label(name="label2"))
+
+
+class _CompilingSession:
+    """
+    Fails any statement which references `bad_column`, like Snowflake would when compiling it.
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    def sql(self, stmt):
+        self.statements.append(stmt)
+        return self
+
+    def collect(self):
+        if "information_schema.columns" in self.statements[-1].lower():
+            return [["QUERY_ID"], ["USER_NAME"]]
+        if "bad_column" in self.statements[-1]:
+            raise SnowparkSQLException("invalid identifier 'BAD_COLUMN'")
+        return []
+
+
+def _predefined(n: int, bad: int = None) -> list:
+    return [
+        _saved_label(
+            name=f"label{i}",
+            condition="bad_column = 1" if i == bad else f"user_name = 'user{i}'",
+        )
+        for i in range(n)
+    ]
+
+
+def test_validate_batch_compiles_all_conditions_at_once():
+    sf = _CompilingSession()
+    validate_batch(sf, _predefined(16))
+    # One statement for the view's columns, one for every condition
+    assert len(sf.statements) == 2
+    assert sf.statements[1].count(" as c") == 16
+
+
+def test_validate_batch_bisects_to_invalid_label():
+    sf = _CompilingSession()
+    with pytest.raises(AssertionError, match="label11"):
+        validate_batch(sf, _predefined(16, bad=11))
+    # columns, all 16, then 0-7, 8-15, 8-11, 8-9, 10-11, 10 and 11
+    assert len(sf.statements) == 9
+
+
+def test_validate_batch_accepts_labels_too_many_to_compile_at_once():
+    class _LimitedSession(_CompilingSession):
+        def collect(self):
+            if self.statements[-1].count(" as c") > 8:
+                raise SnowparkSQLException("statement is too large")
+            return super().collect()
+
+    sf = _LimitedSession()
+    validate_batch(sf, _predefined(16))
+    # columns, all 16, then 0-7 and 8-15 which both compile
+    assert len(sf.statements) == 4
+
+
+def test_validate_batch_rejects_column_names():
+    sf = _CompilingSession()
+    with pytest.raises(
+        AssertionError, match="'USER_NAME' cannot be the same as a column"
+    ):
+        validate_batch(sf, [_saved_label(name="USER_NAME")])
+
+
+def _preview_session(aggregate):
+    sf = MagicMock()
+    groups = MagicMock()
+    groups.collect.return_value = [
+        (
+            "Size",
+            "case when a then 'Big' when b then 'Small' else 'Other' end",
+            "Big",
+        ),
+        (
+            "Size",
+            "case when a then 'Big' when b then 'Small' else 'Other' end",
+            "Small",
+        ),
+    ]
+    agg = MagicMock()
+    agg.collect.return_value = [aggregate]
+    sf.sql.side_effect = [groups, agg]
+    return sf
+
+
+def test_preview_label():
+    clear_preview_cache()
+    sf = _preview_session((12, 3.5, 100, 20.0, 4, 8))
+    preview = preview_label(sf, "rows_produced > 100", days=30, sample_percent=10)
+
+    assert preview.queries == 120
+    assert preview.cost == pytest.approx(35.0)
+    assert preview.total_queries == 1000
+    assert preview.overlaps == {("Size", "Big"): 40, ("Size", "Small"): 80}
+
+    stmt, kwargs = sf.sql.call_args[0][0], sf.sql.call_args[1]
+    assert "SAMPLE (10)" in stmt
+    assert stmt.count("case when a then") == 1, "Each group is evaluated once"
+    assert kwargs["params"] == ["Big", "Small", 30]
+
+    # The same condition over the same slice is served from the cache, without any queries
+    assert (
+        preview_label(sf, "rows_produced > 100", days=30, sample_percent=10) is preview
+    )
+    assert sf.sql.call_count == 2
+
+
+def test_label_write_clears_preview_cache():
+    clear_preview_cache()
+    sf = _preview_session((12, 3.5, 100, 20.0, 4, 8))
+    preview = preview_label(sf, "rows_produced > 100")
+
+    write_session = MagicMock()
+    write_session.sql.return_value.collect.return_value = [(1,)]
+    with patch.object(labels, "request_refresh"):
+        _saved_label(name="Big").write(write_session)
+
+    sf.sql.side_effect = None
+    sf.sql.return_value.collect.side_effect = [[], [(1, 0.5, 10, 2.0)]]
+    assert preview_label(sf, "rows_produced > 100") != preview
+
+
+def test_preview_label_invalid_condition():
+    clear_preview_cache()
+    sf = MagicMock()
+    sf.sql.return_value.collect.side_effect = [
+        [],
+        SnowparkSQLException("invalid identifier 'FOO'"),
+    ]
+    with pytest.raises(AssertionError, match="Invalid label condition"):
+        preview_label(sf, "foo > 1")
@@ -1,7 +1,10 @@
 import datetime
 import pytest
 from pydantic import ValidationError
-from .probes import NotificationMethod, Probe
+from snowflake.snowpark.exceptions import SnowparkSQLException
+from unittest.mock import MagicMock
+from .common import create_entity
+from .probes import MAX_BACKTEST_CHECKS, MONITOR_INTERVAL_MS, NotificationMethod, Probe
 
 
 def test_basic_probe(session):
@@ -271,5 +274,105 @@ def test_disallow_duplicate_slack_addrs(tc):
         ), "Expected to see the duplicated item in the exception's message"
 
 
+def test_create_probe_does_not_load_schema_snapshot():
+    sf = MagicMock()
+    assert (
+        create_entity(
+            sf,
+            "QUERY_MONITOR",
+            {
+                "name": "test_probe",
+                "condition": "bytes_scanned > 1000000",
+                "probe_created_at": datetime.datetime.now(),
+                "probe_modified_at": datetime.datetime.now(),
+            },
+        )
+        is None
+    )
+
+    statements = [c[0][0].lower() for c in sf.sql.call_args_list]
+    assert not any("condition_schema" in stmt for stmt in statements)
+    # The condition is compiled once, before the write
+    assert (
+        sum("dummy_query_history_udtf where false" in stmt for stmt in statements) == 1
+    )
+
+
+def test_backtest():
+    sf = MagicMock()
+    start = datetime.datetime(2023, 9, 1)
+    end = datetime.datetime(2023, 9, 8)
+    df = Probe.backtest(sf, "bytes_scanned > 1000000", start, end)
+
+    assert df is sf.sql.return_value
+    # Compiled against the monitor's source, then against the history it is backtested over
+    compiles = [c[0][0] for c in sf.sql.call_args_list[:2]]
+    assert "from INTERNAL.DUMMY_QUERY_HISTORY_UDTF where false" in compiles[0]
+    assert "from reporting.enriched_query_history where false" in compiles[1]
+    stmt, kwargs = sf.sql.call_args[0][0], sf.sql.call_args[1]
+    assert "FROM reporting.enriched_query_history" in stmt
+    assert "coalesce((bytes_scanned > 1000000), false)" in stmt
+    assert "GROUP BY hour" in stmt
+    # Long running queries are checked a bounded number of times
+    assert f"least(ceil(h.total_elapsed_time / ?), {MAX_BACKTEST_CHECKS + 1})" in stmt
+    assert kwargs["params"] == (start, end, MONITOR_INTERVAL_MS, MONITOR_INTERVAL_MS)
+
+
+def test_backtest_evaluates_current_timestamp_when_seen():
+    pytest.importorskip("sqlglot")
+    sf = MagicMock()
+    start = datetime.datetime(2023, 9, 1)
+    end = datetime.datetime(2023, 9, 8)
+    condition = (
+        "datediff(minute, start_time, CURRENT_TIMESTAMP()) > 5 and end_time < current_timestamp "
+        "and query_tag <> 'current_timestamp'"
+    )
+    Probe.backtest(sf, condition, start, end)
+
+    # Both sources compile the condition as written
+    assert all(condition in c[0][0] for c in sf.sql.call_args_list[:2])
+    stmt = sf.sql.call_args[0][0]
+    assert (
+        "coalesce((DATEDIFF(MINUTE, start_time, monitor_evaluated_at) > 5 AND end_time < monitor_evaluated_at "
+        "AND query_tag <> 'current_timestamp'), false)" in stmt
+    )
+
+
+def test_backtest_rejects_condition_invalid_for_history():
+    class _Session(MagicMock):
+        def sql(self, stmt, **kwargs):
+            if "from reporting.enriched_query_history where false" in stmt:
+                raise SnowparkSQLException("invalid identifier 'ERROR_CODE'")
+            return MagicMock()
+
+    with pytest.raises(AssertionError, match="invalid identifier 'ERROR_CODE'"):
+        Probe.backtest(
+            _Session(),
+            "error_code = 1",
+            datetime.datetime(2023, 9, 1),
+            datetime.datetime(2023, 9, 8),
+        )
+
+
+def test_backtest_rejects_invalid_condition():
+    sf = MagicMock()
+    sf.sql.return_value.collect.side_effect = SnowparkSQLException(
+        "invalid identifier 'COST'"
+    )
+    start = datetime.datetime(2023, 9, 1)
+    end = datetime.datetime(2023, 9, 8)
+    with pytest.raises(AssertionError, match="Invalid query monitor condition"):
+        Probe.backtest(sf, "cost > 1", start, end)
+    assert sf.sql.call_count == 1
+
+
+def test_backtest_rejects_empty_range():
+    sf = MagicMock()
+    start = datetime.datetime(2023, 9, 1)
+    with pytest.raises(AssertionError, match="must start before it ends"):
+        Probe.backtest(sf, "bytes_scanned > 1000000", start, start)
+    sf.sql.assert_not_called()
+
+
 def _expected_condition_verification_sql(p: Probe) -> str:
     return f"select {p.condition}"
@@ -86,3 +86,12 @@ def test_serverless_credit_cost():
             key="serverless_credit_cost",
             value="asdf",
         )
+
+
+def test_query_monitor_retention_days():
+    _ = Setting(key="query_monitor_retention_days", value="30")
+
+    with pytest.raises(ValidationError):
+        _ = Setting(key="query_monitor_retention_days", value=0.5)
+    with pytest.raises(ValidationError):
+        _ = Setting(key="query_monitor_retention_days", value=7.5)
@@ -12,6 +12,7 @@ from .tasks import Task
         ("WaREHouse_EVENTS_maintenance "),
         ("SFUSER_MAINTENANCE"),
         ("USER_LIMITS_MAINTENANCE"),
+        ("PROBE_ACTIONS_MAINTENANCE"),
     ],
 )
 def test_task_enable(session: MockSession, name: str):
@@ -0,0 +1,121 @@
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+from snowflake.snowpark import DataFrame, Row
+from snowflake.snowpark.functions import col, sum as sp_sum
+from .common import profile_entity
+from uuid import uuid4
+from .labels import Label
+from .session import snowpark_session, get_current_session
+from .tracing import (
+    Tracer,
+    TracedDataFrame,
+    TracedSession,
+    fingerprint,
+    normalize_statement,
+)
+
+
+def test_fingerprint_ignores_literals():
+    a = "select count(*) from internal.labels where name = 'foo' and group_rank = 10"
+    b = "SELECT count(*)   FROM internal.labels\nWHERE name = 'bar' AND group_rank = 2"
+    assert fingerprint(a) == fingerprint(b)
+    assert (
+        normalize_statement(a)
+        == "select count(*) from internal.labels where name = ? and group_rank = ?"
+    )
+    assert fingerprint(a) != fingerprint("select 1 from internal.probes")
+
+
+def test_traced_session_records_statements(session):
+    tracer = Tracer()
+    with snowpark_session(session, tracer, "create_entity LABEL") as txn:
+        assert isinstance(txn, TracedSession)
+        assert get_current_session() is txn
+        Label.parse_obj(
+            dict(
+                name="label1",
+                condition="user_name = 'josh@sundeck.io'",
+                label_created_at=datetime.now(),
+                label_modified_at=datetime.now(),
+                label_id=str(uuid4()),
+            )
+        )
+
+    # The condition check and the name check both ran through the traced session
+    assert len(session._sql) == 2
+    assert tracer.totals()["create_entity LABEL"]["statements"] == 2
+    summary = tracer.summary()
+    assert len(summary) == 2
+    assert all(s["count"] == 1 for s in summary)
+    assert all(s["operation"] == "create_entity LABEL" for s in summary)
+
+
+def test_untraced_session_is_unwrapped(session):
+    with snowpark_session(session) as txn:
+        assert txn is session
+        assert get_current_session() is session
+
+
+def test_count_has_no_row_count():
+    tracer = Tracer()
+    df = MagicMock()
+    df.count.return_value = 1000
+    df.collect.return_value = [(1000,)]
+    traced = TracedDataFrame(df, tracer, "select * from internal.labels")
+
+    assert traced.count() == 1000
+    assert traced.collect() == [(1000,)]
+    assert [e["rows"] for e in tracer.events] == [None, 1]
+
+
+def test_every_dataframe_method_is_traced(session):
+    tracer = Tracer()
+    traced = TracedSession(session._session, tracer)
+    a = traced.create_dataframe([Row(k=1, v=2)])
+    b = traced.create_dataframe([Row(k=2, v=3)])
+
+    df = (
+        a.union_all(b)
+        .group_by("k")
+        .agg(sp_sum(col("v")).alias("x"))
+        .union(a.select("k", "v"))
+        .distinct()
+    )
+
+    assert isinstance(df, TracedDataFrame)
+    assert isinstance(df._df, DataFrame)
+    with patch.object(DataFrame, "collect", return_value=[Row(k=1, x=5)]):
+        assert df.collect() == [Row(k=1, x=5)]
+    assert len(tracer.events) == 1
+    assert tracer.events[0]["statement"].startswith(
+        "create_dataframe union_all group_by agg union distinct collect"
+    )
+
+
+def test_profile_is_rolled_back():
+    sf = MagicMock()
+    result = profile_entity(
+        sf,
+        "create",
+        "QUERY_MONITOR",
+        None,
+        {
+            "name": "test_probe",
+            "condition": "1=1",
+            "probe_created_at": datetime.now(),
+            "probe_modified_at": datetime.now(),
+        },
+    )
+
+    assert result["outcome"] is None
+    statements = [c[0][0].strip() for c in sf.sql.call_args_list]
+    assert statements[0] == "BEGIN"
+    assert statements[-1] == "ROLLBACK"
+    # The write's own transaction and the procedure called after it are left out
+    assert statements.count("BEGIN") == 1
+    assert "COMMIT" not in statements
+    sf.call.assert_not_called()
+    assert any(
+        s["statement"] == "call admin.update_probe_monitor_running"
+        for s in result["statements"]
+    )
@@ -5,12 +5,16 @@ import pandas as pd
 import pytest
 from pydantic import ValidationError
 from typing import List
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
+from snowflake.snowpark import Row
 from . import wh_sched
 from .base import unwrap_value
 from .wh_sched import (
     WarehouseSchedules,
+    WarehouseScheduleTemplate,
+    apply_schedule_template,
     delete_warehouse_schedule,
+    plan_schedule_template,
     merge_new_schedule,
     update_existing_schedule,
     verify_and_clean,
@@ -539,3 +543,163 @@ def test_last_modified_updated(session):
     )
 
     assert ws.last_modified is not None, "Update should set last_modified"
+
+
+def _show_warehouses_row(name: str, size: str) -> Row:
+    return Row(
+        name=name,
+        size=size,
+        auto_suspend=600,
+        auto_resume="true",
+        min_cluster_count=1,
+        max_cluster_count=1,
+        scaling_policy="STANDARD",
+    )
+
+
+def test_describe_warehouse_uses_one_snapshot(session):
+    wh_sched.clear_warehouse_snapshot()
+    rows = [
+        _show_warehouses_row("COMPUTE_WH", "X-Small"),
+        _show_warehouses_row("ETL_WH", "Large"),
+    ]
+    with patch.object(session, "collect", return_value=rows):
+        compute = wh_sched.describe_warehouse(session, "COMPUTE_WH")
+        etl = wh_sched.describe_warehouse(session, "etl_wh")
+
+        assert compute.size == "X-Small"
+        assert compute.suspend_minutes == 10
+        assert etl.size == "Large"
+        assert etl.name == "etl_wh"
+        assert session._sql == ["show warehouses"]
+
+        # A warehouse missing from the snapshot is looked up once more before giving up
+        with pytest.raises(ValueError):
+            wh_sched.describe_warehouse(session, "MISSING_WH")
+        assert session._sql == ["show warehouses", "show warehouses"]
+    wh_sched.clear_warehouse_snapshot()
+
+
+def _make_template() -> List[WarehouseScheduleTemplate]:
+    return [
+        WarehouseScheduleTemplate.parse_obj(
+            _make_schedule(
+                "business_hours", start, finish, weekday, size=size, enabled=False
+            ).dict()
+        )
+        for start, finish, weekday, size in [
+            (datetime.time(0, 0), datetime.time(8, 0), True, "X-Small"),
+            (datetime.time(8, 0), datetime.time(18, 0), True, "Large"),
+            (datetime.time(18, 0), datetime.time(23, 59), True, "X-Small"),
+            (datetime.time(0, 0), datetime.time(23, 59), False, "X-Small"),
+        ]
+    ]
+
+
+def test_plan_schedule_template():
+    snapshot = {"COMPUTE_WH": {}, "ETL_WH": {}}
+    existing = [
+        _make_schedule("COMPUTE_WH", datetime.time(0, 0), datetime.time(23, 59), True),
+        _make_schedule("COMPUTE_WH", datetime.time(0, 0), datetime.time(23, 59), False),
+    ]
+
+    schedules = plan_schedule_template(
+        _make_template(), ["COMPUTE_WH", "etl_wh"], snapshot, existing
+    )
+
+    assert len(schedules) == 8
+    assert len(set(s.id_val for s in schedules)) == 8
+    for name, enabled in [("COMPUTE_WH", True), ("etl_wh", False)]:
+        for weekday in (True, False):
+            day = [s for s in schedules if s.name == name and s.weekday == weekday]
+            _assert_contiguous(day)
+            assert all(s.enabled == enabled for s in day)
+            assert all(s.last_modified for s in day)
+    assert [s.size for s in schedules if s.name == "etl_wh" and s.weekday] == [
+        "X-Small",
+        "Large",
+        "X-Small",
+    ]
+
+
+def test_plan_schedule_template_reports_every_error():
+    template = [t for t in _make_template() if t.weekday]
+
+    with pytest.raises(ValueError) as e:
+        plan_schedule_template(
+            template, ["COMPUTE_WH", "MISSING_WH"], {"COMPUTE_WH": {}}, []
+        )
+
+    msg = str(e.value)
+    assert "Warehouse 'MISSING_WH' was not found" in msg
+    assert "Failed to create schedule for COMPUTE_WH, Template has no weekend" in msg
+    assert "Failed to create schedule for MISSING_WH, Template has no weekend" in msg
+
+    with pytest.raises(ValueError):
+        plan_schedule_template([], ["COMPUTE_WH"], {"COMPUTE_WH": {}}, [])
+
+
+def test_plan_schedule_template_resolves_warehouse_names():
+    snapshot = {"ETL_WH": {"name": "ETL_WH"}}
+    existing = [
+        _make_schedule("ETL_WH", datetime.time(0, 0), datetime.time(23, 59), True),
+        _make_schedule("ETL_WH", datetime.time(0, 0), datetime.time(23, 59), False),
+    ]
+
+    schedules = plan_schedule_template(
+        _make_template(), ["etl_wh", "ETL_WH", "Etl_Wh"], snapshot, existing
+    )
+
+    # One set of schedules, under the warehouse's own name, which keeps it enabled
+    assert len(schedules) == 4
+    assert all(s.name == "ETL_WH" for s in schedules)
+    assert all(s.enabled for s in schedules)
+
+
+def test_apply_schedule_template_mixed_case():
+    session = MagicMock()
+    snapshot = {"ETL_WH": {"name": "ETL_WH"}}
+    with patch.object(
+        WarehouseScheduleTemplate, "find_all", return_value=_make_template()
+    ), patch.object(WarehouseSchedules, "batch_read", return_value=[]), patch.object(
+        WarehouseSchedules, "batch_write"
+    ) as batch_write, patch.object(
+        wh_sched, "warehouse_snapshot", return_value=snapshot
+    ), patch.object(
+        wh_sched, "after_schedule_change"
+    ) as after_schedule_change:
+        schedules = apply_schedule_template(
+            session, "business_hours", ["etl_wh", "ETL_WH"]
+        )
+
+    assert len(schedules) == 4
+    assert all(s.name == "ETL_WH" for s in schedules)
+    batch_write.assert_called_once_with(session, schedules)
+    after_schedule_change.assert_called_once_with(session, ["ETL_WH"])
+    # Rows of every casing of the name are replaced
+    (predicate,) = session.table.return_value.delete.call_args[0]
+    assert predicate._expression.columns.name == "upper"
+    assert [v.value for v in predicate._expression.values] == ["ETL_WH"]
+
+
+def test_apply_schedule_template_writes_once():
+    session = MagicMock()
+    warehouses = [f"WH_{i}" for i in range(200)]
+    snapshot = {wh: {} for wh in warehouses}
+    with patch.object(
+        WarehouseScheduleTemplate, "find_all", return_value=_make_template()
+    ), patch.object(WarehouseSchedules, "batch_read", return_value=[]), patch.object(
+        WarehouseSchedules, "batch_write"
+    ) as batch_write, patch.object(
+        wh_sched, "warehouse_snapshot", return_value=snapshot
+    ), patch.object(
+        wh_sched, "after_schedule_change"
+    ) as after_schedule_change:
+        schedules = apply_schedule_template(
+            session, "business_hours", warehouses + ["WH_0"]
+        )
+
+    assert len(schedules) == 200 * 4
+    batch_write.assert_called_once_with(session, schedules)
+    after_schedule_change.assert_called_once_with(session, warehouses)
+    session.table.return_value.delete.assert_called_once()
@@ -1,4 +1,5 @@
 import datetime
+import uuid
 from typing import List
 from contextlib import contextmanager
 import pandas as pd
@@ -19,7 +20,11 @@ def _mock_task(session, fixtures: WarehouseScheduleFixture):
         wh_sched, "log_to_table"
     ) as mock_log_to_table, patch.object(
         wh_sched, "run_statement"
-    ) as mock_run_statement:
+    ) as mock_run_statement, patch.object(
+        wh_sched, "get_applied_state"
+    ) as mock_get_applied_state, patch.object(
+        wh_sched, "record_applied_state"
+    ) as mock_record_applied_state:
         # self.now()
         mocked_now.return_value = fixtures.now
         # self.last_task_run()
@@ -40,6 +45,14 @@ def _mock_task(session, fixtures: WarehouseScheduleFixture):
         mock_run_statement.side_effect = lambda *args, **kwargs: fixtures.run_statement(
             args[1]
         )
+        # self.get_applied_state()
+        mock_get_applied_state.side_effect = lambda *args, **kwargs: dict(
+            fixtures.applied_state
+        )
+        # self.record_applied_state(applied, altered)
+        mock_record_applied_state.side_effect = (
+            lambda *args, **kwargs: fixtures.applied_state.update(args[1])
+        )
 
         yield wh_sched
 
@@ -358,6 +371,125 @@ def test_missed_task_execution(session, wh_sched_fixture):
         assert wh_sched_fixture.task_log[0].get("success"), "Task should have succeeded"
 
 
+def test_missed_task_execution_over_weekend_boundary(session, wh_sched_fixture):
+    """
+    A weekday schedule which started before a missed run should still be applied once it is the weekend.
+    """
+
+    # AUTOSCALE_WH only has weekday schedules
+    wh_sched_fixture.schedule_filter = lambda df: df[df["NAME"] == "AUTOSCALE_WH"]
+
+    # Friday afternoon, then the task doesn't run again until Saturday
+    wh_sched_fixture.last_task_run = datetime.datetime.combine(
+        datetime.date(2023, 9, 29), datetime.time(16, 45)
+    )
+    wh_sched_fixture.now = datetime.datetime.combine(
+        datetime.date(2023, 9, 30), datetime.time(0, 15)
+    )
+
+    with _mock_task(session, wh_sched_fixture) as task:
+        # Run the task
+        alter_warehouse_block = task.run(session)
+
+        # The Friday 17:00 schedule should have been applied
+        statements = _extract_alter_statements(alter_warehouse_block)
+        assert len(statements) == 1
+        assert "alter warehouse AUTOSCALE_WH set".lower() in statements[0].lower()
+        assert "MAX_CLUSTER_COUNT = 1".lower() in statements[0].lower()
+
+
+def test_applied_schedule_is_skipped(session, wh_sched_fixture):
+    """
+    A schedule which was already applied to the warehouse should not be compared or applied again.
+    """
+    wh_sched_fixture.schedule_filter = lambda df: df[df["NAME"] == "COMPUTE_WH"]
+    wh_sched_fixture.last_task_run = datetime.datetime.combine(
+        datetime.date(2023, 9, 26), datetime.time(8, 45)
+    )
+    wh_sched_fixture.now = datetime.datetime.combine(
+        datetime.date(2023, 9, 26), datetime.time(9, 0)
+    )
+
+    with _mock_task(session, wh_sched_fixture) as task:
+        alter_warehouse_block = task.run(session)
+        assert len(_extract_alter_statements(alter_warehouse_block)) == 1
+        assert (
+            "alter warehouse COMPUTE_WH set"
+            in wh_sched_fixture.applied_state["COMPUTE_WH"]
+        )
+        assert "WAREHOUSE_SIZE = XLARGE" in wh_sched_fixture.applied_state["COMPUTE_WH"]
+
+        # The task runs over the same boundary again, the warehouse is not even described
+        with patch.object(wh_sched, "describe_warehouse") as mock_describe_warehouse:
+            alter_warehouse_block = task.run(session)
+            mock_describe_warehouse.assert_not_called()
+        assert alter_warehouse_block == ""
+        assert wh_sched_fixture.task_log[-1]["output"]["wh_skipped"] == 1
+
+        # Once the warehouse is forgotten (e.g. it was altered by hand), the schedule is applied again
+        wh_sched_fixture.applied_state.clear()
+        alter_warehouse_block = task.run(session)
+        assert len(_extract_alter_statements(alter_warehouse_block)) == 1
+
+
+def _many_schedules(warehouses: int) -> pd.DataFrame:
+    """
+    Four weekday and four weekend schedules for each warehouse, staggered across the day.
+    """
+    rows = []
+    for i in range(warehouses):
+        for weekday in (True, False):
+            hours = [0, 6 + i % 4, 12 + i % 3, 18 + i % 5]
+            for j, hour in enumerate(hours):
+                rows.append(
+                    dict(
+                        ID_VAL=uuid.uuid4().hex,
+                        NAME=f"WH_{i}",
+                        START_AT=datetime.time(hour, 15 * (i % 4) if j else 0),
+                        SIZE="X-Small" if weekday else "Small",
+                        WEEKDAY=weekday,
+                        ENABLED=True,
+                    )
+                )
+    return pd.DataFrame(rows)
+
+
+def _reference_task_table(df: pd.DataFrame, this_run, last_run) -> pd.DataFrame:
+    """
+    The latest schedule to have started in (last_run, this_run] for each warehouse, computed one row at a time.
+    """
+    rows = []
+    first_day = max(last_run, this_run - datetime.timedelta(days=1)).date()
+    for i in range((this_run.date() - first_day).days + 1):
+        day = first_day + datetime.timedelta(days=i)
+        for row in df[df.WEEKDAY == (day.weekday() < 5)].itertuples():
+            ts = datetime.datetime.combine(day, row.START_AT)
+            if last_run <= ts <= this_run:
+                rows.append(dict(NAME=row.NAME, ID_VAL=row.ID_VAL, ts=ts))
+    return pd.DataFrame(rows).sort_values(by="ts").groupby("NAME").last()
+
+
+def test_build_task_table_matches_reference(session):
+    df = _many_schedules(1250)
+    assert len(df) == 10_000
+    # A regular run, and a run which missed the evening of a Friday
+    runs = [
+        (datetime.datetime(2023, 9, 26, 8, 45), datetime.datetime(2023, 9, 26, 8, 30)),
+        (datetime.datetime(2023, 9, 30, 0, 15), datetime.datetime(2023, 9, 29, 16, 45)),
+    ]
+
+    with patch.object(wh_sched, "get_schedules") as mocked_get_schedules:
+        mocked_get_schedules.side_effect = lambda _, is_weekday: df[
+            df.WEEKDAY == is_weekday
+        ]
+        for this_run, last_run in runs:
+            to_run = wh_sched.build_task_table(session, this_run, last_run)
+            expected = _reference_task_table(df, this_run, last_run)
+
+            assert len(to_run) > 0
+            assert dict(zip(to_run.NAME, to_run.ID_VAL)) == expected.ID_VAL.to_dict()
+
+
 def test_disabled_schedules_do_nothing(session, wh_sched_fixture):
     """
     The disabled schedules should not trigger warehouse changes
@@ -0,0 +1,241 @@
+import datetime
+import pandas as pd
+import pytest
+from pytz import timezone
+from unittest.mock import MagicMock, patch
+from . import wh_sim
+from .wh_sched import WarehouseSchedules
+from .wh_sim import WarehouseHistory, simulate, simulate_schedules
+
+# A Monday
+_start = datetime.datetime(2023, 9, 25, 0, 0)
+_end = _start + datetime.timedelta(days=1)
+
+
+def _schedule(
+    start_at: datetime.time,
+    finish_at: datetime.time,
+    size: str,
+    suspend_minutes: int = 1,
+    scale_min: int = 0,
+    scale_max: int = 0,
+    weekday: bool = True,
+) -> WarehouseSchedules:
+    return WarehouseSchedules(
+        name="COMPUTE_WH",
+        start_at=start_at,
+        finish_at=finish_at,
+        size=size,
+        suspend_minutes=suspend_minutes,
+        resume=True,
+        scale_min=scale_min,
+        scale_max=scale_max,
+        warehouse_mode="Standard",
+        weekday=weekday,
+        enabled=True,
+    )
+
+
+def _history(
+    windows, running=0.5, queued=0.0, work_minutes=4, size_credits=4, clusters=1
+):
+    """
+    The warehouse ran queries in each of `windows` on `clusters` clusters with `size_credits` credits per hour, and
+    was running for the whole window.
+    """
+    load = pd.DataFrame(
+        dict(
+            WINDOW=windows,
+            RUNNING=[running] * len(windows),
+            QUEUED=[queued] * len(windows),
+        )
+    )
+    work = pd.DataFrame(
+        dict(
+            WINDOW=windows,
+            WORK=[work_minutes * 60 * 1000 * size_credits * clusters] * len(windows),
+            CREDITS_PER_HOUR=[size_credits] * len(windows),
+            QUERIES=[10] * len(windows),
+        )
+    )
+    sessions = pd.DataFrame(
+        dict(ST=windows, ET=[w + datetime.timedelta(minutes=15) for w in windows])
+    )
+    metering = (
+        pd.DataFrame(
+            dict(
+                START_TIME=[w.replace(minute=0) for w in windows],
+                CREDITS=[size_credits * clusters / 4] * len(windows),
+            )
+        )
+        .groupby("START_TIME", as_index=False)
+        .sum()
+    )
+    return WarehouseHistory(load, work, sessions, metering)
+
+
+def test_simulate_smaller_size():
+    windows = [_start + datetime.timedelta(hours=9, minutes=15 * i) for i in range(4)]
+    history = _history(windows)
+    schedules = [
+        _schedule(datetime.time(0, 0), datetime.time(23, 59), "Small"),
+    ]
+
+    df = simulate(schedules, history, _start, _end)
+
+    assert len(df) == 96
+    assert df.SCHEDULED.all()
+    # Medium for the whole of the 4 windows
+    assert df.ACTUAL_CREDITS.sum() == pytest.approx(4.0)
+    # 4 minutes of Medium work takes 8 minutes on a Small, plus a minute until it suspends, in each window
+    assert df.SIMULATED_CREDITS.sum() == pytest.approx(4 * 9 / 60 * 2)
+    busy = df[df.WINDOW.isin(windows)]
+    assert (busy.CLUSTERS == 1).all()
+    # Half of a Medium is a fully loaded Small
+    assert busy.SIMULATED_QUEUED.sum() == pytest.approx(0)
+    assert (df[~df.WINDOW.isin(windows)].SIMULATED_CREDITS == 0).all()
+
+
+def test_simulate_queueing_and_clusters():
+    windows = [_start + datetime.timedelta(hours=9)]
+    history = _history(windows, running=1.0, queued=0.5)
+
+    # A single Small cluster can't keep up with a loaded Medium
+    df = simulate(
+        [_schedule(datetime.time(0, 0), datetime.time(23, 59), "Small")],
+        history,
+        _start,
+        _end,
+    )
+    assert df.SIMULATED_QUEUED.sum() == pytest.approx(2.0)
+
+    # Up to 3 Small clusters absorb it
+    df = simulate(
+        [
+            _schedule(
+                datetime.time(0, 0),
+                datetime.time(23, 59),
+                "Small",
+                scale_min=1,
+                scale_max=3,
+            )
+        ],
+        history,
+        _start,
+        _end,
+    )
+    assert df.CLUSTERS.max() == 3
+    assert df.SIMULATED_QUEUED.sum() == pytest.approx(0)
+
+
+def test_simulate_unscheduled_windows_are_unchanged():
+    # Monday and Saturday mornings
+    windows = [
+        _start + datetime.timedelta(hours=9),
+        _start + datetime.timedelta(days=5, hours=9),
+    ]
+    history = _history(windows)
+    # Only weekday mornings are scheduled
+    schedules = [
+        _schedule(datetime.time(0, 0), datetime.time(12, 0), "X-Large"),
+    ]
+
+    df = simulate(schedules, history, _start, _start + datetime.timedelta(days=7))
+
+    assert df.SCHEDULED.sum() == 5 * 48
+    saturday = df[df.WINDOW == windows[1]].iloc[0]
+    assert not saturday.SCHEDULED
+    assert saturday.SIMULATED_CREDITS == pytest.approx(saturday.ACTUAL_CREDITS)
+    monday = df[df.WINDOW == windows[0]].iloc[0]
+    assert monday.SIZE == "X-Large"
+    # 4 minutes of Medium work is a minute on an X-Large, plus a minute until it suspends
+    assert monday.SIMULATED_CREDITS == pytest.approx(2 / 60 * 16)
+
+
+def test_simulate_never_suspend():
+    history = _history([])
+    schedules = [
+        _schedule(datetime.time(0, 0), datetime.time(23, 59), "X-Small", 0),
+    ]
+
+    df = simulate(schedules, history, _start, _end)
+
+    # Billed all day, even without queries
+    assert df.SIMULATED_CREDITS.sum() == pytest.approx(24)
+    assert df.ACTUAL_CREDITS.sum() == 0
+
+
+@pytest.mark.parametrize(
+    "running, queued, clusters, scale_min, scale_max",
+    [(4, 0, 1, 0, 0), (12, 0, 2, 1, 2), (16, 4, 2, 1, 2)],
+)
+def test_simulate_current_settings_reproduces_history(
+    running, queued, clusters, scale_min, scale_max
+):
+    windows = [_start + datetime.timedelta(hours=9, minutes=15 * i) for i in range(6)]
+    # 14 minutes of work and a minute until it suspends keep the warehouse running for each whole window
+    history = _history(
+        windows, running=running, queued=queued, work_minutes=14, clusters=clusters
+    )
+    schedules = [
+        _schedule(
+            datetime.time(0, 0),
+            datetime.time(23, 59),
+            "Medium",
+            scale_min=scale_min,
+            scale_max=scale_max,
+        ),
+    ]
+
+    df = simulate(schedules, history, _start, _end)
+
+    assert df.ACTUAL_CREDITS.sum() == pytest.approx(6 / 4 * 4 * clusters)
+    assert df.SIMULATED_CREDITS.to_numpy() == pytest.approx(
+        df.ACTUAL_CREDITS.to_numpy()
+    )
+    assert df.SIMULATED_QUEUED.to_numpy() == pytest.approx(df.ACTUAL_QUEUED.to_numpy())
+    assert (df[df.WINDOW.isin(windows)].CLUSTERS == clusters).all()
+
+
+def test_actual_credits_are_metered():
+    windows = [_start + datetime.timedelta(hours=9, minutes=15 * i) for i in range(4)]
+    history = _history(windows)
+    # The warehouse ran 3 clusters for the hour
+    history.metering["CREDITS"] = 12.0
+
+    df = simulate(
+        [_schedule(datetime.time(0, 0), datetime.time(23, 59), "Medium")],
+        history,
+        _start,
+        _end,
+    )
+
+    assert df.ACTUAL_CREDITS.sum() == pytest.approx(12.0)
+    assert df[df.WINDOW.isin(windows)].ACTUAL_CREDITS.to_numpy() == pytest.approx(
+        [3.0] * 4
+    )
+
+
+def test_simulate_schedules_uses_the_schedule_timezone():
+    sf = MagicMock()
+    sf.sql.return_value.collect.return_value = [
+        MagicMock(X=datetime.datetime(2023, 9, 26, 9, 7))
+    ]
+    sf.sql.return_value.to_pandas.return_value = pd.DataFrame()
+    with patch.object(
+        wh_sim, "get_schedule_timezone", return_value=timezone("America/New_York")
+    ):
+        df = simulate_schedules(sf, "COMPUTE_WH", [], days=1)
+
+    now_stmt, now_kwargs = sf.sql.call_args_list[0][0][0], sf.sql.call_args_list[0][1]
+    assert "convert_timezone(?, current_timestamp())" in now_stmt
+    assert now_kwargs["params"] == ["America/New_York"]
+    for c in sf.sql.call_args_list[1:]:
+        assert "convert_timezone('America/New_York', " in c[0][0]
+        assert c[1]["params"] == [
+            "COMPUTE_WH",
+            datetime.datetime(2023, 9, 25, 9, 0),
+            datetime.datetime(2023, 9, 26, 9, 0),
+        ]
+    assert df.WINDOW.iloc[0] == pd.Timestamp(2023, 9, 25, 9, 0)
+    assert len(df) == 96
@@ -1,7 +1,14 @@
 import datetime
 import pytest
 from pytz import timezone
-from .wh_sched import WarehouseSchedules, update_task_state, task_offsets
+from unittest.mock import patch
+from snowflake.snowpark import Row
+from .wh_sched import (
+    WarehouseSchedules,
+    get_applied_task_state,
+    update_task_state,
+    task_offsets,
+)
 from .test_fixtures import MockSession
 
 _pacific = timezone("America/Los_Angeles")
@@ -315,3 +322,57 @@ def test_only_enabled_schedules_affect_schedule(session):
         in block
     )
     assert "alter task if exists tasks.warehouse_scheduling_30 resume" in block
+
+
+def test_applied_task_state_is_not_altered_again(session: MockSession):
+    schedules = [
+        _make_schedule("COMPUTE_WH", datetime.time(0, 0), datetime.time(9, 0)),
+        _make_schedule("COMPUTE_WH", datetime.time(9, 0), datetime.time(17, 30)),
+        _make_schedule("COMPUTE_WH", datetime.time(17, 30), datetime.time(23, 59)),
+    ]
+    applied = {
+        0: ("USING CRON 0 0,9 * * 1-5 America/Los_Angeles", True),
+        15: (None, False),
+        30: ("USING CRON 30 17 * * 1-5 America/Los_Angeles", True),
+        45: (None, False),
+    }
+
+    assert update_task_state(session, schedules, tz=_pacific, applied=applied) is True
+    assert len(session._sql) == 0
+
+    # Moving the evening schedule only changes the _30 task
+    schedules[1].finish_at = schedules[2].start_at = datetime.time(18, 30)
+    assert update_task_state(session, schedules, tz=_pacific, applied=applied) is True
+    assert len(session._sql) == 1
+    script = session._sql[0].lower()
+    assert (
+        "alter task if exists tasks.warehouse_scheduling_30 set schedule = 'using cron 30 18 * * 1-5 america/los_angeles';"
+        in script
+    )
+    for offset in (0, 15, 45):
+        assert f"tasks.warehouse_scheduling_{offset} " not in script
+
+
+def test_suspended_tasks_are_not_suspended_again(session: MockSession):
+    applied = {offset: (None, False) for offset in task_offsets}
+    assert not update_task_state(session, [], tz=_pacific, applied=applied)
+    assert len(session._sql) == 0
+
+
+def test_get_applied_task_state(session: MockSession):
+    rows = [
+        Row(
+            name="WAREHOUSE_SCHEDULING_0",
+            schedule="USING CRON 0 0,9 * * 1-5 America/Los_Angeles",
+            state="started",
+        ),
+        Row(name="WAREHOUSE_SCHEDULING_15", schedule=None, state="suspended"),
+    ]
+    with patch.object(session, "collect", return_value=rows):
+        applied = get_applied_task_state(session)
+
+    assert session._sql == ["show tasks like 'WAREHOUSE_SCHEDULING_%' in schema TASKS"]
+    assert applied == {
+        0: ("USING CRON 0 0,9 * * 1-5 America/Los_Angeles", True),
+        15: (None, False),
+    }
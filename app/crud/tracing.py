@@ -0,0 +1,256 @@
+import hashlib
+import re
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from snowflake.snowpark import (
+    DataFrame,
+    DataFrameNaFunctions,
+    RelationalGroupedDataFrame,
+)
+
+# Matches string and numeric literals so that statements differing only by their values share a fingerprint.
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+# Statement text kept for each fingerprint, enough to recognize the statement without storing whole bodies.
+_MAX_STATEMENT_LEN = 200
+_NO_OPERATION = "(none)"
+# Statements which a rolled back Tracer doesn't run, so that the enclosing transaction can be rolled back.
+_TRANSACTION_CONTROL = ("BEGIN", "BEGIN TRANSACTION", "COMMIT", "ROLLBACK")
+
+
+def normalize_statement(statement: str) -> str:
+    """
+    Replaces literals with `?` and collapses whitespace so that similar statements normalize to the same text.
+    """
+    return _WHITESPACE.sub(" ", _LITERALS.sub("?", statement)).strip().lower()
+
+
+def fingerprint(statement: str) -> str:
+    """
+    Returns a short, stable identifier for the normalized form of the given statement.
+    """
+    return hashlib.md5(normalize_statement(statement).encode("utf-8")).hexdigest()[:12]
+
+
+class Tracer:
+    """
+    Records every statement issued through a traced Snowpark session, grouped by the logical CRUD operation which
+    was active when the statement ran.
+
+    If `rollback` is True, the caller runs the traced work in a transaction which it rolls back. The traced session
+    then leaves out the statements which would end that transaction early: transaction control and procedure calls,
+    which may issue DDL. Procedure calls are still recorded, without timing.
+    """
+
+    def __init__(self, rollback: bool = False):
+        self.events: List[Dict[str, Any]] = []
+        self.rollback = rollback
+        self._operation: Optional[str] = None
+
+    @contextmanager
+    def operation(self, name: str):
+        """
+        Attributes all statements issued within this block to the operation `name`.
+        """
+        previous = self._operation
+        self._operation = name
+        try:
+            yield self
+        finally:
+            self._operation = previous
+
+    @contextmanager
+    def measure(self, statement: str):
+        """
+        Times the block and records it as one execution of `statement`. The block may set `event["rows"]`.
+        """
+        event = dict(
+            operation=self._operation or _NO_OPERATION,
+            fingerprint=fingerprint(statement),
+            statement=normalize_statement(statement)[:_MAX_STATEMENT_LEN],
+            rows=None,
+        )
+        start = time.perf_counter()
+        try:
+            yield event
+        finally:
+            event["elapsed_ms"] = (time.perf_counter() - start) * 1000
+            self.events.append(event)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """
+        Aggregates the recorded events by operation and fingerprint, slowest first.
+        """
+        grouped: Dict[tuple, Dict[str, Any]] = {}
+        for e in self.events:
+            key = (e["operation"], e["fingerprint"])
+            if key not in grouped:
+                grouped[key] = dict(
+                    operation=e["operation"],
+                    fingerprint=e["fingerprint"],
+                    statement=e["statement"],
+                    count=0,
+                    total_ms=0.0,
+                    max_ms=0.0,
+                    rows=0,
+                )
+            agg = grouped[key]
+            agg["count"] += 1
+            agg["total_ms"] += e["elapsed_ms"]
+            agg["max_ms"] = max(agg["max_ms"], e["elapsed_ms"])
+            agg["rows"] += e["rows"] or 0
+        return sorted(grouped.values(), key=lambda a: a["total_ms"], reverse=True)
+
+    def totals(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the number of statements and the total time spent in Snowflake for each operation.
+        """
+        totals: Dict[str, Dict[str, Any]] = {}
+        for e in self.events:
+            t = totals.setdefault(e["operation"], dict(statements=0, total_ms=0.0))
+            t["statements"] += 1
+            t["total_ms"] += e["elapsed_ms"]
+        return totals
+
+    def wrap(self, session) -> "TracedSession":
+        if isinstance(session, TracedSession):
+            return session
+        return TracedSession(session, self)
+
+
+def _row_count(result) -> Optional[int]:
+    if hasattr(result, "rows_inserted"):
+        # MergeResult
+        return result.rows_inserted + result.rows_updated + result.rows_deleted
+    for attr in ("rows_updated", "rows_deleted"):
+        if hasattr(result, attr):
+            return getattr(result, attr)
+    if isinstance(result, int):
+        # count() returns the number of rows it counted, not rows it fetched
+        return None
+    if hasattr(result, "__len__"):
+        return len(result)
+    return None
+
+
+def _unwrap(v):
+    return v._df if isinstance(v, TracedDataFrame) else v
+
+
+class TracedSession:
+    """
+    Wraps a Snowpark Session so that the statements issued through it are recorded by a Tracer. Anything which is not
+    traced is delegated to the wrapped session.
+    """
+
+    def __init__(self, session, tracer: Tracer):
+        self._session = session
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def sql(self, query: str, *args, **kwargs) -> "TracedDataFrame":
+        if self._tracer.rollback and query.strip().upper() in _TRANSACTION_CONTROL:
+            return _SkippedStatement()
+        return TracedDataFrame(
+            self._session.sql(query, *args, **kwargs), self._tracer, query
+        )
+
+    def table(self, name: str) -> "TracedDataFrame":
+        return TracedDataFrame(self._session.table(name), self._tracer, f"table {name}")
+
+    def create_dataframe(self, *args, **kwargs) -> "TracedDataFrame":
+        return TracedDataFrame(
+            self._session.create_dataframe(*args, **kwargs),
+            self._tracer,
+            "create_dataframe",
+        )
+
+    def call(self, proc: str, *args, **kwargs):
+        with self._tracer.measure(f"call {proc}"):
+            if self._tracer.rollback:
+                return None
+            return self._session.call(proc, *args, **kwargs)
+
+
+class _SkippedStatement:
+    def collect(self):
+        return []
+
+
+class TracedDataFrame:
+    """
+    Wraps a Snowpark DataFrame (or Table, or the grouped DataFrame of a group_by). Every method which returns a
+    DataFrame returns a traced one, and actions which execute statements in Snowflake are timed.
+    """
+
+    _ACTIONS = ("collect", "to_pandas", "count", "merge", "delete", "update")
+    # What transformations return which is wrapped in turn
+    _WRAPPED = (DataFrame, RelationalGroupedDataFrame, DataFrameNaFunctions)
+
+    def __init__(self, df, tracer: Tracer, statement: str):
+        self._df = df
+        self._tracer = tracer
+        self._statement = statement
+
+    def __getitem__(self, item):
+        return self._df[item]
+
+    def __getattr__(self, name):
+        attr = getattr(self._df, name)
+        statement = f"{self._statement} {name}"
+        # The aggregates of a grouped DataFrame (e.g. count) are transformations
+        if name in TracedDataFrame._ACTIONS and not isinstance(
+            self._df, RelationalGroupedDataFrame
+        ):
+            return self._traced(attr, statement)
+        if name == "write":
+            return TracedWriter(attr, self._tracer)
+        if callable(attr):
+            return lambda *args, **kwargs: self._wrap(
+                attr(
+                    *[_unwrap(a) for a in args],
+                    **{k: _unwrap(v) for k, v in kwargs.items()},
+                ),
+                statement,
+            )
+        return self._wrap(attr, statement)
+
+    def _wrap(self, result, statement: str):
+        if isinstance(result, TracedDataFrame._WRAPPED):
+            return TracedDataFrame(result, self._tracer, statement)
+        return result
+
+    def _traced(self, fn, statement: str):
+        def run(*args, **kwargs):
+            with self._tracer.measure(statement) as event:
+                result = fn(
+                    *[_unwrap(a) for a in args],
+                    **{k: _unwrap(v) for k, v in kwargs.items()},
+                )
+                event["rows"] = _row_count(result)
+                return result
+
+        return run
+
+
+class TracedWriter:
+    """
+    Wraps a Snowpark DataFrameWriter so that table writes are timed.
+    """
+
+    def __init__(self, writer, tracer: Tracer):
+        self._writer = writer
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        return getattr(self._writer, name)
+
+    def mode(self, save_mode: str) -> "TracedWriter":
+        return TracedWriter(self._writer.mode(save_mode), self._tracer)
+
+    def save_as_table(self, table_name, *args, **kwargs):
+        with self._tracer.measure(f"save_as_table {table_name}"):
+            return self._writer.save_as_table(table_name, *args, **kwargs)
@@ -1,13 +1,15 @@
+import time
 import uuid
-from typing import ClassVar, List, Optional, Tuple
+from typing import ClassVar, Dict, List, Optional, Tuple, Union
 import datetime
 from .base import BaseOpsCenterModel
 from .errors import summarize_error
 from pydantic import validator, root_validator, Field
 from pytz import timezone
 from pytz.exceptions import UnknownTimeZoneError
-from snowflake.snowpark.functions import col, max as sp_max
+from snowflake.snowpark.functions import col, max as sp_max, upper
 from snowflake.snowpark import Row, Session
+import numpy as np
 import pandas as pd
 
 
@@ -36,6 +38,7 @@ class WarehouseSchedules(BaseOpsCenterModel):
     }
     max_cluster_size: ClassVar[int] = 10
     max_sub_schedules: ClassVar[int] = 10
+    upsert_ignored_cols: ClassVar[List[str]] = ["last_modified"]
 
     id_val: str = Field(default_factory=lambda: uuid.uuid4().hex)
     name: str
@@ -113,6 +116,15 @@ class WarehouseSchedules(BaseOpsCenterModel):
         self.last_modified = datetime.datetime.now()
         super().write(session)
 
+    @classmethod
+    def batch_upsert(
+        cls, session: Session, data: List["WarehouseSchedules"]
+    ) -> Dict[str, int]:
+        now = datetime.datetime.now()
+        for s in data:
+            s.last_modified = now
+        return super().batch_upsert(session, data)
+
     def update(self, session: Session, update: "WarehouseSchedules"):
         # Set last_modified on `update` to push it to the SQL table
         update.last_modified = datetime.datetime.now()
@@ -227,7 +239,8 @@ class WarehouseSchedules(BaseOpsCenterModel):
         objs = cls.batch_read(
             session,
             sortby="start_at",
-            filter=lambda df: (df.name == name),
+            where={"name": name},
+            trusted=True,
         )
         return [cls._clean_pandas(o) for o in objs]
 
@@ -241,7 +254,8 @@ class WarehouseSchedules(BaseOpsCenterModel):
         objs = cls.batch_read(
             session,
             sortby="start_at",
-            filter=lambda df: ((df.name == name) & (df.weekday == weekday)),
+            where={"name": name, "weekday": weekday},
+            trusted=True,
         )
         return [cls._clean_pandas(o) for o in objs]
 
@@ -259,14 +273,17 @@ class WarehouseSchedules(BaseOpsCenterModel):
         values. If no such schedule is found, this method returns `None`. If multiple schedules
         are found, it raises a ValueError.
         """
+        # Only need two rows to know if the schedule is ambiguous
         rows = cls.batch_read(
             session,
-            filter=lambda df: (
-                (df.name == name)
-                & (df.weekday == weekday)
-                & (df.start_at == start_at)
-                & (df.finish_at == finish_at)
-            ),
+            where={
+                "name": name,
+                "weekday": weekday,
+                "start_at": start_at,
+                "finish_at": finish_at,
+            },
+            limit=2,
+            trusted=True,
         )
         if len(rows) == 0:
             return None
@@ -285,7 +302,20 @@ class WarehouseSchedules(BaseOpsCenterModel):
             f"update internal.{cls.table_name} set enabled = ? where name = ?",
             params=[enabled, name],
         ).collect()
-        after_schedule_change(session)
+        after_schedule_change(session, name)
+
+
+class WarehouseScheduleTemplate(WarehouseSchedules):
+    """
+    A named set of weekday and weekend schedules which can be applied to any number of warehouses. The `name` of each
+    row is the name of the template.
+    """
+
+    table_name: ClassVar[str] = "WH_SCHEDULE_TEMPLATES"
+
+    @classmethod
+    def create_table(cls, session, with_catalog_views=True):
+        super(WarehouseSchedules, cls).create_table(session, with_catalog_views)
 
 
 class WarehouseAlterStatements(BaseOpsCenterModel):
@@ -487,13 +517,198 @@ def verify_and_clean(
     return None, [i for i in data if i._dirty]
 
 
+def _day_label(weekday: bool) -> str:
+    return "weekday" if weekday else "weekend"
+
+
+def save_schedule_template(
+    session: Session, template: str, schedules: List[WarehouseSchedules]
+) -> List[WarehouseScheduleTemplate]:
+    """
+    Saves the weekday and weekend `schedules` (e.g. those of a warehouse) as the template named `template`, replacing
+    the template if it already exists.
+    :return: The rows of the template.
+    """
+    rows = [
+        WarehouseScheduleTemplate.parse_obj(
+            dict(s.dict(), id_val=uuid.uuid4().hex, name=template, enabled=False)
+        )
+        for s in schedules
+    ]
+    for weekday in (True, False):
+        day = sorted(
+            [r for r in rows if r.weekday == weekday], key=lambda r: r.start_at
+        )
+        if not day:
+            raise ValueError(
+                f"Template {template} has no {_day_label(weekday)} schedules."
+            )
+        err_msg, _ = verify_and_clean(day)
+        if err_msg is not None:
+            raise ValueError(f"Failed to save template {template}, {err_msg}")
+
+    now = datetime.datetime.now()
+    for r in rows:
+        r.last_modified = now
+    session.table(f"INTERNAL.{WarehouseScheduleTemplate.table_name}").delete(
+        col("name") == template
+    )
+    WarehouseScheduleTemplate.batch_write(session, rows)
+    return rows
+
+
+def plan_schedule_template(
+    template: List[WarehouseScheduleTemplate],
+    warehouses: List[str],
+    snapshot: Dict[str, dict],
+    existing: List[WarehouseSchedules],
+) -> List[WarehouseSchedules]:
+    """
+    Builds the schedules of every warehouse in `warehouses` from the rows of a template, without touching Snowflake.
+    A warehouse keeps its scheduling enabled or disabled. All warehouses are checked before any error is raised.
+    :param template: The rows of the template.
+    :param warehouses: The warehouses to apply the template to, in any case.
+    :param snapshot: The output of SHOW WAREHOUSES, see warehouse_snapshot().
+    :param existing: The current schedules of `warehouses`.
+    :return: The new schedules of every warehouse, replacing all of their current schedules.
+    """
+    if not template:
+        raise ValueError("Template not found or has no schedules.")
+
+    errors = [
+        f"Warehouse '{wh}' was not found or permissions are missing."
+        for wh in warehouses
+        if wh.upper() not in snapshot
+    ]
+    warehouses = _resolve_warehouse_names(warehouses, snapshot)
+    enabled = {}
+    for s in existing:
+        name = s.name.upper()
+        enabled[name] = enabled.get(name, True) and s.enabled
+
+    now = datetime.datetime.now()
+    schedules = []
+    for wh in warehouses:
+        for weekday in (True, False):
+            day = [
+                WarehouseSchedules.parse_obj(
+                    dict(
+                        t.dict(),
+                        id_val=uuid.uuid4().hex,
+                        name=wh,
+                        enabled=enabled.get(wh.upper(), False),
+                        last_modified=now,
+                    )
+                )
+                for t in sorted(template, key=lambda t: t.start_at)
+                if t.weekday == weekday
+            ]
+            err_msg = (
+                f"Template has no {_day_label(weekday)} schedules."
+                if not day
+                else verify_and_clean(day)[0]
+            )
+            if err_msg is not None:
+                errors.append(f"Failed to create schedule for {wh}, {err_msg}")
+            schedules.extend(day)
+
+    if errors:
+        raise ValueError("\n".join(errors))
+    return schedules
+
+
+def apply_schedule_template(
+    session: Session, template: str, warehouses: List[str]
+) -> List[WarehouseSchedules]:
+    """
+    Replaces the schedules of every warehouse in `warehouses` with the template named `template`. The warehouses are
+    validated together, every row is written in one batch and the tasks are updated once.
+    :return: The new schedules.
+    """
+    if not warehouses:
+        raise ValueError("At least one warehouse is required.")
+
+    rows = WarehouseScheduleTemplate.find_all(session, template)
+    snapshot = warehouse_snapshot(session)
+    schedules = plan_schedule_template(
+        rows,
+        warehouses,
+        snapshot,
+        WarehouseSchedules.batch_read(
+            session, where=_any_case(warehouses), trusted=True
+        ),
+    )
+    warehouses = _resolve_warehouse_names(warehouses, snapshot)
+
+    # Also replaces rows which were written with another casing of the name
+    session.table(f"INTERNAL.{WarehouseSchedules.table_name}").delete(
+        _any_case(warehouses)
+    )
+    WarehouseSchedules.batch_write(session, schedules)
+    after_schedule_change(session, warehouses)
+    return schedules
+
+
+def _resolve_warehouse_names(
+    warehouses: List[str], snapshot: Dict[str, dict]
+) -> List[str]:
+    """
+    Replaces each of `warehouses` with its name in `snapshot` and drops duplicates which only differ by case.
+    Warehouses missing from the snapshot keep the name they were given.
+    """
+    resolved = {}
+    for wh in warehouses:
+        resolved.setdefault(wh.upper(), snapshot.get(wh.upper(), {}).get("name", wh))
+    return list(resolved.values())
+
+
+def _any_case(warehouses: List[str]):
+    return upper(col("name")).isin([wh.upper() for wh in warehouses])
+
+
+# How long a SHOW WAREHOUSES snapshot is reused before the warehouses are listed again.
+WAREHOUSE_SNAPSHOT_TTL_SECONDS = 30
+# The output of SHOW WAREHOUSES by upper-cased warehouse name, and when it was taken.
+_warehouse_snapshot: Dict[str, dict] = {}
+_warehouse_snapshot_taken_at = 0.0
+
+
+def warehouse_snapshot(session: Session) -> Dict[str, dict]:
+    """
+    Returns the state of every warehouse from a single `show warehouses`, reusing the previous snapshot for
+    WAREHOUSE_SNAPSHOT_TTL_SECONDS.
+    """
+    global _warehouse_snapshot_taken_at
+    if (
+        _warehouse_snapshot
+        and time.monotonic() - _warehouse_snapshot_taken_at
+        < WAREHOUSE_SNAPSHOT_TTL_SECONDS
+    ):
+        return _warehouse_snapshot
+
+    _warehouse_snapshot.clear()
+    for row in session.sql("show warehouses").collect():
+        wh_dict = row.as_dict()
+        _warehouse_snapshot.setdefault(wh_dict["name"].upper(), wh_dict)
+    _warehouse_snapshot_taken_at = time.monotonic()
+    return _warehouse_snapshot
+
+
+def clear_warehouse_snapshot():
+    _warehouse_snapshot.clear()
+
+
 def describe_warehouse(session: Session, warehouse: str):
-    wh_df = session.sql(f"show warehouses like '{warehouse}'").collect()
-    if len(wh_df) == 0:
+    snapshot_exists = bool(_warehouse_snapshot)
+    wh_dict = warehouse_snapshot(session).get(warehouse.upper())
+    if wh_dict is None and snapshot_exists:
+        # The warehouse may have been created since the snapshot was taken
+        clear_warehouse_snapshot()
+        wh_dict = warehouse_snapshot(session).get(warehouse.upper())
+    if wh_dict is None:
         raise ValueError(
-            "Warehouse '{warehouse}' was not found or permissions are missing."
+            f"Warehouse '{warehouse}' was not found or permissions are missing."
         )
-    wh_dict = wh_df[0].as_dict()
     return WarehouseSchedules(
         name=warehouse,
         size=wh_dict["size"],
@@ -578,35 +793,108 @@ def update_warehouse(warehouse_now, warehouse_next):
     return ""
 
 
-def after_schedule_change(session: Session) -> bool:
+def after_schedule_change(
+    session: Session, warehouse: Optional[Union[str, List[str]]] = None
+) -> bool:
     """
     Takes the current collection of warehouse schedules, records the alter warehouse statement
     for each schedule, and appropriately schedules the tasks to run.
+    :param warehouse: The only warehouse (or list of warehouses) whose schedules changed, or None to regenerate the
+    statements of every warehouse.
     :return: True if any task is scheduled to run (resumed), False otherwise.
     """
-    schedules = WarehouseSchedules.batch_read(session, sortby="start_at")
+    where = {"name": warehouse} if warehouse is not None else None
+    schedules = WarehouseSchedules.batch_read(
+        session, sortby="start_at", where=where, trusted=True
+    )
 
     # Generate alter statements for each schedule
-    regenerate_alter_statements(session, schedules)
-    # Update the task's state
-    task_started = update_task_state(session, schedules)
+    regenerate_alter_statements(session, schedules, warehouse)
+    # Index the statements by the 15-minute slots in which each schedule is in effect. The timeline is rebuilt for
+    # every warehouse when several of them changed.
+    session.call(
+        "internal.rebuild_warehouse_schedule_timeline",
+        warehouse if isinstance(warehouse, str) else None,
+    )
+    # Update the task's state. The tasks depend on when the enabled schedules of every warehouse start, and only the
+    # tasks whose schedule differs from the one currently applied are altered.
+    task_started = update_task_state(
+        session,
+        enabled_schedule_starts(session),
+        applied=get_applied_task_state(session),
+    )
 
     return task_started
 
 
-def regenerate_alter_statements(session: Session, schedules: List[WarehouseSchedules]):
+def regenerate_alter_statements(
+    session: Session,
+    schedules: List[WarehouseSchedules],
+    warehouse: Optional[Union[str, List[str]]] = None,
+):
     """
     Given a list of WarehouseSchedules, generate the ALTER WAREHOUSE statements and write them to the
-    WAREHOUSE_ALTER_STATEMENTS table. Any rows in the WarehouseAlterStatements table which are not included in
-    the `schedules` will be deleted (e.g. `dataframe.write.mode('overwrite')`)
+    WAREHOUSE_ALTER_STATEMENTS table. Only statements which changed are rewritten, and any rows in the
+    WarehouseAlterStatements table which are not included in the `schedules` will be deleted.
     :param session: Snowpark session
     :param schedules: List of WarehouseSessions
+    :param warehouse: The warehouse (or list of warehouses) which `schedules` belong to, or None if they are the
+    schedules of every warehouse.
     """
     # Take the Schedule and generate the WarehouseAlterStatements object which contains the ALTER WAREHOUSE stmt.
     alter_stmts = [generate_alter_from_schedule(schedule) for schedule in schedules]
 
-    # Write all the statements to the table, overwriting any existing statements.
-    WarehouseAlterStatements.batch_write(session, alter_stmts, overwrite=True)
+    # Merge the statements into the table, leaving rows for untouched schedules as they are.
+    WarehouseAlterStatements.batch_upsert(session, alter_stmts)
+
+    # Remove statements for schedules which no longer exist.
+    table = session.table(f"INTERNAL.{WarehouseAlterStatements.table_name}")
+    if warehouse is not None:
+        # The statements of other warehouses are not known here, keep whatever still has a schedule.
+        table.delete(
+            ~col("id_val").isin(
+                session.table(f"INTERNAL.{WarehouseSchedules.table_name}").select(
+                    "id_val"
+                )
+            )
+        )
+        return
+    ids = [stmt.id_val for stmt in alter_stmts]
+    if ids:
+        table.delete(~col("id_val").isin(ids))
+    else:
+        table.delete()
+
+
+def enabled_schedule_starts(session: Session) -> List[WarehouseSchedules]:
+    """
+    Returns one (unvalidated) WarehouseSchedules per distinct start time and weekday flag of the enabled schedules,
+    which is all that is needed to schedule the tasks.
+    """
+    rows = session.sql(
+        f"select distinct start_at, weekday from internal.{WarehouseSchedules.table_name} where enabled"
+    ).collect()
+    return [
+        WarehouseSchedules.construct(start_at=r[0], weekday=r[1], enabled=True)
+        for r in rows
+    ]
+
+
+def get_applied_task_state(session: Session) -> Dict[int, Tuple[Optional[str], bool]]:
+    """
+    Returns the cron schedule currently set on each warehouse scheduling task and whether it is started, by offset.
+    """
+    schema, name = task_name.split(".")
+    rows = session.sql(f"show tasks like '{name}_%' in schema {schema}").collect()
+    applied = {}
+    for row in rows:
+        task = row.as_dict()
+        try:
+            offset = int(task["name"].rsplit("_", 1)[1])
+        except ValueError:
+            continue
+        applied[offset] = (task.get("schedule"), task.get("state") == "started")
+    return applied
 
 
 def get_schedule_timezone(session: Session) -> timezone:
@@ -624,12 +912,21 @@ def get_schedule_timezone(session: Session) -> timezone:
 
 
 def update_task_state(
-    session: Session, schedules: List[WarehouseSchedules], tz=None
+    session: Session,
+    schedules: List[WarehouseSchedules],
+    tz=None,
+    applied: Optional[Dict[int, Tuple[Optional[str], bool]]] = None,
 ) -> bool:
+    """
+    Sets the cron schedule of each warehouse scheduling task from the enabled schedules. When the currently `applied`
+    state of the tasks is given (see get_applied_task_state), tasks which already have the right schedule and state
+    are left alone.
+    """
     # Make sure we have at least one enabled schedule.
     enabled_schedules = [sch for sch in schedules if sch.enabled]
     if len(enabled_schedules) == 0:
-        disable_all_tasks(session)
+        if applied is None or any(started for _, started in applied.values()):
+            disable_all_tasks(session)
         return False
 
     # Indirection for unit tests. Caller is not expected to provide a timezone.
@@ -639,6 +936,10 @@ def update_task_state(
     # Build the cron list for the enabled schedules
     alter_statements = []
     for offset in task_offsets:
+        if applied is not None and _task_state_matches(
+            applied.get(offset), enabled_schedules, offset, tz
+        ):
+            continue
         # For each "offset", generate multiple statements
         #   1. ALTER TASK ... SUSPEND
         #   2. ALTER TASK ... SET SCHEDULE = 'USING CRON ...'
@@ -647,6 +948,10 @@ def update_task_state(
             _make_alter_task_statements(enabled_schedules, offset, tz)
         )
 
+    if not alter_statements:
+        # Every task already has the right schedule
+        return True
+
     # Collect the statements together
     alter_body = "\n".join(alter_statements)
 
@@ -660,6 +965,27 @@ def update_task_state(
     return True
 
 
+def _task_state_matches(
+    applied: Optional[Tuple[Optional[str], bool]],
+    schedules: List[WarehouseSchedules],
+    offset: int,
+    tz: timezone,
+) -> bool:
+    """
+    Returns True if the applied (cron schedule, started) of the task for `offset` is what the schedules call for.
+    """
+    if applied is None:
+        return False
+    applied_schedule, started = applied
+    cron_schedule, should_run = _make_cron_schedule(schedules, offset, tz)
+    if not should_run:
+        return not started
+    return (
+        started
+        and (applied_schedule or "").lower() == f"using cron {cron_schedule}".lower()
+    )
+
+
 def _make_alter_task_statements(
     schedules: List[WarehouseSchedules],
     offset: int,
@@ -728,6 +1054,9 @@ def get_last_run(session: Session) -> datetime.datetime:
 
 
 def get_schedules(session: Session, is_weekday: bool) -> pd.DataFrame:
+    """
+    Returns the enabled weekday or weekend schedules. Both filters are evaluated in Snowflake.
+    """
     return (
         session.table("internal.wh_schedules")
         .filter(col("weekday") == is_weekday)
@@ -750,62 +1079,146 @@ def disable_all_tasks(session: Session):
 
 
 def build_task_table(session: Session, this_run, last_run: datetime.datetime):
-    today = this_run.date()
-    # TODO handle looking back over a weekend boundary
     # TODO handle the timestamp from config
-    is_weekday = this_run.weekday() < 5
 
     # Look for time of last successful run.
     # If we have no successful past runs, claim the last run was from a day ago so we consider
     # all schedules that are scheduled for "today"
     if last_run is None:
         last_run = this_run - datetime.timedelta(days=1)
+    elif this_run.tzinfo and last_run.tzinfo:
+        last_run = last_run.astimezone(this_run.tzinfo)
+    # Schedules are in the wall-clock time of this run
+    lo = np.datetime64(last_run.replace(tzinfo=None), "us")
+    hi = np.datetime64(this_run.replace(tzinfo=None), "us")
+
+    # Every enabled day has a schedule starting at midnight, so looking back further than a day can't change
+    # which schedule is the latest to have started.
+    first_day = max(last_run, this_run - datetime.timedelta(days=1)).date()
+    days_by_type = {}
+    for i in range((this_run.date() - first_day).days + 1):
+        day = first_day + datetime.timedelta(days=i)
+        days_by_type.setdefault(day.weekday() < 5, []).append(day)
+
+    # Find all schedules for weekend/weekday for each day since the last run, which may cross a weekend boundary.
+    # Snowflake only returns the enabled schedules of that type of day.
+    schedules_by_type = {}
+    candidates = []
+    for is_weekday, days in days_by_type.items():
+        scheds = get_schedules(session, is_weekday)
+        schedules_by_type[is_weekday] = scheds
+        if scheds.empty:
+            continue
+        # The time each schedule started on each of the days, as a (days, schedules) array
+        starts = (
+            np.array(days, dtype="datetime64[D]")[:, np.newaxis]
+            + _start_offsets(scheds.START_AT)[np.newaxis, :]
+        )
+        # Then, determine which schedules should have run since the last time the task ran.
+        day_idx, row_idx = np.nonzero((starts >= lo) & (starts <= hi))
+        candidates.append(scheds.iloc[row_idx].assign(ts=starts[day_idx, row_idx]))
+    if not candidates:
+        return schedules_by_type[this_run.weekday() < 5]
+    scheds = pd.concat(candidates, ignore_index=True)
 
-    # Find all schedules for weekend/weekday (whichever we're currently in)
-    scheds = get_schedules(session, is_weekday)
-    if scheds.empty:
-        return scheds
-
-    # Convert a datetime from the start_time for this schedule, fixed on "today".
-    scheds["ts"] = scheds.START_AT.map(lambda x: build_ts(today, this_run, x))
-    # Then, determine which schedules should have run since the last time the task ran.
-    scheds["should_run"] = scheds.ts.map(lambda x: last_run <= x <= this_run)
     # Finally, take the last schedule for each warehouse that should have run (to transparently handle
     # the task failing to run on the expected 15minute boundaries)
-    to_run = scheds[scheds.should_run].sort_values(by="ts").groupby("NAME").last()
+    to_run = (
+        scheds.sort_values(by="ts", kind="stable")
+        .groupby("NAME", sort=True)
+        .tail(1)
+        .sort_values(by="NAME")
+    )
 
-    return to_run.reset_index()
+    return to_run.reset_index(drop=True)
 
 
-def build_ts(today, now, schedule_start_time: datetime.time):
-    # localize the start_time for the schedule to today's date
-    return datetime.datetime.combine(today, schedule_start_time).replace(
-        tzinfo=now.tzinfo
+def _start_offsets(start_at: pd.Series) -> np.ndarray:
+    """
+    Converts a column of datetime.time into an array of timedelta64 offsets from midnight. Schedules start on 15-minute
+    boundaries, so there are only a handful of distinct times to convert.
+    """
+    codes, uniques = pd.factorize(start_at)
+    seconds = np.array(
+        [t.hour * 3600 + t.minute * 60 + t.second for t in uniques], dtype=np.int64
     )
+    return seconds[codes].astype("timedelta64[s]")
 
 
-def build_statement(session: Session, data):
+def build_statement(
+    session: Session, data, applied: Optional[Dict[str, str]] = None
+) -> Tuple[str, List[str], Dict[str, str]]:
+    """
+    Compares the schedules in `data` with the current state of their warehouses. Schedules whose alter statement was
+    the last one `applied` to their warehouse (see get_applied_state) are skipped without looking at the warehouse.
+    :return: The block of ALTER WAREHOUSE statements to run, the warehouses it alters and the alter statement of each
+    schedule which was compared, by upper-cased warehouse name.
+    """
     df = data
-    arr = WarehouseSchedules.from_df(df)
+    arr = WarehouseSchedules.from_df(df, trusted=True)
+    applied = applied or {}
+    pending = {}
     allstmt = []
     wh_updated = []
+    # Compare against the current state of the warehouses, listed once for the whole run
+    clear_warehouse_snapshot()
     for wh in arr:
+        desired = generate_alter_from_schedule(wh).alter_statement
+        if applied.get(wh.name.upper()) == desired:
+            continue
+        pending[wh.name.upper()] = desired
         wh_now = describe_warehouse(session, wh.name)
         stmt = update_warehouse(wh_now, wh)
         if stmt:
             allstmt.append(stmt)
             wh_updated.append(wh.name)
     if len(allstmt) == 0:
-        return "", wh_updated
+        return "", wh_updated, pending
     joined_stmts = ";\n".join(allstmt)
     return (
         f"""begin
     {joined_stmts};
     end;""",
         wh_updated,
+        pending,
     )
 
 
+def get_applied_state(session: Session) -> Dict[str, str]:
+    """
+    Returns the alter statement last applied to each warehouse, by upper-cased warehouse name, after forgetting the
+    warehouses which were changed since (see INTERNAL.RECONCILE_WAREHOUSE_APPLIED_STATE).
+    """
+    session.call("internal.reconcile_warehouse_applied_state", False)
+    rows = session.sql(
+        "select name, alter_statement from internal.warehouse_applied_state"
+    ).collect()
+    return {r[0]: r[1] for r in rows}
+
+
+def record_applied_state(session: Session, applied: Dict[str, str], altered: bool):
+    """
+    Records the alter statement now in effect for each warehouse, by upper-cased warehouse name. When any warehouse
+    was `altered`, the resulting settings of the warehouses are reconciled right away.
+    """
+    if not applied:
+        return
+    values = ", ".join(["(?, ?)"] * len(applied))
+    params = [v for item in applied.items() for v in item]
+    session.sql(
+        f"""merge into internal.warehouse_applied_state a
+        using (select column1 as name, column2 as alter_statement from values {values}) s
+        on a.name = s.name
+        when matched then update set alter_statement = s.alter_statement, applied_at = current_timestamp(),
+            state_hash = null, reconciled_at = null
+        when not matched then insert (name, alter_statement, applied_at)
+            values (s.name, s.alter_statement, current_timestamp())""",
+        params=params,
+    ).collect()
+    if altered:
+        session.call("internal.reconcile_warehouse_applied_state", True)
+
+
 def now(session: Session):
     return session.sql("select current_timestamp as x").collect()[0].X
 
@@ -816,15 +1229,19 @@ def run(session: Session):
     obj = dict()
     try:
         last_run = get_last_run(session)
+        applied = get_applied_state(session)
 
         df = build_task_table(session, this_run, last_run)
         obj["candidates"] = len(df)
-        stmt, wh_updated = build_statement(session, df)
+        stmt, wh_updated, pending = build_statement(session, df, applied)
         obj["wh_updated"] = wh_updated
+        obj["wh_skipped"] = len(df) - len(pending)
         obj["stmt"] = stmt
         obj["update_count"] = len(wh_updated)
         if stmt:
             run_statement(session, stmt)
+        # The warehouses which were compared now have the settings of their schedule, altered or not
+        record_applied_state(session, pending, bool(stmt))
         success = True
         return stmt
     except Exception as e:
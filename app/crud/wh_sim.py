@@ -0,0 +1,319 @@
+import datetime
+from typing import List, NamedTuple
+import numpy as np
+import pandas as pd
+from snowflake.snowpark import Session
+from .wh_sched import WarehouseSchedules, get_schedule_timezone
+
+WINDOW_MINUTES = 15
+WINDOW_MS = WINDOW_MINUTES * 60 * 1000
+SLOTS_PER_DAY = 24 * 60 // WINDOW_MINUTES
+_MS_PER_HOUR = 3600 * 1000
+# The number of queries one cluster runs concurrently before queueing, Snowflake's default MAX_CONCURRENCY_LEVEL.
+_MAX_CONCURRENCY_LEVEL = 8
+
+# Credits per hour of one cluster of each schedule size. Duplicates INTERNAL.WAREHOUSE_MULTIPLIER, data must be kept
+# in sync.
+_CREDITS_PER_HOUR = {
+    "X-Small": 1,
+    "Small": 2,
+    "Medium": 4,
+    "Large": 8,
+    "X-Large": 16,
+    "2X-Large": 32,
+    "3X-Large": 64,
+    "4X-Large": 128,
+    "5X-Large": 256,
+    "6X-Large": 512,
+    "Medium Snowpark": 4 * 1.5,
+    "Large Snowpark": 8 * 1.5,
+    "X-Large Snowpark": 16 * 1.5,
+    "2X-Large Snowpark": 32 * 1.5,
+    "3X-Large Snowpark": 64 * 1.5,
+    "4X-Large Snowpark": 128 * 1.5,
+}
+
+
+class WarehouseHistory(NamedTuple):
+    """
+    The activity of one warehouse, in the schedule timezone.
+    """
+
+    # WINDOW, RUNNING and QUEUED (the average load) per 15-minute window, from reporting.warehouse_load_history
+    load: pd.DataFrame
+    # WINDOW, WORK (execution milliseconds times the credits per hour of the size the query ran on), CREDITS_PER_HOUR
+    # (of the size most queries ran on) and QUERIES per 15-minute window, from reporting.enriched_query_history
+    work: pd.DataFrame
+    # ST and ET of each period the warehouse was running, from reporting.warehouse_sessions
+    sessions: pd.DataFrame
+    # START_TIME and CREDITS (compute credits billed, for all clusters) per hour, from
+    # reporting.warehouse_metering_history
+    metering: pd.DataFrame
+
+
+def load_history(
+    session: Session,
+    warehouse: str,
+    tz: str,
+    start: datetime.datetime,
+    end: datetime.datetime,
+) -> WarehouseHistory:
+    """
+    Reads the load, queries, sessions and metering of `warehouse` between `start` and `end`, aggregated to 15-minute
+    windows where possible. `start`, `end` and the returned times are in the timezone `tz`.
+    """
+
+    def local(column: str) -> str:
+        return f"convert_timezone('{tz}', {column})::timestamp_ntz"
+
+    params = [warehouse, start, end]
+    load = session.sql(
+        f"""select time_slice({local('start_time')}, {WINDOW_MINUTES}, 'minute') as window,
+            avg(avg_running) as running, avg(avg_queued_load) as queued
+        from reporting.warehouse_load_history
+        where warehouse_name = ? and {local('start_time')} >= ? and {local('start_time')} < ?
+        group by window""",
+        params=params,
+    ).to_pandas()
+    work = session.sql(
+        f"""select time_slice({local('start_time')}, {WINDOW_MINUTES}, 'minute') as window,
+            sum(execution_time * internal.warehouse_multiplier(warehouse_size, warehouse_type)) as work,
+            internal.warehouse_multiplier(mode(warehouse_size), mode(warehouse_type)) as credits_per_hour,
+            count(*) as queries
+        from reporting.enriched_query_history
+        where warehouse_name = ? and {local('start_time')} >= ? and {local('start_time')} < ? and execution_time > 0
+        group by window""",
+        params=params,
+    ).to_pandas()
+    sessions = session.sql(
+        f"""select {local('st')} as st, {local('et')} as et
+        from reporting.warehouse_sessions
+        where warehouse_name = ? and {local('et')} >= ? and {local('st')} < ?
+        order by st""",
+        params=params,
+    ).to_pandas()
+    metering = session.sql(
+        f"""select {local('start_time')} as start_time, sum(credits_used_compute) as credits
+        from reporting.warehouse_metering_history
+        where warehouse_name = ? and {local('start_time')} >= ? and {local('start_time')} < ?
+        group by 1
+        order by 1""",
+        params=params,
+    ).to_pandas()
+    return WarehouseHistory(load, work, sessions, metering)
+
+
+def simulate(
+    schedules: List[WarehouseSchedules],
+    history: WarehouseHistory,
+    start: datetime.datetime,
+    end: datetime.datetime,
+) -> pd.DataFrame:
+    """
+    Replays each 15-minute window between `start` and `end` as if the warehouse had the size, auto-suspend and
+    cluster counts of the schedule in effect at the time.
+
+    The queries of a window are assumed to take the same amount of work on any size, so a size with twice the credits
+    per hour runs them in half the time, with twice as many of them running at once. Each cluster runs as many
+    concurrent queries as the warehouse did per cluster when it queued, or MAX_CONCURRENCY_LEVEL otherwise. The
+    warehouse is billed while the queries run, plus the auto-suspend delay when there is no more work, for as many
+    clusters as the concurrent load needs within the scale limits. Load which doesn't fit on those clusters is queued.
+    Windows which no schedule covers are left as they were.
+    :return: One row per window with the actual (metered) and simulated credits and average queued load.
+    """
+    start = pd.Timestamp(start).floor(f"{WINDOW_MINUTES}min")
+    n = int((pd.Timestamp(end) - start) / pd.Timedelta(minutes=WINDOW_MINUTES))
+    windows = pd.date_range(start, periods=n, freq=f"{WINDOW_MINUTES}min")
+    edges = windows.values.astype("datetime64[ms]").astype(np.int64)
+    edges = np.append(edges, edges[-1] + WINDOW_MS) if n else edges
+
+    load = _by_window(history.load, windows, ["RUNNING", "QUEUED"])
+    work = _by_window(history.work, windows, ["WORK", "CREDITS_PER_HOUR", "QUERIES"])
+    running, queued = load["RUNNING"].to_numpy(), load["QUEUED"].to_numpy()
+    work_ms, queries = work["WORK"].to_numpy(), work["QUERIES"].to_numpy()
+
+    # The size the warehouse actually had, carried over the windows without queries
+    actual_rate = (
+        pd.Series(
+            np.where(work["CREDITS_PER_HOUR"] > 0, work["CREDITS_PER_HOUR"], np.nan)
+        )
+        .ffill()
+        .bfill()
+        .fillna(1)
+        .to_numpy()
+    )
+    active_ms = (
+        np.diff(_active_ms_before(history.sessions, edges)) if n else np.zeros(0)
+    )
+    actual_credits = _metered_credits(
+        history.metering, edges, active_ms, active_ms * actual_rate / _MS_PER_HOUR
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # The clusters the warehouse actually ran, on average while it was running
+        actual_clusters = np.maximum(
+            np.nan_to_num(
+                actual_credits * _MS_PER_HOUR / (active_ms * actual_rate),
+                nan=1.0,
+                posinf=1.0,
+            ),
+            1.0,
+        )
+        # Concurrent queries per cluster. A warehouse which queued was running as many as it could.
+        concurrency = np.where(
+            (queued > 0) & (running > 0),
+            running / actual_clusters,
+            np.maximum(running / actual_clusters, _MAX_CONCURRENCY_LEVEL),
+        )
+
+    # The schedule in effect for each window
+    weekday = windows.dayofweek < 5
+    slot = windows.hour * (60 // WINDOW_MINUTES) + windows.minute // WINDOW_MINUTES
+    timeline = np.full((2, SLOTS_PER_DAY), -1)
+    for i, s in enumerate(schedules):
+        first = (s.start_at.hour * 60 + s.start_at.minute) // WINDOW_MINUTES
+        last = (
+            SLOTS_PER_DAY
+            if s.finish_at == datetime.time(23, 59)
+            else (s.finish_at.hour * 60 + s.finish_at.minute) // WINDOW_MINUTES
+        )
+        timeline[int(s.weekday), first:last] = i
+    idx = timeline[weekday.astype(int), slot]
+    scheduled = idx >= 0
+
+    def per_schedule(values):
+        return np.append(np.asarray(values, dtype=float), np.nan)[idx]
+
+    rate = per_schedule([_CREDITS_PER_HOUR[s.size] for s in schedules])
+    suspend_ms = per_schedule([s.suspend_minutes * 60 * 1000 for s in schedules])
+    min_clusters = per_schedule([max(s.scale_min, 1) for s in schedules])
+    max_clusters = per_schedule([max(s.scale_max, s.scale_min, 1) for s in schedules])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Concurrent queries on the simulated size
+        demand = (running + queued) * actual_rate / rate
+        clusters = np.clip(np.ceil(demand / concurrency), min_clusters, max_clusters)
+        simulated_queued = np.maximum(demand - clusters * concurrency, 0)
+        busy_ms = np.minimum(work_ms / rate / clusters, WINDOW_MS)
+        # An auto-suspend of 0 never suspends
+        idle_ms = np.where(
+            suspend_ms == 0,
+            WINDOW_MS - busy_ms,
+            np.where(queries > 0, np.minimum(suspend_ms, WINDOW_MS - busy_ms), 0),
+        )
+        simulated_credits = (busy_ms + idle_ms) * clusters * rate / _MS_PER_HOUR
+
+    return pd.DataFrame(
+        {
+            "WINDOW": windows,
+            "SCHEDULED": scheduled,
+            "SIZE": np.where(
+                scheduled,
+                np.array([s.size for s in schedules] + [None], dtype=object)[idx],
+                None,
+            ),
+            "CLUSTERS": np.where(scheduled, clusters, np.nan),
+            "ACTUAL_CREDITS": actual_credits,
+            "SIMULATED_CREDITS": np.where(scheduled, simulated_credits, actual_credits),
+            "ACTUAL_QUEUED": queued,
+            "SIMULATED_QUEUED": np.where(scheduled, simulated_queued, queued),
+        }
+    )
+
+
+def simulate_schedules(
+    session: Session,
+    warehouse: str,
+    schedules: List[WarehouseSchedules],
+    days: int = 30,
+) -> pd.DataFrame:
+    """
+    Simulates `schedules` for `warehouse` over the last `days` days, see simulate().
+    """
+    assert days > 0, "The simulation must cover at least one day."
+    # Windows are bucketed in the schedule timezone, so the range must be too
+    tz = get_schedule_timezone(session).zone
+    end = pd.Timestamp(
+        session.sql(
+            "select convert_timezone(?, current_timestamp())::timestamp_ntz as x",
+            params=[tz],
+        )
+        .collect()[0]
+        .X
+    ).floor(f"{WINDOW_MINUTES}min")
+    start = end - pd.Timedelta(days=days)
+    history = load_history(
+        session, warehouse, tz, start.to_pydatetime(), end.to_pydatetime()
+    )
+    return simulate(schedules, history, start, end)
+
+
+def _by_window(
+    df: pd.DataFrame, windows: pd.DatetimeIndex, columns: List[str]
+) -> pd.DataFrame:
+    """
+    Aligns the per-window rows of `df` to `windows`, with 0 for the windows it has no row for.
+    """
+    if df.empty:
+        return pd.DataFrame(0.0, index=windows, columns=columns)
+    aligned = df.assign(WINDOW=pd.to_datetime(df["WINDOW"])).set_index("WINDOW")[
+        columns
+    ]
+    return aligned.astype(float).reindex(windows, fill_value=0.0).fillna(0.0)
+
+
+def _metered_credits(
+    metering: pd.DataFrame,
+    edges: np.ndarray,
+    active_ms: np.ndarray,
+    estimated: np.ndarray,
+) -> np.ndarray:
+    """
+    Spreads the credits metered per hour over the windows between `edges` (epoch milliseconds), in proportion to how
+    long the warehouse was running in each of them, or evenly if it wasn't. Windows without metering yet, which lags
+    by a few hours, keep their `estimated` credits.
+    """
+    credits = estimated.astype(float)
+    if metering.empty or len(edges) < 2:
+        return credits
+    hours = (
+        pd.to_datetime(metering["START_TIME"])
+        .values.astype("datetime64[ms]")
+        .astype(np.int64)
+    )
+    order = np.argsort(hours)
+    hours, metered = hours[order], metering["CREDITS"].astype(float).to_numpy()[order]
+    # The metered hour each window starts in
+    hour = np.searchsorted(hours, edges[:-1], side="right") - 1
+    metered_window = (hour >= 0) & (
+        edges[:-1] < hours[np.maximum(hour, 0)] + _MS_PER_HOUR
+    )
+    hour = np.where(metered_window, hour, len(hours))
+    active_in_hour = np.bincount(hour, weights=active_ms, minlength=len(hours) + 1)
+    windows_in_hour = np.bincount(hour, minlength=len(hours) + 1)
+    share = np.where(
+        active_in_hour[hour] > 0,
+        active_ms / np.maximum(active_in_hour[hour], 1),
+        1 / np.maximum(windows_in_hour[hour], 1),
+    )
+    return np.where(metered_window, np.append(metered, 0.0)[hour] * share, credits)
+
+
+def _active_ms_before(sessions: pd.DataFrame, edges: np.ndarray) -> np.ndarray:
+    """
+    Returns, for each edge (epoch milliseconds), how long the warehouse had been running before it. The sessions of a
+    warehouse don't overlap, so this is the sum of the finished sessions plus the part of the one in progress.
+    """
+    if sessions.empty:
+        return np.zeros(len(edges))
+    st = pd.to_datetime(sessions["ST"]).values.astype("datetime64[ms]").astype(np.int64)
+    et = pd.to_datetime(sessions["ET"]).values.astype("datetime64[ms]").astype(np.int64)
+    order = np.argsort(st)
+    st, et = st[order], et[order]
+    finished = np.concatenate([[0], np.cumsum(et - st)])
+    # The number of sessions which started before each edge
+    started = np.searchsorted(st, edges, side="right")
+    last = np.maximum(started - 1, 0)
+    in_progress = np.where(
+        started > 0, np.clip(edges - st[last], 0, et[last] - st[last]), 0
+    )
+    return finished[last] + in_progress
@@ -6,8 +6,9 @@ import streamlit as st
 from connection import Connection
 import session as general_session
 from session import Mode
-from crud.labels import Label as ModelLabel
-from crud.session import snowpark_session
+from crud.labels import Label as ModelLabel, preview_label
+from crud.session import deferred_validation, snowpark_session
+from crud.tracing import Tracer
 from crud.errors import error_to_markdown
 
 
@@ -48,6 +49,7 @@ class Label:
             to identify any query not otherwise labeled.
             """
             )
+            self.session.show_trace(st)
 
         with Connection.get() as conn:
             data = conn.sql(
@@ -185,8 +187,12 @@ class Label:
                     "labels",
                     "create",
                 )
+            tracer = Tracer()
+            self.session.set_trace(tracer)
             try:
-                with snowpark_session(conn) as txn:
+                with snowpark_session(
+                    conn, tracer, "create label"
+                ) as txn, deferred_validation():
                     obj = ModelLabel.parse_obj(
                         {
                             "name": name,
@@ -222,8 +228,12 @@ class Label:
                     "update",
                 )
 
+            tracer = Tracer()
+            self.session.set_trace(tracer)
             try:
-                with snowpark_session(conn) as sf:
+                with snowpark_session(
+                    conn, tracer, "update label"
+                ) as sf, deferred_validation():
                     # Make the old label, bypassing validation
                     if is_dynamic:
                         old_label = ModelLabel.construct(
@@ -267,7 +277,9 @@ class Label:
                     "labels",
                     "delete",
                 )
-            with snowpark_session(conn) as txn:
+            tracer = Tracer()
+            self.session.set_trace(tracer)
+            with snowpark_session(conn, tracer, "delete label") as txn:
                 # Make the old label, bypassing validation
                 if is_dynamic:
                     label_to_del = ModelLabel.construct(
@@ -280,6 +292,55 @@ class Label:
             self.session.set_toast("Label deleted.")
             self.session.do_list()
 
+    def preview(self, condition, is_dynamic):
+        with st.expander("Preview"):
+            cols = st.columns(2)
+            days = cols[0].number_input(
+                key="PREVIEW_DAYS", label="Days of history", min_value=1, value=7
+            )
+            sample = cols[1].slider(
+                key="PREVIEW_SAMPLE",
+                label="Sample (%)",
+                min_value=1,
+                max_value=100,
+                value=100,
+            )
+            if not st.button("Preview", disabled=not condition):
+                return
+            try:
+                with st.spinner("Evaluating condition..."), Connection.get() as conn:
+                    preview = preview_label(
+                        conn,
+                        condition,
+                        is_dynamic,
+                        days,
+                        sample if sample < 100 else None,
+                    )
+            except AssertionError as ae:
+                st.error(str(ae))
+                return
+
+            cols = st.columns(2)
+            cols[0].metric(
+                "Matching queries",
+                f"{preview.queries:,}",
+                help=f"Out of {preview.total_queries:,} queries",
+            )
+            cols[1].metric(
+                "Matching cost",
+                f"${preview.cost:,.2f}",
+                help=f"Out of ${preview.total_cost:,.2f}",
+            )
+            if preview.overlaps:
+                st.write("Matching queries by existing grouped label")
+                st.dataframe(
+                    [
+                        {"Group": group, "Label": label, "Queries": queries}
+                        for (group, label), queries in preview.overlaps.items()
+                    ],
+                    use_container_width=True,
+                )
+
     def create_label(self, create: dict):
         grouped = create.get("grouped")
         is_dynamic = create.get("is_dynamic", False)
@@ -305,6 +366,7 @@ class Label:
             )
 
         condition = st.text_area(key="CONDITION", label="Condition")
+        self.preview(condition, is_dynamic)
 
         st.button(
             "Create",
@@ -344,6 +406,7 @@ class Label:
         condition = st.text_area(
             key="CONDITION", label="Condition", value=update["condition"]
         )
+        self.preview(condition, is_dynamic)
 
         st.button(
             "Update",
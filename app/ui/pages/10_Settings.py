@@ -97,6 +97,11 @@ with config_tab:
             key="tz-select",
             options=pytz.common_timezones,
         )
+        retention = st.text_input(
+            "Query Monitor Activity Retention (days)",
+            value=str(config.Config.get("query_monitor_retention_days") or 30),
+            key="query_monitor_retention_days",
+        )
         if st.form_submit_button("Save"):
 
             if (
@@ -108,9 +113,12 @@ with config_tab:
 
             elif timezone is None or timezone not in pytz.common_timezones:
                 st.error("Please enter a valid timezone.")
+            elif not retention.strip().isdigit() or int(retention) < 1:
+                st.error("Please enter a whole number of days for the retention.")
             else:
                 config.set_costs(clean_compute, clean_serverless, clean_storage)
                 config.Config.set("default_timezone", timezone)
+                config.Config.set("query_monitor_retention_days", retention.strip())
                 connection.execute(
                     f"""
                 BEGIN
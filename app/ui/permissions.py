@@ -8,6 +8,7 @@ if not add_custom_modules():
 
 
 from crud import OPSCENTER_ROLE_ARN, get_api_gateway_url  # noqa E402
+from crud.conditions import clear_schema_snapshot  # noqa E402
 
 try:
     import snowflake.permissions as perms
@@ -64,3 +65,5 @@ def setup_permissions():
     if not config.up_to_date() and has_account_privileges:
         with connection.Connection.get() as conn:
             conn.call(f"{db}.ADMIN.FINALIZE_SETUP")
+        # The migration may have changed the columns conditions can use
+        clear_schema_snapshot()
@@ -7,6 +7,7 @@ from session import Mode
 from crud.errors import error_to_markdown
 from crud.probes import Probe as ModelProbe
 from crud.session import snowpark_session
+from crud.tracing import Tracer
 
 
 def display():
@@ -57,6 +58,7 @@ class Probe:
 
             """
             )
+            self.session.show_trace(st)
         with Connection.get() as conn:
             data = conn.sql("select * from internal.PROBES order by name").collect()
 
@@ -126,6 +128,49 @@ class Probe:
 
         st.button("New", key="create", on_click=self.session.do_create, args=[dict()])
 
+        self.show_metrics()
+
+    def show_metrics(self):
+        with st.expander("Monitoring performance (last 24 hours)"):
+            with Connection.get() as conn:
+                summary = conn.sql(
+                    """
+                    select count(*) as runs, sum(queries_scanned) as scanned, sum(matches) as matches, sum(suppressed) as suppressed,
+                        percentile_cont(0.95) within group (order by duration_ms) as p95_duration_ms,
+                        (select percentile_cont(0.5) within group (order by latency_ms) from internal.probe_actions
+                            where action_time >= dateadd(day, -1, current_timestamp())) as p50_latency_ms,
+                        (select percentile_cont(0.95) within group (order by latency_ms) from internal.probe_actions
+                            where action_time >= dateadd(day, -1, current_timestamp())) as p95_latency_ms
+                    from internal.probe_monitoring_runs
+                    where run_start >= dateadd(day, -1, current_timestamp())"""
+                ).collect()[0]
+                if not summary["RUNS"]:
+                    st.write("Query monitors have not run in the last 24 hours.")
+                    return
+                hourly = conn.sql(
+                    """select * from reporting.query_monitor_run_metrics
+                    where hour >= dateadd(day, -1, current_timestamp()) order by hour desc"""
+                ).to_pandas()
+
+            cols = st.columns(4)
+            cols[0].metric("Runs", f"{summary['RUNS']:,}")
+            cols[1].metric("Queries examined", f"{summary['SCANNED'] or 0:,}")
+            cols[2].metric(
+                "p95 run time",
+                _format_ms(summary["P95_DURATION_MS"]),
+                help="Time taken by a PROBE_MONITORING run",
+            )
+            cols[3].metric(
+                "p50 / p95 latency",
+                f"{_format_ms(summary['P50_LATENCY_MS'])} / {_format_ms(summary['P95_LATENCY_MS'])}",
+                help="Time from the start of a matching query until it was cancelled or notified on",
+            )
+            if summary["SUPPRESSED"]:
+                st.caption(
+                    f"{summary['SUPPRESSED']:,} notifications were suppressed by rate limits. Cancellations are never rate limited."
+                )
+            st.dataframe(hourly, use_container_width=True)
+
     def on_create_click(
         self,
         name,
@@ -143,8 +188,10 @@ class Probe:
                     "probes",
                     "create",
                 )
+            tracer = Tracer()
+            self.session.set_trace(tracer)
             try:
-                with snowpark_session(conn) as txn:
+                with snowpark_session(conn, tracer, "create query monitor") as txn:
                     obj = ModelProbe.parse_obj(
                         {
                             "name": name,
@@ -189,8 +236,10 @@ class Probe:
                     "probes",
                     "update",
                 )
+            tracer = Tracer()
+            self.session.set_trace(tracer)
             try:
-                with snowpark_session(conn) as txn:
+                with snowpark_session(conn, tracer, "update query monitor") as txn:
                     old_probe = ModelProbe.construct(name=oldname)
                     new_probe = ModelProbe.parse_obj(
                         {
@@ -227,7 +276,9 @@ class Probe:
                     "probes",
                     "delete",
                 )
-            with snowpark_session(conn) as txn:
+            tracer = Tracer()
+            self.session.set_trace(tracer)
+            with snowpark_session(conn, tracer, "delete query monitor") as txn:
                 del_probe = ModelProbe.construct(name=name)
                 del_probe.delete(txn)
 
@@ -329,3 +380,9 @@ class Probe:
 def write_if(column, value):
     if value is not None:
         column.write(value)
+
+
+def _format_ms(ms) -> str:
+    if ms is None:
+        return "-"
+    return f"{ms / 1000:,.1f}s"
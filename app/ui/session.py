@@ -57,6 +57,7 @@ class Session:
 
     def __init__(self):
         self.toast = None
+        self.trace = None
         self.mode = Mode.LIST
         self.initialized = False
         self.report_session = ReportSession()
@@ -84,6 +85,32 @@ class Session:
                     self.toast = None
                     # TODO: figure out how to hide toast after a few seconds (this probably requires a custom component)
 
+    def set_trace(self, tracer):
+        self.trace = tracer
+
+    def show_trace(self, container):
+        """
+        Shows the Snowflake statements issued by the last create, update or delete and how long each took.
+        """
+        if self.trace and self.trace.events:
+            summary = self.trace.summary()
+            total_ms = sum(t["total_ms"] for t in summary)
+            count = sum(t["count"] for t in summary)
+            container.expander(
+                f"Last change: {count} statements, {total_ms:.0f} ms"
+            ).dataframe(
+                [
+                    dict(
+                        statement=t["statement"],
+                        count=t["count"],
+                        total_ms=round(t["total_ms"], 1),
+                        max_ms=round(t["max_ms"], 1),
+                        rows=t["rows"],
+                    )
+                    for t in summary
+                ]
+            )
+
     def get_report(self):
         return self.report_session
 
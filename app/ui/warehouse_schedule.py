@@ -5,6 +5,8 @@ import session
 import config
 from table import build_table, Actions
 from crud.base import BaseOpsCenterModel
+from crud.wh_sched import WarehouseSchedules
+from crud.wh_sim import simulate_schedules
 from typing import ClassVar
 from reports_heatmap import heatmap
 from filters import BaseFilter
@@ -19,6 +21,49 @@ import warehouses  # noqa E402
 sess = session.reports().get_report()
 
 
+def simulation(warehouse: str, credit_cost: float, days: int = 30):
+    st.markdown(
+        f"Estimates what the schedules above would have cost over the last {days} days, by replaying the load of "
+        "the warehouse in 15-minute windows at the scheduled size, auto-suspend and cluster counts. Periods without "
+        "a schedule are left as they were."
+    )
+    if not st.button("Run simulation", key="simulate"):
+        return
+    with st.spinner("Replaying warehouse history..."):
+        with connection.Connection.get() as conn:
+            schedules = WarehouseSchedules.find_all(conn, warehouse)
+            df = simulate_schedules(conn, warehouse, schedules, days)
+
+    actual = df.ACTUAL_CREDITS.sum()
+    simulated = df.SIMULATED_CREDITS.sum()
+    cols = st.columns(3)
+    cols[0].metric(
+        "Actual spend", f"${actual * credit_cost:,.2f}", help=f"{actual:,.1f} credits"
+    )
+    cols[1].metric(
+        "Simulated spend",
+        f"${simulated * credit_cost:,.2f}",
+        delta=f"{(simulated - actual) * credit_cost:,.2f}",
+        delta_color="inverse",
+        help=f"{simulated:,.1f} credits",
+    )
+    cols[2].metric(
+        "Queued load",
+        f"{df.SIMULATED_QUEUED.mean():,.2f}",
+        delta=f"{df.SIMULATED_QUEUED.mean() - df.ACTUAL_QUEUED.mean():,.2f}",
+        delta_color="inverse",
+        help="Average number of queries waiting for the warehouse, simulated and compared to what actually happened",
+    )
+    daily = (
+        df.assign(DAY=df.WINDOW.dt.date)
+        .groupby("DAY")[["ACTUAL_CREDITS", "SIMULATED_CREDITS"]]
+        .sum()
+        .mul(credit_cost)
+        .rename(columns={"ACTUAL_CREDITS": "Actual", "SIMULATED_CREDITS": "Simulated"})
+    )
+    st.line_chart(daily)
+
+
 class WarehouseSummary(BaseOpsCenterModel):
     col_widths: ClassVar[dict] = {
         "warehouse": ("Warehouse", 2),
@@ -115,9 +160,11 @@ def display():
     else:
         whfilter = st.session_state["warehouse"]
         st.title(whfilter.warehouse)
-        s, a, r = st.tabs(["Schedule", "Activity", "Recommendations"])
+        s, m, a, r = st.tabs(["Schedule", "Simulation", "Activity", "Recommendations"])
         with s:
             warehouses.display()
+        with m:
+            simulation(whfilter.warehouse, credit_cost)
         with a:
             f = BaseFilter(None)
             f.start = range[0]
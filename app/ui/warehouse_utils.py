@@ -34,7 +34,7 @@ def set_enabled(wh_name: str, enabled: bool):
             f"update internal.{WarehouseSchedules.table_name} set enabled = ? where name = ?",
             params=[enabled, wh_name],
         ).collect()
-        after_schedule_change(txn)
+        after_schedule_change(txn, wh_name)
 
 
 def time_filter(
@@ -217,9 +217,11 @@ class Warehouses(Container):
             new_row.write(txn)
 
             # Make sure the rest of the rows are updated
-            [i.update(txn, i) for i in new_data if i.id_val != new_row_id]
+            WarehouseSchedules.batch_upsert(
+                txn, [i for i in new_data if i.id_val != new_row_id]
+            )
             # Twiddle the task state after adding a new schedule
-            after_schedule_change(txn)
+            after_schedule_change(txn, row.name)
 
     def on_delete_click_internal(self, *args) -> Optional[str]:
         row = args[0][0]
@@ -233,10 +235,10 @@ class Warehouses(Container):
             comment, new_warehouses = verify_and_clean(data, ignore_errors=True)
             if comment is not None:
                 return comment
-            [i.update(txn, i) for i in new_warehouses]
+            WarehouseSchedules.batch_upsert(txn, new_warehouses)
 
             # Twiddle the task state after adding a new schedule
-            after_schedule_change(txn)
+            after_schedule_change(txn, row.name)
 
     def on_update_click_internal(self, *args) -> Optional[str]:
         if args[3] is not None:
@@ -249,9 +251,9 @@ class Warehouses(Container):
         if comment is not None:
             return comment
         with connection.Connection.get() as conn, transaction(conn) as txn:
-            [i.update(txn, i) for i in new_warehouses]
+            WarehouseSchedules.batch_upsert(txn, new_warehouses)
             # Twiddle the task state after a schedule has changed
-            after_schedule_change(txn)
+            after_schedule_change(txn, args[0].name)
 
     def list(self):
         wh = st.session_state.get("warehouse")
@@ -64,54 +64,152 @@ EXCEPTION
         raise;
 END;
 
+-- Label values computed once per query by QUERY_HISTORY_MAINTENANCE, keyed by the label (or label group) name. Reads of
+-- LABELED_QUERY_HISTORY use these values rather than evaluating every label condition over the whole history.
+CREATE TABLE IF NOT EXISTS INTERNAL_REPORTING_MV.LABEL_VALUES (query_id text, labels object);
+
+-- The definition of each label key which LABEL_VALUES currently holds. A key whose definition has changed since it was
+-- materialized is evaluated by LABELED_QUERY_HISTORY until it is backfilled.
+CREATE TABLE IF NOT EXISTS INTERNAL.LABEL_MATERIALIZATION (label_key text, definition_hash text, materialized_at timestamp_ltz);
+
+-- One column of LABELED_QUERY_HISTORY per ungrouped label, label group and dynamic label group.
+CREATE OR REPLACE VIEW INTERNAL.LABEL_DEFINITIONS AS
+WITH definitions AS (
+    SELECT 1 AS kind_order, name AS label_key, 'boolean' AS value_type,
+        'case when ' || condition || ' then true else false end' AS expr
+    FROM internal.labels
+    WHERE group_name IS NULL
+    UNION ALL
+    SELECT 2, group_name, 'string',
+        'case ' || listagg(' when ' || condition || $$ then '$$ || replace(name, '''', '''''') || $$' $$, '') WITHIN GROUP (ORDER BY group_rank) || $$ else 'Other' end$$
+    FROM internal.labels
+    WHERE group_name IS NOT NULL AND NOT is_dynamic
+    GROUP BY group_name
+    UNION ALL
+    SELECT 3, group_name, 'string',
+        'iff( ' || condition || ' is not null, ' || condition || $$, 'Other')$$
+    FROM internal.labels
+    WHERE is_dynamic
+)
+SELECT kind_order, label_key, value_type, expr, sha2(value_type || ':' || expr) AS definition_hash
+FROM definitions;
+
 CREATE OR REPLACE PROCEDURE INTERNAL.UPDATE_LABEL_VIEW()
 RETURNS boolean
 AS
 BEGIN
-    let labels cursor for select name, condition from internal.labels where group_name is null;
+    let labels cursor for
+        select d.label_key, d.value_type, d.expr, coalesce(m.definition_hash = d.definition_hash, false) as materialized
+        from internal.label_definitions d
+        left join internal.label_materialization m on m.label_key = d.label_key
+        order by d.kind_order, d.label_key;
     let s string := $$
 CREATE OR REPLACE VIEW REPORTING.LABELED_QUERY_HISTORY
 COPY GRANTS
 AS
-SELECT *,$$;
+SELECT eqh.*,$$;
+    let col string;
+    let k string;
     for label in labels do
-         s := s || '\n\tcase when ' || label.condition || ' then true else false end as "' || label.name || '",';
+        col := label.expr;
+        if (label.materialized) then
+            -- Read the stored value, falling back to the condition for queries which have not been labeled yet.
+            k := '''' || replace(label.label_key, '''', '''''') || '''';
+            col := 'iff(get(lv._lv_labels, ' || k || ') is not null, get(lv._lv_labels, ' || k || ')::' || label.value_type || ', ' || label.expr || ')';
+        end if;
+        s := s || '\n\t' || col || ' as "' || label.label_key || '",';
     end for;
 
-    let grouped_labels cursor for
-        select group_name, name, condition from internal.labels
-        where group_name is not null and NOT is_dynamic
-        order by group_name, group_rank;
-    let group_name string := null;
-    for grp in grouped_labels do
-        if (grp.group_name <> group_name or group_name is null) then
-            if (group_name is not null) then
-                s := s || ' end as "'|| group_name || '", ';
-            end if;
-
-            s := s || '\n\tcase ';
-        end if;
+    s := s || '\n\t1 as not_used_internal\nFROM REPORTING.ENRICHED_QUERY_HISTORY eqh' ||
+        '\nLEFT JOIN (SELECT query_id AS _lv_query_id, labels AS _lv_labels FROM INTERNAL_REPORTING_MV.LABEL_VALUES) lv ON lv._lv_query_id = eqh.query_id';
+    SYSTEM$LOG_INFO('Updating label definitions. Updated SQL: \n' || s);
+    --return s;
+    execute immediate s;
+    return true;
+END;
 
-        s := s || ' when ' || grp.condition || $$ then '$$ || grp.name || $$' $$;
-        group_name := grp.group_name;
+-- Computes label values for the queries in ENRICHED_QUERY_HISTORY which match source_filter. When pending is true, only the
+-- label keys whose definition has not been materialized are computed (and recorded as materialized), otherwise only the
+-- keys which are already materialized. Values of other keys are left untouched. Returns the number of keys computed.
+CREATE OR REPLACE PROCEDURE INTERNAL.MERGE_LABEL_VALUES(source_filter string, pending boolean)
+RETURNS number
+AS
+BEGIN
+    let labels cursor for
+        select d.label_key, d.expr, d.definition_hash, coalesce(m.definition_hash = d.definition_hash, false) as materialized
+        from internal.label_definitions d
+        left join internal.label_materialization m on m.label_key = d.label_key;
+    let n number := 0;
+    let k string;
+    let cols string := '';
+    let updates string := 'coalesce(t.labels, object_construct())';
+    let inserts string := '';
+    let hashes string := '';
+    for label in labels do
+        if (label.materialized <> pending) then
+            n := n + 1;
+            k := '''' || replace(label.label_key, '''', '''''') || '''';
+            cols := cols || ',\n\t' || label.expr || ' as c' || n;
+            updates := 'object_insert(' || updates || ', ' || k || ', s.c' || n || ', true)';
+            inserts := inserts || iff(n > 1, ', ', '') || k || ', s.c' || n;
+            hashes := hashes || iff(n > 1, ', ', '') || '(' || k || ', ''' || label.definition_hash || ''')';
+        end if;
     end for;
 
-    if (group_name is not null) then
-        s := s || $$ else 'Other' end as "$$ || group_name || '", ';
+    if (n = 0) then
+        return 0;
     end if;
 
-    let dynamic_groups cursor for
-        select group_name, condition from internal.labels
-        where is_dynamic;
-    for dgrp in dynamic_groups do
-        s := s || '\n\tiff( ' || dgrp.condition || ' is not null, ' || dgrp.condition || ', \'Other\')  as "' || dgrp.group_name || '",';
+    -- A query has one row in ENRICHED_QUERY_HISTORY, but keep the merge deterministic if it is ever seen twice.
+    let stmt string := 'MERGE INTO INTERNAL_REPORTING_MV.LABEL_VALUES t USING (\nSELECT query_id' || cols ||
+        '\nFROM REPORTING.ENRICHED_QUERY_HISTORY WHERE ' || source_filter ||
+        '\nQUALIFY ROW_NUMBER() OVER (PARTITION BY query_id ORDER BY end_time DESC) = 1) s ON t.query_id = s.query_id' ||
+        '\nWHEN MATCHED THEN UPDATE SET t.labels = ' || updates ||
+        '\nWHEN NOT MATCHED THEN INSERT (query_id, labels) VALUES (s.query_id, object_construct_keep_null(' || inserts || '))';
+    execute immediate stmt;
+
+    if (pending) then
+        -- Record the definitions which were used, not the current ones, in case a label changed in the meantime.
+        execute immediate 'MERGE INTO INTERNAL.LABEL_MATERIALIZATION m USING (SELECT column1 AS label_key, column2 AS definition_hash FROM VALUES ' || hashes || ') d' ||
+            ' ON m.label_key = d.label_key' ||
+            ' WHEN MATCHED THEN UPDATE SET m.definition_hash = d.definition_hash, m.materialized_at = current_timestamp()' ||
+            ' WHEN NOT MATCHED THEN INSERT (label_key, definition_hash, materialized_at) VALUES (d.label_key, d.definition_hash, current_timestamp())';
+    end if;
+    return n;
+END;
+
+-- Backfills the values of new or edited labels over the whole query history and drops the values of deleted labels. Each
+-- pending label is computed once, then LABELED_QUERY_HISTORY is regenerated to read the stored values.
+CREATE OR REPLACE PROCEDURE INTERNAL.BACKFILL_LABEL_VALUES()
+RETURNS OBJECT
+AS
+BEGIN
+    BEGIN TRANSACTION;
+    let removed cursor for
+        select m.label_key
+        from internal.label_materialization m
+        left join internal.label_definitions d on d.label_key = m.label_key
+        where d.label_key is null;
+    let removed_count number := 0;
+    for r in removed do
+        execute immediate 'UPDATE INTERNAL_REPORTING_MV.LABEL_VALUES SET labels = object_delete(labels, ''' || replace(r.label_key, '''', '''''') || ''')';
+        removed_count := removed_count + 1;
     end for;
+    delete from internal.label_materialization where label_key not in (select label_key from internal.label_definitions);
 
-    s := s || '\n\t1 as not_used_internal\nFROM REPORTING.ENRICHED_QUERY_HISTORY';
-    SYSTEM$LOG_INFO('Updating label definitions. Updated SQL: \n' || s);
-    --return s;
-    execute immediate s;
-    return true;
+    let backfilled number;
+    call internal.merge_label_values('true', true) into :backfilled;
+    COMMIT;
+
+    if (removed_count > 0 or backfilled > 0) then
+        call internal.update_label_view();
+    end if;
+    return object_construct('labels_backfilled', backfilled, 'labels_removed', removed_count);
+EXCEPTION
+    WHEN OTHER THEN
+        ROLLBACK;
+        SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Failed to backfill label values.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+        return OBJECT_CONSTRUCT('SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate);
 END;
 
 CREATE OR REPLACE PROCEDURE ADMIN.CREATE_LABEL(name text, grp text, rank number, condition text, is_dynamic boolean)
@@ -238,6 +336,33 @@ def update_label(session, old_name, name, grp, rank, condition):
     return update_entity(session, 'LABEL', old_name, {'name': name, 'group_name': grp, 'group_rank': rank, 'condition': condition, 'is_dynamic': False, 'label_created_at': datetime.now(), 'label_modified_at': datetime.now(), 'label_id': str(uuid4())})
 $$;
 
+-- Applies a batch of label changes, each an object with an "action" of 'create', 'update' or 'delete', the "name" of the
+-- label to update or delete and the new label as "entity". LABELED_QUERY_HISTORY is regenerated once for the whole batch.
+-- Returns the outcome of each change: null on success or an error message.
+CREATE OR REPLACE PROCEDURE ADMIN.APPLY_LABELS(operations array)
+    RETURNS array
+    language python
+    runtime_version = "3.10"
+    handler = 'apply_labels'
+    packages = ('snowflake-snowpark-python', 'pydantic==1.*', 'snowflake-telemetry-python')
+    imports = ('{{stage}}/python/crud.zip', '{{stage}}/python/sqlglot.zip')
+    EXECUTE AS OWNER
+AS
+$$
+from crud import apply_entities
+from datetime import datetime
+from uuid import uuid4
+def apply_labels(session, operations):
+    for op in operations:
+        entity = op.get('entity')
+        if isinstance(entity, dict):
+            entity.setdefault('is_dynamic', False)
+            entity.setdefault('label_created_at', datetime.now())
+            entity.setdefault('label_modified_at', datetime.now())
+            entity.setdefault('label_id', str(uuid4()))
+    return apply_entities(session, 'LABEL', operations)
+$$;
+
 CREATE OR REPLACE VIEW CATALOG.LABELS AS SELECT * FROM INTERNAL.LABELS;
 
 CREATE OR REPLACE PROCEDURE INTERNAL.POPULATE_PREDEFINED_LABELS()
@@ -304,7 +429,7 @@ CREATE OR REPLACE PROCEDURE INTERNAL_PYTHON.VALIDATE_PREDEFINED_LABELS()
     runtime_version = "3.10"
     handler = 'validate_predefined_labels'
     packages = ('snowflake-snowpark-python', 'pydantic==1.*', 'snowflake-telemetry-python')
-    imports = ('{{stage}}/python/crud.zip')
+    imports = ('{{stage}}/python/crud.zip', '{{stage}}/python/sqlglot.zip')
     EXECUTE AS OWNER
 AS
 $$
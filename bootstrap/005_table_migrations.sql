@@ -84,6 +84,30 @@ BEGIN
 END;
 
 
+CREATE TABLE IF NOT EXISTS INTERNAL.CONDITION_SCHEMA (source text, column_name text, data_type text);
+-- When the columns were snapshotted, so that the CRUD code knows to reload its copy.
+ALTER TABLE INTERNAL.CONDITION_SCHEMA ADD COLUMN IF NOT EXISTS refreshed_at timestamp_ltz;
+
+CREATE OR REPLACE PROCEDURE internal.refresh_condition_schema()
+    RETURNS STRING
+    LANGUAGE SQL
+    COMMENT = 'Snapshots the columns that label and query monitor conditions may reference, so the CRUD code can validate conditions without compiling them in Snowflake.'
+    AS
+BEGIN
+    BEGIN TRANSACTION;
+    DELETE FROM INTERNAL.CONDITION_SCHEMA;
+    INSERT INTO INTERNAL.CONDITION_SCHEMA (source, column_name, data_type, refreshed_at)
+        SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, current_timestamp() FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE (TABLE_SCHEMA = 'REPORTING' AND TABLE_NAME = 'ENRICHED_QUERY_HISTORY')
+            OR (TABLE_SCHEMA = 'INTERNAL' AND TABLE_NAME = 'DUMMY_QUERY_HISTORY_UDTF');
+    COMMIT;
+    return 'Success';
+EXCEPTION
+  WHEN OTHER THEN
+      ROLLBACK;
+      RAISE;
+END;
+
 CREATE OR REPLACE PROCEDURE internal.migrate_view()
     RETURNS STRING
     LANGUAGE SQL
@@ -92,6 +116,7 @@ CREATE OR REPLACE PROCEDURE internal.migrate_view()
 BEGIN
     call INTERNAL.create_view_QUERY_HISTORY_COMPLETE_AND_DAILY();
     call INTERNAL.create_view_enriched_query_history();
+    call INTERNAL.refresh_condition_schema();
     call INTERNAL.create_view_enriched_query_history_daily();
     call INTERNAL.create_view_enriched_query_history_hourly();
     call INTERNAL.UPDATE_LABEL_VIEW();
@@ -5,8 +5,112 @@ CREATE OR REPLACE VIEW CATALOG.QUERY_MONITORS AS SELECT * FROM INTERNAL.PROBES;
 CREATE TABLE INTERNAL.PREDEFINED_PROBES if not exists (name string, condition string, notify_writer boolean, notify_writer_method string, notify_other string, notify_other_method string, cancel boolean, enabled boolean, probe_modified_at timestamp, probe_created_at timestamp);
 
 CREATE TABLE INTERNAL.PROBE_ACTIONS (action_time timestamp, probe_name string, query_id string, actions_taken variant, outcome string) IF NOT EXISTS;
+-- Time from the start of the query until the action was taken
+ALTER TABLE INTERNAL.PROBE_ACTIONS ADD COLUMN IF NOT EXISTS latency_ms number;
 CREATE OR REPLACE VIEW REPORTING.QUERY_MONITOR_ACTIVITY AS SELECT * FROM INTERNAL.PROBE_ACTIONS;
 
+-- One row per PROBE_MONITORING run. The *_ms columns break down where the run spent its time.
+CREATE TABLE INTERNAL.PROBE_MONITORING_RUNS IF NOT EXISTS (run_start timestamp_ltz, run_end timestamp_ltz, duration_ms number,
+    queries_scanned number, matches number, cancels number, notifications number, evaluate_ms number, cancel_ms number,
+    notify_ms number, max_latency_ms number);
+-- Notifications dropped by the rate limits of PROBE_RATE_LIMITS
+ALTER TABLE INTERNAL.PROBE_MONITORING_RUNS ADD COLUMN IF NOT EXISTS suppressed number;
+
+-- Token buckets which rate limit the notifications sent by PROBE_MONITORING, one per monitor ('probe:<name>') and one
+-- per destination ('destination:<method>:<destination>'). A bucket holds up to query_monitor_*_burst tokens and refills
+-- at query_monitor_*_rate tokens per minute. suppressed counts the notifications dropped since the bucket last let one through.
+CREATE TABLE INTERNAL.PROBE_RATE_LIMITS IF NOT EXISTS (bucket string, tokens float, refilled_at timestamp_ltz, suppressed number);
+
+-- Percentiles of the monitoring runs, per hour
+CREATE OR REPLACE VIEW REPORTING.QUERY_MONITOR_RUN_METRICS AS
+    SELECT date_trunc('hour', run_start) AS hour, count(*) AS runs, sum(queries_scanned) AS queries_scanned,
+        sum(matches) AS matches, sum(cancels) AS cancels, sum(notifications) AS notifications, sum(suppressed) AS suppressed,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY duration_ms) AS p50_duration_ms,
+        percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_ms) AS p95_duration_ms,
+        max(duration_ms) AS max_duration_ms,
+        percentile_cont(0.95) WITHIN GROUP (ORDER BY queries_scanned) AS p95_queries_scanned,
+        percentile_cont(0.95) WITHIN GROUP (ORDER BY notify_ms) AS p95_notify_ms,
+        sum(notify_ms) AS notify_ms
+    FROM INTERNAL.PROBE_MONITORING_RUNS
+    GROUP BY hour;
+
+-- Percentiles of the time from a query's start until a monitor acted on it, per monitor and hour
+CREATE OR REPLACE VIEW REPORTING.QUERY_MONITOR_LATENCY AS
+    SELECT date_trunc('hour', action_time) AS hour, probe_name, count(*) AS actions,
+        count_if(actions_taken:CANCEL::boolean) AS cancels,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY latency_ms) AS p50_latency_ms,
+        percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms) AS p95_latency_ms,
+        max(latency_ms) AS max_latency_ms
+    FROM INTERNAL.PROBE_ACTIONS
+    WHERE latency_ms IS NOT NULL
+    GROUP BY hour, probe_name;
+
+-- Daily rollups of the actions older than the query_monitor_retention_days setting, see COMPACT_PROBE_ACTIONS.
+CREATE TABLE INTERNAL.PROBE_ACTIONS_DAILY IF NOT EXISTS (action_date date, probe_name string, actions number, cancels number, notifications number, first_action_time timestamp, last_action_time timestamp);
+CREATE OR REPLACE VIEW REPORTING.QUERY_MONITOR_ACTIVITY_DAILY AS
+    SELECT action_date, probe_name, sum(actions) AS actions, sum(cancels) AS cancels, sum(notifications) AS notifications,
+        min(first_action_time) AS first_action_time, max(last_action_time) AS last_action_time
+    FROM (
+        SELECT * FROM INTERNAL.PROBE_ACTIONS_DAILY
+        UNION ALL
+        SELECT action_time::date, probe_name, count(*), count_if(actions_taken:CANCEL::boolean),
+            count_if(actions_taken:EMAIL is not null or actions_taken:SLACK is not null), min(action_time), max(action_time)
+        FROM INTERNAL.PROBE_ACTIONS
+        GROUP BY 1, 2
+    )
+    GROUP BY action_date, probe_name;
+
+-- Cluster the actions by day so that reads of recent actions only scan recent partitions. We want this to be done exactly once.
+DECLARE
+    key text default 'CLUSTERED_PROBE_ACTIONS';
+BEGIN
+    let already_clustered text;
+    call internal.get_config(:key) into :already_clustered;
+    if (already_clustered is null OR already_clustered <> 'true') then
+        SYSTEM$LOG_INFO('Clustering PROBE_ACTIONS by (ACTION_TIME::DATE)');
+        ALTER TABLE INTERNAL.PROBE_ACTIONS CLUSTER BY (ACTION_TIME::date);
+        call internal.set_config(:key, 'true');
+    end if;
+END;
+
+-- Rolls the actions older than the retention period into PROBE_ACTIONS_DAILY and deletes them.
+CREATE OR REPLACE PROCEDURE INTERNAL.COMPACT_PROBE_ACTIONS()
+RETURNS OBJECT
+AS
+BEGIN
+    let retention_days text;
+    call internal.get_config('query_monitor_retention_days') into :retention_days;
+    let cutoff timestamp := (select dateadd(day, -coalesce(try_to_number(:retention_days), 30), current_date())::timestamp);
+
+    BEGIN TRANSACTION;
+    MERGE INTO internal.probe_actions_daily t
+    USING (
+        SELECT action_time::date AS action_date, probe_name, count(*) AS actions, count_if(actions_taken:CANCEL::boolean) AS cancels,
+            count_if(actions_taken:EMAIL is not null or actions_taken:SLACK is not null) AS notifications,
+            min(action_time) AS first_action_time, max(action_time) AS last_action_time
+        FROM internal.probe_actions
+        WHERE action_time < :cutoff
+        GROUP BY 1, 2
+    ) s ON t.action_date = s.action_date AND t.probe_name = s.probe_name
+    WHEN MATCHED THEN UPDATE SET
+        t.actions = t.actions + s.actions, t.cancels = t.cancels + s.cancels, t.notifications = t.notifications + s.notifications,
+        t.first_action_time = least(t.first_action_time, s.first_action_time), t.last_action_time = greatest(t.last_action_time, s.last_action_time)
+    WHEN NOT MATCHED THEN INSERT (action_date, probe_name, actions, cancels, notifications, first_action_time, last_action_time)
+        VALUES (s.action_date, s.probe_name, s.actions, s.cancels, s.notifications, s.first_action_time, s.last_action_time);
+    DELETE FROM internal.probe_actions WHERE action_time < :cutoff;
+    let compacted number := SQLROWCOUNT;
+    DELETE FROM internal.probe_monitoring_runs WHERE run_start < :cutoff;
+    -- Buckets untouched since the cutoff have refilled completely
+    DELETE FROM internal.probe_rate_limits WHERE refilled_at < :cutoff;
+    COMMIT;
+    return object_construct('cutoff', :cutoff, 'compacted', :compacted);
+EXCEPTION
+    WHEN OTHER THEN
+        ROLLBACK;
+        SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Failed to compact query monitor actions.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+        RAISE;
+END;
+
 CREATE OR REPLACE PROCEDURE INTERNAL.MIGRATE_PROBES_TABLE()
 RETURNS OBJECT
 AS
@@ -103,6 +207,8 @@ BEGIN
     let notify_probes_enabled boolean := (select count(*) > 0 from internal.probes where notify_writer or length(notify_other) > 3);
     let notify_setup boolean := (select count(*) > 0 from internal.config where key in ('url','tenant_url'));
     let configured boolean := (select count(*) > 0 from internal.config where key = 'post_setup');
+    -- Recompile the monitoring statement now rather than on the next task run
+    call internal.compile_probe_select();
     if (cancel_probes_enabled and configured) then
         execute immediate 'alter task tasks.PROBE_MONITORING resume';
     elseif (notify_probes_enabled and notify_setup and configured) then
@@ -146,10 +252,12 @@ BEGIN
     -- We do it here so we don't have to transport objects from queries to sql text but it means
     -- there is a slight chance of seeing different actions for the probe between the first step and the second.
     --
-    -- The actions CTE is doing two-levels of filtering to ensure each probe fires exactly one per matched query.
-    -- The addition clauses on top of the CONDITION in the case statements ensure probes with duplicate conditions
-    -- will each match. The final NOT IN clause of the where condition for the CTE will ensure that we don't re-trigger
-    -- the same probe again for the same query when multiple probes exist with the same condition.
+    -- Each query is evaluated against every probe in one pass: the matches CTE builds the array of all probes whose
+    -- condition matches the query, matched flattens it into one row per (probe, query) and actions keeps the pairs
+    -- which haven't been acted on yet. Overlapping probes all fire in the same run.
+    --
+    -- The statement takes one bind, the watermark: queries which ended after it or are still running are evaluated.
+    -- A query can only have been acted on after it started, so only actions newer than the oldest query are checked.
     let s string := $$
     with
     users as (
@@ -158,24 +266,34 @@ BEGIN
     probes as (
         select * from internal.probes where cancel or notify_writer or length(notify_other) > 3
     ),
-    actions as (
-    SELECT current_timestamp() as probe_time, qh.query_id, user_name, query_text, warehouse_name, start_time, case $$;
-    let found boolean := false;
+    qh as (
+        select * from table(SNOWFLAKE.INFORMATION_SCHEMA.QUERY_HISTORY(END_TIME_RANGE_START => ?::timestamp_ltz, RESULT_LIMIT => 10000))
+    ),
+    recent_actions as (
+        select probe_name, query_id from internal.probe_actions
+        where action_time >= (select min(start_time) from qh)
+    ),
+    matches as (
+    SELECT current_timestamp() as probe_time, query_id, user_name, query_text, warehouse_name, start_time, array_construct_compact($$;
+    let sep string := '';
     let probes cursor for select name, condition from internal.probes;
     for probe in probes do
-        found := true;
-        s := s || '\n\t when ' || probe.condition || $$ and (actions.probe_name != '$$ || probe.name || $$' or actions.probe_name is null) then '$$ || probe.name || $$' $$;
+        s := s || sep || '\n\t iff(' || probe.condition || $$, '$$ || replace(probe.name, '''', '''''') || $$', null)$$;
+        sep := ',';
     end for;
-
-    if (not found) then
-        s := s || '\n\t when true then null::text ';
-    end if;
-    s := s || $$
-    else null end as probe_to_execute
-    from table(SNOWFLAKE.INFORMATION_SCHEMA.QUERY_HISTORY(CURRENT_TIMESTAMP())) as qh
-    left outer join internal.probe_actions as actions on qh.query_id = actions.query_id
-    where session_id <> current_session() and
-        (probe_to_execute, qh.query_id) not in (select probe_name, query_id from internal.probe_actions)
+    s := s || $$) as matched_probes
+    from qh
+    where session_id <> current_session()
+    ),
+    matched as (
+    select m.probe_time, m.query_id, m.user_name, m.query_text, m.warehouse_name, m.start_time, f.value::string as probe_to_execute
+    from matches m, lateral flatten(input => m.matched_probes) f
+    ),
+    actions as (
+    select m.*
+    from matched m
+    left outer join recent_actions ra on ra.query_id = m.query_id and ra.probe_name = m.probe_to_execute
+    where ra.query_id is null
     ),
     items as (
     select
@@ -193,18 +311,71 @@ BEGIN
     left join users u on a.user_name = u.name
     where probe_to_execute is not null
     )
-    select probe_time, probe_name, query_id, action_taken, user_name, warehouse_name, start_time, query_text from items
+    -- Always return at least one row, so that the number of queries scanned is known when nothing matched
+    select probe_time, probe_name, query_id, action_taken, user_name, warehouse_name, start_time, query_text, scanned.queries_scanned
+    from (select count(*) as queries_scanned from qh) scanned
+    left join items on true
     $$;
     return s;
 END;
 
+-- The statement generated by GET_PROBE_SELECT and the probe definitions it was generated from.
+CREATE TABLE INTERNAL.PROBE_SELECT IF NOT EXISTS (statement string, definition_hash number, compiled_at timestamp_ltz);
+-- The generated statement may change between versions
+DELETE FROM INTERNAL.PROBE_SELECT;
+
+CREATE OR REPLACE PROCEDURE INTERNAL.COMPILE_PROBE_SELECT()
+RETURNS string
+AS
+BEGIN
+    -- Only the probe names and conditions are compiled into the statement, everything else is read when it runs.
+    let definition_hash number := (select hash_agg(name, condition) from internal.probes);
+    let s string;
+    call internal.get_probe_select() into :s;
+    BEGIN TRANSACTION;
+    delete from internal.probe_select;
+    insert into internal.probe_select (statement, definition_hash, compiled_at) values (:s, :definition_hash, current_timestamp());
+    COMMIT;
+    return s;
+END;
+
+-- Returns the statement which PROBE_MONITORING runs, compiling it only when the probes have changed since it was stored.
+CREATE OR REPLACE PROCEDURE INTERNAL.GET_CACHED_PROBE_SELECT()
+RETURNS string
+AS
+BEGIN
+    let s string := (
+        select any_value(statement) from internal.probe_select
+        where definition_hash is not distinct from (select hash_agg(name, condition) from internal.probes)
+    );
+    if (s is null) then
+        call internal.compile_probe_select() into :s;
+    end if;
+    return s;
+END;
+
+-- Evaluates a query monitor condition against the materialized query history, returning per hour the number of
+-- matching queries, their cost and how many ran long enough that a cancelling monitor would have caught them.
+CREATE OR REPLACE PROCEDURE ADMIN.BACKTEST_QUERY_MONITOR(condition text, start_time timestamp_ltz, end_time timestamp_ltz)
+    RETURNS TABLE(hour timestamp_ltz, matches number, matched_cost float, cancelled number)
+    language python
+    runtime_version = "3.10"
+    handler = 'backtest_query_monitor'
+    packages = ('snowflake-snowpark-python', 'pydantic==1.*', 'snowflake-telemetry-python')
+    imports = ('{{stage}}/python/crud.zip', '{{stage}}/python/sqlglot.zip')
+    EXECUTE AS OWNER
+AS
+$$
+from crud import backtest_query_monitor
+$$;
+
 CREATE OR REPLACE PROCEDURE ADMIN.CREATE_QUERY_MONITOR(name text, condition text, notify_writer boolean, notify_writer_method string, notify_other string, notify_other_method string, cancel boolean)
     RETURNS TEXT
     LANGUAGE PYTHON
     runtime_version = "3.10"
     handler = 'create_probe'
     packages = ('snowflake-snowpark-python', 'pydantic==1.*', 'snowflake-telemetry-python')
-    imports = ('{{stage}}/python/crud.zip')
+    imports = ('{{stage}}/python/crud.zip', '{{stage}}/python/sqlglot.zip')
     EXECUTE AS OWNER
 AS
 $$
@@ -237,7 +408,7 @@ CREATE OR REPLACE PROCEDURE ADMIN.UPDATE_QUERY_MONITOR(oldname text, name text,
     runtime_version = "3.10"
     handler = 'update_probe'
     packages = ('snowflake-snowpark-python', 'pydantic==1.*', 'snowflake-telemetry-python')
-    imports = ('{{stage}}/python/crud.zip')
+    imports = ('{{stage}}/python/crud.zip', '{{stage}}/python/sqlglot.zip')
     EXECUTE AS OWNER
 AS
 $$
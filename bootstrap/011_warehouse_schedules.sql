@@ -18,6 +18,26 @@ CREATE TABLE INTERNAL.WH_SCHEDULES IF NOT EXISTS(
     last_modified timestamp_ltz
 );
 
+-- Named templates of weekday and weekend schedules which can be applied to many warehouses. The name column holds the
+-- name of the template.
+CREATE TABLE INTERNAL.WH_SCHEDULE_TEMPLATES IF NOT EXISTS(
+    id_val text,
+    name text,
+    start_at time,
+    finish_at time,
+    size text,
+    suspend_minutes number,
+    resume boolean,
+    scale_min number,
+    scale_max number,
+    warehouse_mode text,
+    comment text,
+    weekday boolean,
+    day text,
+    enabled boolean,
+    last_modified timestamp_ltz
+);
+
 -- Create table for the outcome of executing warehouse schedules
 CREATE TABLE IF NOT EXISTS internal.task_warehouse_schedule(
     run timestamp_ltz,
@@ -31,20 +51,109 @@ CREATE TABLE IF NOT EXISTS internal.warehouse_alter_statements(
     alter_statement text
 );
 
+-- The enabled schedule in effect for each warehouse in every 15-minute slot (0-95) of a weekday and of a weekend day,
+-- with the statement which applies it. is_start marks the slot in which the schedule begins.
+CREATE TABLE IF NOT EXISTS internal.warehouse_schedule_timeline(
+    weekday boolean,
+    slot number,
+    name text,
+    id_val text,
+    is_start boolean,
+    alter_statement text
+);
+
+-- The alter statement last applied to each warehouse (by upper-cased name) and a hash of the warehouse's settings, as
+-- of the last time it was reconciled with SHOW WAREHOUSES. A warehouse whose next schedule has the same statement is
+-- not altered again.
+CREATE TABLE IF NOT EXISTS internal.warehouse_applied_state(
+    name text,
+    alter_statement text,
+    applied_at timestamp_ltz,
+    state_hash number,
+    reconciled_at timestamp_ltz
+);
+
 -- Catalog view for warehouse_schedules
 CREATE OR REPLACE VIEW catalog.warehouse_schedules AS
     SELECT * exclude (id_val, day) FROM internal.wh_schedules;
 
+CREATE OR REPLACE VIEW catalog.warehouse_schedule_templates AS
+    SELECT * exclude (id_val, day, enabled) FROM internal.wh_schedule_templates;
+
 -- Reporting view for the actions taken by warehouse schedules
 CREATE OR REPLACE VIEW reporting.warehouse_schedules_task_history as
     SELECT run, success, output:"statements"::ARRAY as statements_executed,
     output:"opscenter timezone"::TEXT as schedule_timezone,
-    output:"warehouses_updated"::NUMBER as warehouses_updated
+    output:"warehouses_updated"::NUMBER as warehouses_updated,
+    output:"warehouses_skipped"::NUMBER as warehouses_skipped
     from internal.task_warehouse_schedule;
 
 -- Inadvertently created by python crud.
 drop view if exists catalog.wh_schedules;
 
+-- Rebuilds internal.warehouse_schedule_timeline from the schedules and their alter statements, for one warehouse or
+-- for all of them when warehouse is NULL. Schedules start and finish on 15-minute boundaries, except the last one of
+-- the day which finishes at 23:59.
+CREATE OR REPLACE PROCEDURE INTERNAL.REBUILD_WAREHOUSE_SCHEDULE_TIMELINE(warehouse text)
+    RETURNS NUMBER
+    language sql
+AS
+BEGIN
+    DELETE FROM internal.warehouse_schedule_timeline WHERE :warehouse IS NULL OR name = :warehouse;
+    INSERT INTO internal.warehouse_schedule_timeline (weekday, slot, name, id_val, is_start, alter_statement)
+        WITH slots AS (
+            SELECT row_number() OVER (ORDER BY seq4()) - 1 AS slot FROM TABLE(GENERATOR(ROWCOUNT => 96))
+        ), schedules AS (
+            SELECT sch.weekday, sch.name, sch.id_val, alt.alter_statement,
+                floor((hour(sch.start_at) * 60 + minute(sch.start_at)) / 15) AS start_slot,
+                iff(sch.finish_at = '23:59'::time, 96, floor((hour(sch.finish_at) * 60 + minute(sch.finish_at)) / 15)) AS finish_slot
+            FROM internal.wh_schedules sch
+                LEFT OUTER JOIN internal.warehouse_alter_statements alt ON sch.id_val = alt.id_val
+            WHERE sch.enabled AND (:warehouse IS NULL OR sch.name = :warehouse)
+        )
+        SELECT sch.weekday, s.slot, sch.name, sch.id_val, s.slot = sch.start_slot, sch.alter_statement
+        FROM schedules sch
+            JOIN slots s ON s.slot >= sch.start_slot AND s.slot < sch.finish_slot;
+    return SQLROWCOUNT;
+END;
+
+-- Reconciles internal.warehouse_applied_state with the warehouses from a single SHOW WAREHOUSES. Warehouses which
+-- were dropped, or altered since their schedule was applied, are forgotten so that their next schedule is applied.
+-- Unless force is TRUE, nothing is done until a warehouse has not been reconciled for
+-- warehouse_state_reconcile_minutes.
+CREATE OR REPLACE PROCEDURE INTERNAL.RECONCILE_WAREHOUSE_APPLIED_STATE(force boolean)
+    RETURNS NUMBER
+    language sql
+AS
+BEGIN
+    let reconcile_minutes text;
+    call internal.get_config('warehouse_state_reconcile_minutes') into :reconcile_minutes;
+    let stale number := (select count(*) from internal.warehouse_applied_state
+        where reconciled_at is null
+            or reconciled_at < timestampadd('minute', -coalesce(try_to_number(:reconcile_minutes), 60), current_timestamp()));
+    if (not force and stale = 0) then
+        return 0;
+    end if;
+
+    show warehouses;
+    CREATE OR REPLACE TEMPORARY TABLE internal.warehouse_state_snapshot AS
+        SELECT upper(w."name") AS name,
+            hash(w.o['size'], w.o['type'], w.o['auto_suspend'], w.o['auto_resume'], w.o['min_cluster_count'],
+                w.o['max_cluster_count'], w.o['scaling_policy']) AS state_hash
+        FROM (SELECT "name", object_construct(*) AS o FROM table(result_scan(last_query_id()))) w;
+
+    -- A NULL state_hash was just applied and is adopted as-is.
+    DELETE FROM internal.warehouse_applied_state a
+        WHERE NOT EXISTS (SELECT 1 FROM internal.warehouse_state_snapshot w
+            WHERE w.name = a.name AND (a.state_hash IS NULL OR w.state_hash = a.state_hash));
+    let forgotten number := SQLROWCOUNT;
+    UPDATE internal.warehouse_applied_state a
+        SET state_hash = w.state_hash, reconciled_at = current_timestamp()
+        FROM internal.warehouse_state_snapshot w
+        WHERE a.name = w.name;
+    return forgotten;
+END;
+
 CREATE OR REPLACE PROCEDURE INTERNAL.UPDATE_WAREHOUSE_SCHEDULES(last_run timestamp_ltz, this_run timestamp_ltz)
     RETURNS VARIANT
     language sql
@@ -81,27 +190,37 @@ BEGIN
         last_run := (select CONVERT_TIMEZONE(internal.get_current_timezone(), :tz, :last_run));
     end if;
 
-    -- TODO handle looking back over a weekend boundary (from python)
-    -- TODO the WEEK_START session parameter can alter what DAYOFWEEK returns.
-    let is_weekday boolean := (select DAYOFWEEK(:this_run) not in (0, 6));
+    -- Forget the warehouses which were altered outside of their schedules. Without a reconciled state, every schedule is
+    -- applied.
+    begin
+        call internal.reconcile_warehouse_applied_state(FALSE);
+    exception
+        when other then
+            SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Exception occurred when reconciling the applied warehouse state.',
+                'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+            DELETE FROM internal.warehouse_applied_state;
+    end;
 
     -- Get the warehouse schedule to apply.
-    -- Get the latest (greatest start_at), enabled schedules which match the day of the week that should be applied
-    -- since the last time the task ran.
+    -- Find the 15-minute boundaries crossed since the last time the task ran, and for each warehouse the latest of them
+    -- at which one of its enabled schedules starts, whether on a weekday or a weekend day. Every enabled day has a
+    -- schedule starting at midnight, so there is no need to look back further than a day. DAYOFWEEKISO is used because
+    -- it does not depend on the WEEK_START session parameter.
     let res resultset := (
-        with schedules as(
-          select *, TIMESTAMP_FROM_PARTS(date_trunc('day', :this_run)::DATE, start_at) as ts
-          from internal.wh_schedules
-          where
-              enabled = TRUE and
-              weekday = :is_weekday and
-              ts > :last_run and ts <= :this_run
-        ), ids as(
-            select distinct(last_value(id_val)) over (partition by name order by ts) from schedules
-        ) select sch.name, sch.id_val, alt.alter_statement
-            from internal.wh_schedules sch
-                left outer join internal.warehouse_alter_statements alt on sch.id_val = alt.id_val
-            where sch.id_val in (select * from ids)
+        with boundaries as (
+            select timestampadd('minute', 15 * row_number() over (order by seq4()),
+                time_slice(greatest(:last_run, timestampadd('day', -1, :this_run)), 15, 'minute')) as ts
+            from table(generator(rowcount => 97))
+        ), crossed as (
+            select ts, dayofweekiso(ts) < 6 as weekday, hour(ts) * 4 + minute(ts) / 15 as slot
+            from boundaries
+            where ts > :last_run and ts <= :this_run
+        ) select t.name, t.id_val, t.alter_statement, equal_null(a.alter_statement, t.alter_statement) as already_applied
+            from crossed c
+                join internal.warehouse_schedule_timeline t on t.weekday = c.weekday and t.slot = c.slot
+                left outer join internal.warehouse_applied_state a on a.name = upper(t.name)
+            where t.is_start
+            qualify row_number() over (partition by t.name order by c.ts desc) = 1
     );
 
     -- build some metadata
@@ -114,19 +233,27 @@ BEGIN
 
     let success boolean := TRUE;
     let warehouses_updated := 0;
+    let warehouses_skipped := 0;
     let statements array := array_construct();
+    let applied array := array_construct();
     for schedule in c1 do
         let sch_outcome string := '';
+        let sch_name string := schedule.name;
+        let sch_statement string := schedule.alter_statement;
         begin
             -- Make sure the about left outer join matched a row.
             if (length(coalesce(schedule.alter_statement, '')) = 0) then
                 sch_outcome := 'No alter statement found for warehouse ' || schedule.name;
                 success := FALSE;
+            elseif (schedule.already_applied) then
+                sch_outcome := 'Already applied to warehouse ' || schedule.name;
+                warehouses_skipped := warehouses_skipped + 1;
             else
                 -- Return the actual alter statement to know what was executed.
                 sch_outcome := schedule.alter_statement;
                 execute immediate schedule.alter_statement;
                 warehouses_updated := warehouses_updated + 1;
+                applied := (select array_append(:applied, object_construct('name', upper(:sch_name), 'alter_statement', :sch_statement)));
             end if;
         exception
             when other then
@@ -138,6 +265,23 @@ BEGIN
         statements := (select array_append(:statements, :sch_outcome));
     end for;
     task_outcome := (select object_insert(:task_outcome, 'warehouses_updated', :warehouses_updated));
+    task_outcome := (select object_insert(:task_outcome, 'warehouses_skipped', :warehouses_skipped));
+
+    -- Record what was applied, and the resulting settings of the warehouses.
+    if (array_size(applied) > 0) then
+        MERGE INTO internal.warehouse_applied_state a
+        USING (SELECT value:name::text AS name, value:alter_statement::text AS alter_statement FROM table(flatten(input => :applied))) s
+        ON a.name = s.name
+        WHEN MATCHED THEN UPDATE SET alter_statement = s.alter_statement, applied_at = current_timestamp(), state_hash = NULL, reconciled_at = NULL
+        WHEN NOT MATCHED THEN INSERT (name, alter_statement, applied_at) VALUES (s.name, s.alter_statement, current_timestamp());
+        begin
+            call internal.reconcile_warehouse_applied_state(TRUE);
+        exception
+            when other then
+                SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Exception occurred when reconciling the applied warehouse state.',
+                    'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+        end;
+    end if;
     task_outcome := (select object_insert(:task_outcome, 'statements', :statements));
 
     INSERT INTO internal.task_warehouse_schedule SELECT :this_run, :success, :task_outcome;
@@ -211,9 +355,9 @@ def create_warehouse_schedule(bare_session, name: str, size: str, start: datetim
         # Write the new schedule
         new_sched.write(session)
         # Update any schedules that were affected by adding the new schedule
-        [i.update(session, i) for i in new_scheds if i.id_val != new_sched.id_val]
+        WarehouseSchedules.batch_upsert(session, [i for i in new_scheds if i.id_val != new_sched.id_val])
         # Twiddle the task state after adding a new schedule
-        after_schedule_change(session)
+        after_schedule_change(session, name)
 $$;
 
 
@@ -238,17 +382,17 @@ def run_delete(bare_session, name: str, start: datetime.time, finish: datetime.t
             raise Exception(f"Could not find warehouse schedule: {name}, {start}, {finish}, {'weekday' if is_weekday else 'weekend'}")
 
         to_delete = WarehouseSchedules.construct(id_val = row.id_val)
-        current_scheds = WarehouseSchedules.batch_read(session, sortby="start_at", filter=lambda df: ((df.name == name) & (df.weekday == is_weekday)))
+        current_scheds = WarehouseSchedules.find_all_with_weekday(session, name, is_weekday)
         new_scheds = delete_warehouse_schedule(to_delete, current_scheds)
 
         # Delete that schedule, leaving a hole
         to_delete.delete(session)
 
         # Run the updates, filling the hole
-        [i.update(session, i) for i in new_scheds]
+        WarehouseSchedules.batch_upsert(session, new_scheds)
 
         # Twiddle the task state after adding a new schedule
-        after_schedule_change(session)
+        after_schedule_change(session, name)
 $$;
 
 
@@ -299,10 +443,10 @@ def update_warehouse_schedule(bare_session, name: str, start: datetime.time, fin
         schedules_needing_update = update_existing_schedule(old_schedule.id_val, new_schedule, schedules)
 
         # Persist all updates to the table
-        [i.update(session, i) for i in schedules_needing_update]
+        WarehouseSchedules.batch_upsert(session, schedules_needing_update)
 
         # Twiddle the task state after a schedule has changed
-        after_schedule_change(session)
+        after_schedule_change(session, name)
 $$;
 
 
@@ -359,6 +503,57 @@ def run(session, name: str):
     return ""
 $$;
 
+CREATE OR REPLACE PROCEDURE ADMIN.CREATE_WAREHOUSE_SCHEDULE_TEMPLATE(template_name text, warehouse_name text)
+    RETURNS TEXT
+    LANGUAGE PYTHON
+    runtime_version = "3.10"
+    handler = 'run'
+    packages = ('snowflake-snowpark-python', 'pydantic==1.*', 'snowflake-telemetry-python')
+    imports = ('{{stage}}/python/crud.zip')
+    EXECUTE AS OWNER
+AS
+$$
+from crud.base import transaction
+from crud.wh_sched import fetch_schedules_with_defaults, save_schedule_template
+def run(bare_session, template_name: str, warehouse_name: str):
+    with transaction(bare_session) as session:
+        # The template is a copy of the current schedules of the warehouse
+        schedules = fetch_schedules_with_defaults(session, warehouse_name)
+        save_schedule_template(session, template_name, schedules)
+        return ""
+$$;
+
+
+CREATE OR REPLACE PROCEDURE ADMIN.DELETE_WAREHOUSE_SCHEDULE_TEMPLATE(template_name text)
+    RETURNS TEXT
+    LANGUAGE SQL
+    EXECUTE AS OWNER
+AS
+BEGIN
+    DELETE FROM internal.wh_schedule_templates WHERE name = :template_name;
+    return '';
+END;
+
+
+CREATE OR REPLACE PROCEDURE ADMIN.APPLY_WAREHOUSE_SCHEDULE_TEMPLATE(template_name text, warehouse_names array)
+    RETURNS TEXT
+    LANGUAGE PYTHON
+    runtime_version = "3.10"
+    handler = 'run'
+    packages = ('snowflake-snowpark-python', 'pydantic==1.*', 'snowflake-telemetry-python')
+    imports = ('{{stage}}/python/crud.zip')
+    EXECUTE AS OWNER
+AS
+$$
+from crud.base import transaction
+from crud.wh_sched import apply_schedule_template
+def run(bare_session, template_name: str, warehouse_names: list):
+    with transaction(bare_session) as session:
+        # Replaces the schedules of every warehouse, or none of them if any warehouse fails validation
+        apply_schedule_template(session, template_name, warehouse_names)
+        return ""
+$$;
+
 CREATE OR REPLACE PROCEDURE INTERNAL.MIGRATE_WHSCHED_TABLE()
 RETURNS OBJECT
 AS
@@ -398,7 +593,7 @@ def run(bare_session, warehouse_name: str):
         _ = fetch_schedules_with_defaults(session, warehouse_name)
 
         # Twiddle the task state after adding a new schedule
-        after_schedule_change(session)
+        after_schedule_change(session, warehouse_name)
         return ""
 $$;
 
@@ -52,6 +52,7 @@ BEGIN
         if (oldest_running = 0::timestamp) then
           -- we should ensure that there are no records in the table if this is the first run. This allows a separate process to insert a "reset" message in the log which will cause us to start over again.
           truncate table INTERNAL_REPORTING_MV.QUERY_HISTORY_COMPLETE_AND_DAILY;
+          truncate table INTERNAL_REPORTING_MV.LABEL_VALUES;
         end if;
 
         DROP TABLE IF EXISTS RAW_QH_EVT ;
@@ -71,6 +72,17 @@ BEGIN
             let where_clause_complete varchar := (select 'END_TIME <> to_timestamp_ltz(\'' || :newest_completed || '\')');
             let new_closed number;
             call internal.generate_insert_statement('INTERNAL_REPORTING_MV', 'QUERY_HISTORY_COMPLETE_AND_DAILY', 'INTERNAL', 'RAW_QH_EVT', :where_clause_complete) into :new_closed;
+            -- Label the new and updated queries once, so that reads of LABELED_QUERY_HISTORY don't evaluate the label conditions.
+            -- A label which fails on the new data must not stop the ingest. The values of these queries are left for the view
+            -- to evaluate from the label conditions, and the materialized labels stay as they are for the next run to retry.
+            let labels_computed number := 0;
+            begin
+                call internal.merge_label_values('query_id in (select query_id from INTERNAL.RAW_QH_EVT)', false) into :labels_computed;
+            exception
+                when other then
+                    SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Exception occurred when computing label values, they are evaluated by the view instead.',
+                        'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
+            end;
             -- Figure out the oldest row in the table
             let range_min timestamp := (select min(end_time) as end_time from reporting.enriched_query_history);
             output := OBJECT_CONSTRUCT_KEEP_NULL('oldest_running', :oldest_running, 'newest_completed', :newest_completed, 'attempted_migrate', :migrate, 'migrate', :migrate1, 'migrate_INCOMPLETE', :migrate2,
@@ -16,3 +16,19 @@ BEGIN
     SYSTEM$LOG_INFO(OBJECT_CONSTRUCT('action', verb, 'domain', domain));
     return '';
 END;
+
+CREATE OR REPLACE PROCEDURE ADMIN.PROFILE_CRUD(action text, entity_type text, name text, entity object)
+    RETURNS object
+    LANGUAGE PYTHON
+    runtime_version = "3.10"
+    handler = 'profile'
+    packages = ('snowflake-snowpark-python', 'pydantic==1.*', 'snowflake-telemetry-python')
+    imports = ('{{stage}}/python/crud.zip')
+    EXECUTE AS OWNER
+AS
+$$
+from crud import profile_entity
+def profile(session, action, entity_type, name, entity):
+    # Runs the create, update or delete in a transaction which is rolled back and reports every statement it issued.
+    return profile_entity(session, action.lower(), entity_type.upper(), name, entity)
+$$;
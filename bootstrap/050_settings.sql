@@ -16,9 +16,9 @@ CREATE OR REPLACE PROCEDURE ADMIN.UPDATE_SETTING(name TEXT, value TEXT)
     EXECUTE AS OWNER
 AS
 BEGIN
-    let pass boolean := (select :name is not null and :value is not null and :name in ('default_timezone', 'storage_cost', 'serverless_credit_cost', 'compute_credit_cost'));
+    let pass boolean := (select :name is not null and :value is not null and :name in ('default_timezone', 'storage_cost', 'serverless_credit_cost', 'compute_credit_cost', 'query_monitor_retention_days'));
     if (not pass) then
-        return 'Invalid setting name or value, setting name cannot be null and value cannot be null. Setting name cannot be one of: default_timezone, storage_cost, serverless_credit_cost, compute_credit_cost';
+        return 'Invalid setting name or value, setting name cannot be null and value cannot be null. Setting name cannot be one of: default_timezone, storage_cost, serverless_credit_cost, compute_credit_cost, query_monitor_retention_days';
     end if;
     let is_tz boolean := (select :name = 'default_timezone');
     if (is_tz) then
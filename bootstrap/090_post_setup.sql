@@ -205,6 +205,11 @@ BEGIN
     let output object;
     CALL INTERNAL.refresh_queries(true, :input) into :output;
 
+    -- Materialize the values of new or edited labels. Failures are logged, but don't fail the query history refresh.
+    let labels object;
+    CALL INTERNAL.BACKFILL_LABEL_VALUES() into :labels;
+    output := object_insert(output, 'labels', labels);
+
     CALL INTERNAL.FINISH_TASK(:task_name, :object_name, :task_run_id, :output);
 END;
 
@@ -215,6 +220,13 @@ CREATE OR REPLACE TASK TASKS.SFUSER_MAINTENANCE
     AS
     CALL INTERNAL.refresh_users();
 
+CREATE OR REPLACE TASK TASKS.PROBE_ACTIONS_MAINTENANCE
+    SCHEDULE = '1440 minute'
+    ALLOW_OVERLAPPING_EXECUTION = FALSE
+    USER_TASK_MANAGED_INITIAL_WAREHOUSE_SIZE = "XSMALL"
+    AS
+    CALL INTERNAL.COMPACT_PROBE_ACTIONS();
+
 CREATE OR REPLACE TASK TASKS.UPGRADE_CHECK
     SCHEDULE = '1440 minute'
     ALLOW_OVERLAPPING_EXECUTION = FALSE
@@ -232,81 +244,173 @@ DECLARE
   identifier STRING := (select current_account());
 BEGIN
     SYSTEM$LOG_DEBUG('probe_monitoring task beginning');
-    CALL INTERNAL.GET_PROBE_SELECT() into :sql;
-    execute immediate sql;
-    LET c1 CURSOR FOR SELECT probe_name, query_id, to_json(action_taken) as action_takens, action_taken, query_text, user_name, warehouse_name, start_time FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
-    FOR act IN c1 DO
+    -- Evaluate the queries which ended since the last run (with a minute of overlap for late arrivals) or are still
+    -- running. After a long suspension, don't look back further than 15 minutes.
+    let run_start timestamp_ltz := current_timestamp();
+    let last_run string;
+    CALL INTERNAL.GET_CONFIG('PROBE_MONITORING_WATERMARK') into :last_run;
+    let watermark timestamp_ltz := (select greatest(
+        coalesce(dateadd(minute, -1, try_to_timestamp_ltz(:last_run, 'YYYY-MM-DD"T"HH24:MI:SS.FF3TZH:TZM')), :run_start),
+        dateadd(minute, -15, :run_start)));
+    CALL INTERNAL.GET_CACHED_PROBE_SELECT() into :sql;
+    let evaluate_start timestamp_ltz := current_timestamp();
+    execute immediate sql using (watermark);
+    let scan_query_id string := LAST_QUERY_ID();
+    let queries_scanned number := (SELECT any_value(queries_scanned) FROM TABLE(RESULT_SCAN(:scan_query_id)));
+    CREATE OR REPLACE TEMPORARY TABLE INTERNAL.PROBE_RUN_MATCHES AS
+        SELECT probe_name, query_id, action_taken, query_text, user_name, warehouse_name, start_time FROM TABLE(RESULT_SCAN(:scan_query_id))
+        WHERE probe_name IS NOT NULL;
+    let evaluate_ms number := (select datediff(millisecond, :evaluate_start, current_timestamp()));
+
+    -- Cancel queries, keeping the outcome of each cancellation by query id
+    let cancel_start timestamp_ltz := current_timestamp();
+    let cancel_outcomes object := (select object_construct());
+    LET cancels CURSOR FOR SELECT DISTINCT query_id FROM INTERNAL.PROBE_RUN_MATCHES WHERE action_taken:CANCEL::boolean;
+    FOR c IN cancels DO
+        let id string := c.query_id;
         let outcome string := '';
-        if (act.action_taken:CANCEL::boolean) then
-            let id string := act.query_id;
+        BEGIN
             select SYSTEM$CANCEL_QUERY(:id);
-            BEGIN
-                outcome := (SELECT * FROM TABLE(RESULT_SCAN(LAST_QUERY_ID())));
-            EXCEPTION
-                when EXPRESSION_ERROR THEN
-                    outcome := SQLERRM;
-                WHEN other THEN
-                    outcome := SQLERRM;
-            END;
-        end if;
+            outcome := (SELECT * FROM TABLE(RESULT_SCAN(LAST_QUERY_ID())));
+        EXCEPTION
+            WHEN other THEN
+                outcome := SQLERRM;
+        END;
+        cancel_outcomes := (select object_insert(:cancel_outcomes, :id, :outcome));
+    END FOR;
 
-        -- Send emails
-        let emails string := act.action_taken:EMAIL;
-        if (length(emails) > 1) then
-            let subject string := 'Sundeck OpsCenter probe [{probe_name}] matched query.';
-            let body string := '
-                Query Id: {query_id}\n
-                Query User: {user_name}\n
-                Warehouse Name: {warehouse_name}\n
-                Start Time: {start_time}\n
-                Query Text: \n{query_text}\n
-                Account Locator:\n{identifier}\n
-            ';
-            let dict variant := OBJECT_CONSTRUCT('query_id', act.query_id, 'query_text', act.query_text, 'user_name', act.user_name, 'warehouse_name', act.warehouse_name, 'start_time', act.start_time, 'probe_name', act.probe_name, 'identifier', :identifier);
-            let outcome2 string := '';
+    let cancel_ms number := (select datediff(millisecond, :cancel_start, current_timestamp()));
+
+    -- Notifications are rate limited by token buckets, per monitor and per destination, so that a flood of matches
+    -- can't slow the run down. The cancels above are never limited.
+    let notify_start timestamp_ltz := current_timestamp();
+    let config string;
+    CALL INTERNAL.GET_CONFIG('query_monitor_probe_burst') into :config;
+    let probe_burst float := (select coalesce(try_to_double(:config), 20));
+    CALL INTERNAL.GET_CONFIG('query_monitor_probe_rate') into :config;
+    let probe_rate float := (select coalesce(try_to_double(:config), 5));
+    CALL INTERNAL.GET_CONFIG('query_monitor_destination_burst') into :config;
+    let destination_burst float := (select coalesce(try_to_double(:config), 5));
+    CALL INTERNAL.GET_CONFIG('query_monitor_destination_rate') into :config;
+    let destination_rate float := (select coalesce(try_to_double(:config), 0.5));
+
+    -- Each monitor notifies about as many of its matches as it has tokens, oldest queries first
+    CREATE OR REPLACE TEMPORARY TABLE INTERNAL.PROBE_RUN_NOTIFY AS
+        WITH notify AS (
+            SELECT DISTINCT m.probe_name, m.query_id, m.start_time
+            FROM INTERNAL.PROBE_RUN_MATCHES m, LATERAL FLATTEN(input => m.action_taken) d, LATERAL SPLIT_TO_TABLE(d.value::string, ',') s
+            WHERE d.key IN ('EMAIL', 'SLACK') AND length(trim(s.value)) > 1
+        ), ranked AS (
+            SELECT n.probe_name, n.query_id,
+                least(:probe_burst, coalesce(b.tokens + datediff(millisecond, b.refilled_at, :notify_start) / 60000 * :probe_rate, :probe_burst)) AS tokens,
+                row_number() OVER (PARTITION BY n.probe_name ORDER BY n.start_time, n.query_id) AS rn
+            FROM notify n
+            LEFT JOIN internal.probe_rate_limits b ON b.bucket = 'probe:' || n.probe_name
+        )
+        SELECT probe_name, query_id, tokens, rn <= floor(tokens) AS allowed FROM ranked;
+    let suppressed number := (SELECT count_if(not allowed) FROM INTERNAL.PROBE_RUN_NOTIFY);
+
+    -- Send one digest per destination, listing the queries which matched a monitor notifying it in this run, rather
+    -- than one notification per matched query.
+    let notify_outcomes object := (select object_construct());
+    let destination_buckets array := (select array_construct());
+    LET digests CURSOR FOR
+        WITH destinations AS (
+            SELECT DISTINCT m.probe_name, m.query_id, m.query_text, m.user_name, m.warehouse_name, m.start_time,
+                lower(d.key) AS method, trim(s.value) AS destination
+            FROM INTERNAL.PROBE_RUN_MATCHES m, INTERNAL.PROBE_RUN_NOTIFY r, LATERAL FLATTEN(input => m.action_taken) d, LATERAL SPLIT_TO_TABLE(d.value::string, ',') s
+            WHERE d.key IN ('EMAIL', 'SLACK') AND length(trim(s.value)) > 1
+                AND r.probe_name = m.probe_name AND r.query_id = m.query_id AND r.allowed
+        ), numbered AS (
+            SELECT *, row_number() OVER (PARTITION BY method, destination ORDER BY start_time, query_id, probe_name) AS rn
+            FROM destinations
+        )
+        SELECT method, destination, count(*) AS matches,
+            listagg(iff(rn > 20, null, iff(method = 'slack',
+                'Query Monitor: [' || probe_name || ']\nQuery Id: `' || query_id || '`\nQuery User: ' || coalesce(user_name, '') ||
+                    '\nWarehouse Name: `' || coalesce(warehouse_name, '') || '`\nStart Time: `' || start_time || '`\nQuery Text: ```' || left(query_text, 1000) || '```\n',
+                'Query Monitor: [' || probe_name || ']\nQuery Id: ' || query_id || '\nQuery User: ' || coalesce(user_name, '') ||
+                    '\nWarehouse Name: ' || coalesce(warehouse_name, '') || '\nStart Time: ' || start_time || '\nQuery Text: \n' || left(query_text, 1000) || '\n')), '\n')
+                WITHIN GROUP (ORDER BY rn) AS details
+        FROM numbered
+        GROUP BY method, destination;
+    FOR digest IN digests DO
+        let method string := digest.method;
+        let destination string := digest.destination;
+        let matches number := digest.matches;
+        let details string := digest.details;
+        let bucket string := (select 'destination:' || :method || ':' || :destination);
+        let tokens float := (select coalesce(min(least(:destination_burst, tokens + datediff(millisecond, refilled_at, :notify_start) / 60000 * :destination_rate)), :destination_burst)
+            from internal.probe_rate_limits where bucket = :bucket);
+        let earlier_suppressed number := (select coalesce(min(suppressed), 0) from internal.probe_rate_limits where bucket = :bucket);
+        let subject string := (select 'Sundeck OpsCenter query monitors matched ' || :matches || iff(:matches = 1, ' query.', ' queries.'));
+        let body string := (select :subject || '\nAccount Locator: ' || :identifier || '\n\n' || :details || iff(:matches > 20, '\n... and ' || (:matches - 20) || ' more.', '') ||
+            iff(:earlier_suppressed > 0, '\n\n' || :earlier_suppressed || ' earlier notifications to this destination were suppressed by rate limits.', ''));
+        let result string := '';
+        if (tokens >= 1) then
             BEGIN
-                outcome2 := (select to_json(INTERNAL.NOTIFICATIONS(tools.templatejs(:body, :dict), tools.templatejs(:subject, :dict), 'email', :emails)));
+                result := (select to_json(INTERNAL.NOTIFICATIONS(:body, iff(:method = 'email', :subject, 'unused'), :method, :destination)));
             EXCEPTION
-                when EXPRESSION_ERROR THEN
-                    outcome2 := SQLERRM;
                 WHEN other THEN
-                    outcome2 := SQLERRM;
+                    result := SQLERRM;
             END;
-            outcome := (select :outcome || coalesce(:outcome2, ''));
+            destination_buckets := (select array_append(:destination_buckets, object_construct('bucket', :bucket, 'tokens', :tokens - 1, 'suppressed', 0, 'passed', true)));
+        else
+            result := 'Notification suppressed by rate limit.';
+            suppressed := suppressed + matches;
+            destination_buckets := (select array_append(:destination_buckets, object_construct('bucket', :bucket, 'tokens', :tokens, 'suppressed', :matches, 'passed', false)));
         end if;
+        notify_outcomes := (select object_insert(:notify_outcomes, :method || ':' || :destination, coalesce(:result, '')));
+    END FOR;
 
-        -- Send slack messages
-        let slackDests string := act.action_taken:SLACK;
-        IF (length(slackDests) > 1) THEN
-            let slackResult string := '';
-            let dict variant := OBJECT_CONSTRUCT('bt', CHAR(UNICODE('\u0060')), 'query_id', act.query_id, 'query_text', act.query_text, 'user_name', act.user_name, 'warehouse_name', act.warehouse_name, 'start_time', act.start_time, 'probe_name', act.probe_name, 'identifier', :identifier);
-            let message string := '
-Sundeck OpsCenter probe [{probe_name}] matched query.\n
-Query Id: {bt}{query_id}{bt}\n
-Query User: {user_name}\n
-Warehouse Name: {bt}{warehouse_name}{bt}\n
-Start Time: {bt}{start_time}{bt}\n
-Query Text: {bt}{bt}{bt}{query_text}{bt}{bt}{bt}\n
-Account Locator: {bt}{identifier}{bt}\n
-            ';
-           BEGIN
-               slackResult := (select to_json(INTERNAL.NOTIFICATIONS(tools.templatejs(:message, :dict), 'unused', 'slack', :slackDests)));
-           EXCEPTION
-           WHEN other THEN
-               slackResult := SQLERRM;
-           END;
-            outcome := (select :outcome || coalesce(:slackResult, ''));
-       END IF;
-
-       let name string := act.PROBE_NAME;
-       let action string := act.ACTION_TAKENS;
-       let query_id string := act.QUERY_ID;
-       insert into internal.probe_actions select CURRENT_TIMESTAMP(), :name, :query_id, parse_json(:action), :outcome;
-   END FOR;
+    -- Take the spent tokens from the buckets, and count what was suppressed since each bucket last let a notification through
+    MERGE INTO internal.probe_rate_limits b
+    USING (
+        SELECT 'probe:' || probe_name AS bucket, any_value(tokens) - count_if(allowed) AS tokens, count_if(not allowed) AS suppressed, count_if(allowed) > 0 AS passed
+        FROM INTERNAL.PROBE_RUN_NOTIFY
+        GROUP BY probe_name
+        UNION ALL
+        SELECT value:bucket::string, value:tokens::float, value:suppressed::number, value:passed::boolean
+        FROM TABLE(FLATTEN(input => :destination_buckets))
+    ) u ON b.bucket = u.bucket
+    WHEN MATCHED THEN UPDATE SET b.tokens = u.tokens, b.refilled_at = :notify_start, b.suppressed = iff(u.passed, u.suppressed, b.suppressed + u.suppressed)
+    WHEN NOT MATCHED THEN INSERT (bucket, tokens, refilled_at, suppressed) VALUES (u.bucket, u.tokens, :notify_start, u.suppressed);
+
+    let notify_ms number := (select datediff(millisecond, :notify_start, current_timestamp()));
+
+    -- Record every action of this run in one statement
+    INSERT INTO internal.probe_actions (action_time, probe_name, query_id, actions_taken, outcome, latency_ms)
+        WITH outcomes AS (
+            SELECT key, value::string AS outcome FROM TABLE(FLATTEN(input => :notify_outcomes))
+        ), notified AS (
+            SELECT m.probe_name, m.query_id, listagg(o.outcome, '') AS outcome
+            FROM INTERNAL.PROBE_RUN_MATCHES m, INTERNAL.PROBE_RUN_NOTIFY r, LATERAL FLATTEN(input => m.action_taken) d, LATERAL SPLIT_TO_TABLE(d.value::string, ',') s, outcomes o
+            WHERE d.key IN ('EMAIL', 'SLACK') AND o.key = lower(d.key) || ':' || trim(s.value)
+                AND r.probe_name = m.probe_name AND r.query_id = m.query_id AND r.allowed
+            GROUP BY m.probe_name, m.query_id
+        )
+        SELECT CURRENT_TIMESTAMP(), m.probe_name, m.query_id, m.action_taken,
+            iff(m.action_taken:CANCEL::boolean, coalesce(c.value::string, ''), '') || coalesce(n.outcome, '') ||
+                iff(r.allowed = false, 'Notification suppressed by rate limit.', ''),
+            datediff(millisecond, m.start_time, CURRENT_TIMESTAMP())
+        FROM INTERNAL.PROBE_RUN_MATCHES m
+        LEFT JOIN TABLE(FLATTEN(input => :cancel_outcomes)) c ON c.key = m.query_id
+        LEFT JOIN notified n ON n.probe_name = m.probe_name AND n.query_id = m.query_id
+        LEFT JOIN INTERNAL.PROBE_RUN_NOTIFY r ON r.probe_name = m.probe_name AND r.query_id = m.query_id;
+
+    INSERT INTO internal.probe_monitoring_runs (run_start, run_end, duration_ms, queries_scanned, matches, cancels, notifications,
+            evaluate_ms, cancel_ms, notify_ms, max_latency_ms, suppressed)
+        SELECT :run_start, current_timestamp(), datediff(millisecond, :run_start, current_timestamp()), :queries_scanned,
+            (SELECT count(*) FROM INTERNAL.PROBE_RUN_MATCHES), array_size(object_keys(:cancel_outcomes)),
+            (SELECT count_if(value:passed::boolean) FROM TABLE(FLATTEN(input => :destination_buckets))),
+            :evaluate_ms, :cancel_ms, :notify_ms, (SELECT datediff(millisecond, min(start_time), current_timestamp()) FROM INTERNAL.PROBE_RUN_MATCHES), :suppressed;
+    DROP TABLE INTERNAL.PROBE_RUN_NOTIFY;
+    DROP TABLE INTERNAL.PROBE_RUN_MATCHES;
+   CALL INTERNAL.SET_CONFIG('PROBE_MONITORING_WATERMARK', to_varchar(:run_start, 'YYYY-MM-DD"T"HH24:MI:SS.FF3TZH:TZM'));
 EXCEPTION
    WHEN OTHER THEN
        SYSTEM$LOG_ERROR(OBJECT_CONSTRUCT('error', 'Unhandled exception occurred during probe monitoring.', 'SQLCODE', :sqlcode, 'SQLERRM', :sqlerrm, 'SQLSTATE', :sqlstate));
-       insert into internal.probe_actions select CURRENT_TIMESTAMP(), '', '', null::VARIANT, 'Caught unhandled exception: ' || :sqlerrm;
+       insert into internal.probe_actions (action_time, probe_name, query_id, actions_taken, outcome) select CURRENT_TIMESTAMP(), '', '', null::VARIANT, 'Caught unhandled exception: ' || :sqlerrm;
        RAISE;
 END;
 
@@ -542,6 +646,7 @@ grant MONITOR, OPERATE on all tasks in schema TASKS to APPLICATION ROLE ADMIN;
 -- enable tasks
 call ADMIN.UPDATE_PROBE_MONITOR_RUNNING();
 alter task TASKS.SFUSER_MAINTENANCE resume;
+alter task TASKS.PROBE_ACTIONS_MAINTENANCE resume;
 alter task TASKS.WAREHOUSE_EVENTS_MAINTENANCE resume;
 alter task TASKS.SIMPLE_DATA_EVENTS_MAINTENANCE resume;
 alter task TASKS.QUERY_HISTORY_MAINTENANCE resume;
@@ -568,6 +673,12 @@ call internal.maybe_set_config('compute_credit_cost', '2.0');
 call internal.maybe_set_config('serverless_credit_cost', '3.0');
 call internal.maybe_set_config('storage_cost', '40.0');
 call internal.maybe_set_config('default_timezone', 'America/Los_Angeles');
+call internal.maybe_set_config('query_monitor_retention_days', '30');
+call internal.maybe_set_config('query_monitor_probe_burst', '20');
+call internal.maybe_set_config('query_monitor_probe_rate', '5');
+call internal.maybe_set_config('query_monitor_destination_burst', '5');
+call internal.maybe_set_config('query_monitor_destination_rate', '0.5');
+call internal.maybe_set_config('warehouse_state_reconcile_minutes', '60');
 
 -- Determine if the account has warehouse autoscaling and cache it in the config
 let has_autoscaling boolean;
@@ -15,6 +15,9 @@ call INTERNAL.ENABLE_QUERY_HASH();
 -- Migrate warehouse schedules table
 call INTERNAL.MIGRATE_WHSCHED_TABLE();
 
+-- Build the warehouse schedule timeline for schedules created before it existed
+call INTERNAL.REBUILD_WAREHOUSE_SCHEDULE_TIMELINE(NULL);
+
 -- Populate the list of predefined labels
 call INTERNAL.POPULATE_PREDEFINED_LABELS();
 
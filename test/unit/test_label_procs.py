@@ -5,6 +5,7 @@ from common_utils import generate_unique_name
 from common_utils import run_proc
 from common_utils import row_count
 from common_utils import run_sql
+import json
 import time
 
 
@@ -626,3 +627,30 @@ def test_merge_predefined_labels(conn, timestamp_string):
     assert (
         row_count(conn, sql) == 0
     ), "Labels created by merge_predefined_labels should all be enabled"
+
+
+def test_apply_labels(conn, timestamp_string):
+    name1 = generate_unique_name("label", timestamp_string)
+    name2 = generate_unique_name("label", timestamp_string) + "_2"
+    ops = [
+        dict(action="create", entity=dict(name=name1, condition="rows_produced > 100")),
+        dict(action="create", entity=dict(name=name2, condition="rows_produced > 10")),
+        dict(action="create", entity=dict(name=name1, condition="rows_produced > 1")),
+        dict(action="delete", name=name2),
+    ]
+    sql = f"call ADMIN.APPLY_LABELS(parse_json('{json.dumps(ops)}')::array);"
+    outcomes = json.loads(run_sql(conn, sql))
+    assert outcomes[0] is None and outcomes[1] is None and outcomes[3] is None
+    assert "already exists" in outcomes[2], "Duplicate label should be reported"
+
+    sql = f"select count(*) from INTERNAL.labels where name in ('{name1}', '{name2}')"
+    assert row_count(conn, sql) == 1, "Only the first label should remain"
+
+    sql = f"""select count(*) from INFORMATION_SCHEMA.COLUMNS where TABLE_SCHEMA = 'REPORTING' and
+                TABLE_NAME = 'LABELED_QUERY_HISTORY' and COLUMN_NAME = '{name1}'"""
+    assert (
+        row_count(conn, sql) == 1
+    ), "The view should have been regenerated after the batch"
+
+    sql = f"call ADMIN.DELETE_LABEL('{name1}');"
+    assert run_proc(conn, sql) is None, "ADMIN.DELETE_LABEL did not return NULL value!"
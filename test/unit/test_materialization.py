@@ -237,6 +237,9 @@ def test_materialization_status_structure(conn):
 
         ignored_views = [
             "QUERY_MONITOR_ACTIVITY",
+            "QUERY_MONITOR_ACTIVITY_DAILY",
+            "QUERY_MONITOR_LATENCY",
+            "QUERY_MONITOR_RUN_METRICS",
             "QUOTA_TASK_HISTORY",
             "SUNDECK_QUERY_HISTORY",
             "TASK_LOG_HISTORY",
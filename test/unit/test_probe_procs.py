@@ -147,3 +147,19 @@ def test_error_message(conn, timestamp_string, statement, expected_error):
     probe = generate_unique_name("probe", timestamp_string)
     sql = statement.format(probe=probe)
     assert expected_error.lower() in str(run_proc(conn, sql)).lower()
+
+
+def test_probe_select_is_recompiled(conn, timestamp_string):
+    probe = generate_unique_name("probe", timestamp_string)
+    sql = f"CALL ADMIN.CREATE_QUERY_MONITOR('{probe}', 'rows_produced > 100', True, 'SLACK', 'jinfeng@sundeck.io', 'SLACK', False);"
+    assert run_proc(conn, sql) is None
+
+    # Creating the probe compiled a statement which matches it
+    sql = f"select count(*) from INTERNAL.PROBE_SELECT where contains(statement, '{probe}')"
+    assert row_count(conn, sql) == 1, "Probe statement was not recompiled on create"
+
+    sql = f"call ADMIN.DELETE_QUERY_MONITOR('{probe}');"
+    assert run_proc(conn, sql) is None
+
+    sql = f"select count(*) from INTERNAL.PROBE_SELECT where contains(statement, '{probe}')"
+    assert row_count(conn, sql) == 0, "Probe statement was not recompiled on delete"
@@ -47,6 +47,10 @@ def _ensure_tables_created(conn):
     """
     with conn.cursor() as cur:
         _ = cur.execute("truncate table internal.WH_SCHEDULES").fetchone()
+        _ = cur.execute(
+            "truncate table internal.WAREHOUSE_SCHEDULE_TIMELINE"
+        ).fetchone()
+        _ = cur.execute("truncate table internal.WAREHOUSE_APPLIED_STATE").fetchone()
 
 
 def _update_warehouse_schedules_sql(last_run: str, now: str) -> str:
@@ -105,6 +109,18 @@ def test_basic_warehouse_schedule(conn, timestamp_string):
             assert len(obj["statements"]) == 1
             assert "WAREHOUSE_SIZE = SMALL" in obj["statements"][0]
 
+            # The warehouse already has the settings of the schedule, it should not be altered again
+            row = cur.execute(
+                _update_warehouse_schedules_sql(
+                    "2023-10-02 11:45:00", "2023-10-02 12:00:00"
+                )
+            ).fetchone()
+
+            obj = json.loads(row[0])
+            assert obj["num_candidates"] == 1
+            assert obj["warehouses_updated"] == 0
+            assert obj["warehouses_skipped"] == 1
+
             # Reset the schedule when we're done
             _ = cur.execute(
                 f"call ADMIN.RESET_WAREHOUSE_SCHEDULE('{wh_name}')"